@@ -0,0 +1,115 @@
+from contextlib import asynccontextmanager, nullcontext
+from heapq import heapify, heappop, heappush
+from typing import AsyncContextManager, AsyncIterator, Dict, List, Optional
+import asyncio
+import itertools
+import time
+
+# Requests with a lower priority value are admitted first
+SMALL = 0
+LARGE = 1
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request cannot be queued, or waited in the queue for too long. The server answers it with a 503.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits how many requests run against the database at once.
+
+    Requests over the limit wait in a bounded queue, smaller requests first, and are rejected once the queue is full
+    or they have waited max_queue_time seconds. A released slot is handed straight to the next waiter, so a waiting
+    request is never overtaken by one that arrives later with the same priority.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_queue_time: Optional[float] = None):
+        self.name = name
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self._active = 0
+        # (priority, arrival, future) of every waiting request
+        self._queue: List[list] = []
+        self._arrivals = itertools.count()
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_queue_time = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    @asynccontextmanager
+    async def admit(self, priority: int = LARGE) -> AsyncIterator[None]:
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int) -> None:
+        if self._active < self.max_concurrency and not self._queue:
+            self._active += 1
+            self.admitted += 1
+            return
+        if len(self._queue) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(f"Too many {self.name} requests queued", self.max_queue_time or 1.0)
+
+        start = time.monotonic()
+        entry = [priority, next(self._arrivals), asyncio.get_running_loop().create_future()]
+        heappush(self._queue, entry)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(entry[2], self.max_queue_time)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if entry[2].done() and not entry[2].cancelled():
+                # The slot was handed over as the wait ended, pass it on
+                self._release()
+            elif entry in self._queue:
+                self._queue.remove(entry)
+                heapify(self._queue)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_queue_time += 1
+                raise AdmissionRejected(f"Timed out waiting for a {self.name} slot", self.max_queue_time or 1.0)
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            self.queue_time_total += elapsed
+            self.queue_time_max = max(self.queue_time_max, elapsed)
+        self.admitted += 1
+
+    def _release(self) -> None:
+        while self._queue:
+            _, _, future = heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": len(self._queue),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_queue_time": self.rejected_queue_time,
+            "queue_time_total": self.queue_time_total,
+            "queue_time_max": self.queue_time_max
+        }
+
+
+def admit(controller: Optional[AdmissionController], priority: int = LARGE) -> AsyncContextManager:
+    if controller is None:
+        return nullcontext()
+    return controller.admit(priority)
@@ -0,0 +1,80 @@
+"""
+Insert many Track rows through insert_Track_many into a scratch copy of chinook.sqlite, comparing one statement for
+the whole list against chunks sized from the bound parameter limit.
+
+    python benchmarks/bulk_insert.py [--rows 100000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import RootConnector
+from models import Configuration, MutationRequest
+
+
+def track_objects(rows: int) -> list:
+    return [{
+        "Name": f"Bulk Track {i}",
+        "AlbumId": 1 + i % 347,
+        "MediaTypeId": 1 + i % 5,
+        "GenreId": 1 + i % 25,
+        "Composer": None,
+        "Milliseconds": 200000 + i,
+        "Bytes": 5000000 + i,
+        "UnitPrice": 0.99
+    } for i in range(rows)]
+
+
+async def run_insert(path: str, rows: int, max_parameters: int, max_rows: int) -> dict:
+    with open(os.path.join(ROOT, "config.json")) as f:
+        raw = json.load(f)
+    raw["credentials"]["url"] = f"file:{path}"
+    raw["mutations"] = {"max_parameters": max_parameters, "max_rows_per_statement": max_rows}
+    connector = RootConnector()
+    configuration = Configuration(**raw)
+    state = await connector.try_init_state(configuration, {})
+    request = MutationRequest(operations=[{
+        "type": "procedure",
+        "name": "insert_Track_many",
+        "arguments": {"objects": track_objects(rows)}
+    }], collection_relationships={})
+
+    result = {"max_parameters": max_parameters, "max_rows_per_statement": max_rows, "rows": rows}
+    start = time.perf_counter()
+    try:
+        await connector.mutation(configuration, state, request)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        result["rows_per_second"] = round(rows / result["seconds"])
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    settings = [
+        (10 ** 9, 10 ** 9),  # Everything in one statement, as before chunking
+        (999, 500),
+        (32766, 500),
+        (32766, 4096),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        for max_parameters, max_rows in settings:
+            path = os.path.join(directory, "chinook.sqlite")
+            shutil.copy(os.path.join(ROOT, "chinook.sqlite"), path)
+            print(json.dumps(await run_insert(path, args.rows, max_parameters, max_rows)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
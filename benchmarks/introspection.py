@@ -0,0 +1,86 @@
+"""
+Time table introspection against a generated many-table database: one table at a time (the previous behaviour),
+per-table with bounded concurrency (the fallback) and the batched set-based queries.
+
+    python benchmarks/introspection.py [--tables 800] [--latency-ms 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hasura_ndc  # noqa: F401 -- the SDK must be imported before the connector's models
+import libsql_client
+
+from benchmarks.latency import LatencyClient
+from utilities import introspect_table, introspect_tables, introspect_tables_batched
+
+
+def generate_database(path: str, tables: int) -> None:
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE t0 (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, score REAL)")
+    for i in range(1, tables):
+        db.execute(f"""
+CREATE TABLE t{i} (
+  id INTEGER PRIMARY KEY,
+  parent_id INTEGER REFERENCES t{i - 1}(id),
+  code TEXT NOT NULL UNIQUE,
+  label TEXT,
+  created DATETIME
+)""")
+    db.commit()
+    db.close()
+
+
+async def time_strategy(name: str, client, table_names, introspect) -> dict:
+    start = time.perf_counter()
+    result = await introspect(table_names, client)
+    elapsed = time.perf_counter() - start
+    return {"strategy": name, "tables": len(result), "seconds": round(elapsed, 4), "round_trips": client.round_trips}
+
+
+async def sequential(table_names, client):
+    return {table_name: await introspect_table(table_name, client) for table_name in table_names}
+
+
+async def concurrent(table_names, client):
+    semaphore = asyncio.Semaphore(8)
+
+    async def bounded(table_name):
+        async with semaphore:
+            return await introspect_table(table_name, client)
+    return dict(zip(table_names, await asyncio.gather(*[bounded(t) for t in table_names])))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=800)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Injected per round trip latency")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "many_tables.sqlite")
+        generate_database(path, args.tables)
+        table_names = [f"t{i}" for i in range(args.tables)]
+
+        def client():
+            return LatencyClient(libsql_client.create_client(f"file:{path}"), args.latency_ms / 1000)
+
+        batched = await introspect_tables_batched(table_names, client())
+        assert batched == await sequential(table_names, client()), "Batched introspection disagrees"
+
+        for name, introspect in (("sequential", sequential),
+                                 ("concurrent", concurrent),
+                                 ("batched", introspect_tables)):
+            print(json.dumps(await time_strategy(name, client(), table_names, introspect)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
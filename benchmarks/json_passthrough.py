@@ -0,0 +1,100 @@
+"""
+Compare decoding query results into Python objects against splicing SQLite's JSON straight into the response body.
+
+The decoded path reproduces what the server does with a returned QueryResponse: validate it against the response
+model, make it JSON-able and serialize it again.
+
+    python benchmarks/json_passthrough.py [--iterations 20] [--limit 3503]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from main import RootConnector
+from models import QueryRequest, QueryResponse
+
+
+def track_request(limit: int) -> QueryRequest:
+    fields = ["TrackId", "Name", "AlbumId", "MediaTypeId", "GenreId", "Composer", "Milliseconds", "Bytes", "UnitPrice"]
+    return QueryRequest(**{
+        "collection": "Track",
+        "arguments": {},
+        "collection_relationships": {},
+        "query": {
+            "fields": {f: {"type": "column", "column": f} for f in fields},
+            "limit": limit
+        }
+    })
+
+
+async def measure(connector, configuration, state, request, passthrough: bool, iterations: int):
+    configuration.json_passthrough = passthrough
+    adapter = TypeAdapter(QueryResponse)
+    timings = []
+    peak = 0
+    size = 0
+    # The last iteration runs under tracemalloc to capture peak memory, it is too slow to time
+    for i in range(iterations + 1):
+        traced = i == iterations
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        response = await connector.query(configuration, state, request)
+        if passthrough:
+            body = response.body
+        else:
+            body = json.dumps(jsonable_encoder(adapter.validate_python(response))).encode()
+        elapsed = time.perf_counter() - start
+        size = len(body)
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            timings.append(elapsed)
+    timings.sort()
+    return {
+        "mode": "passthrough" if passthrough else "decoded",
+        "iterations": iterations,
+        "bytes": size,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "min_ms": timings[0] * 1000,
+        "peak_memory_kb": peak / 1024
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configuration", default="config.json")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=3503)
+    args = parser.parse_args()
+
+    connector = RootConnector()
+    configuration = await connector.parse_configuration(args.configuration)
+    state = await connector.try_init_state(configuration, {})
+    request = track_request(args.limit)
+
+    results = [
+        await measure(connector, configuration, state, request, False, args.iterations),
+        await measure(connector, configuration, state, request, True, args.iterations)
+    ]
+    for result in results:
+        print(json.dumps(result))
+    decoded, passthrough = results
+    print(f"speedup: {decoded['p50_ms'] / passthrough['p50_ms']:.2f}x, "
+          f"peak memory: {decoded['peak_memory_kb'] / passthrough['peak_memory_kb']:.2f}x lower")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
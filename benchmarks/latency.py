@@ -0,0 +1,35 @@
+from typing import List
+import asyncio
+
+from libsql_client import Client, InArgs, InStatement, ResultSet, Transaction
+
+
+class LatencyClient(Client):
+    """
+    A local stand-in for a remote database: wraps a client and adds a fixed delay to every round trip.
+    """
+
+    def __init__(self, client: Client, latency: float):
+        self.client = client
+        self.latency = latency
+        self.round_trips = 0
+
+    async def execute(self, stmt: InStatement, args: InArgs = None) -> ResultSet:
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+        return await self.client.execute(stmt, args)
+
+    async def batch(self, stmts: List[InStatement]) -> List[ResultSet]:
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+        return await self.client.batch(stmts)
+
+    def transaction(self) -> Transaction:
+        return self.client.transaction()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.client.closed
@@ -0,0 +1,94 @@
+"""
+Compare the two relationship strategies on the Artist -> Albums -> Tracks shape of http_requests/query.http: a
+correlated subquery per parent row, built into nested JSON by SQLite, against one statement per relationship level
+stitched together in Python.
+
+    python benchmarks/relationships.py [--limits 10 100 275] [--iterations 20] [--latency-ms 0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import libsql_client
+
+from benchmarks.latency import LatencyClient
+from main import RootConnector
+from models import QueryRequest, State
+from plan_cache import PlanCache
+from pool import ClientPool
+
+
+def query_http_shape(limit: int) -> QueryRequest:
+    with open(os.path.join(ROOT, "http_requests", "query.http")) as f:
+        shape = json.loads(f.read().split("\n\n", 1)[1])
+    shape["query"]["limit"] = limit
+    return QueryRequest(**shape)
+
+
+async def measure(connector, configuration, state, clients, request, strategy: str, iterations: int):
+    configuration.relationship_strategy = strategy
+    round_trips = 0
+    timings = []
+    body = b""
+    for _ in range(iterations):
+        before = sum(client.round_trips for client in clients)
+        start = time.perf_counter()
+        body = (await connector.query(configuration, state, request)).body
+        timings.append(time.perf_counter() - start)
+        round_trips = sum(client.round_trips for client in clients) - before
+    timings.sort()
+    return body, {
+        "strategy": strategy,
+        "limit": request.query.limit,
+        "bytes": len(body),
+        "round_trips": round_trips,
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "min_ms": round(timings[0] * 1000, 3)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configuration", default="config.json")
+    parser.add_argument("--limits", type=int, nargs="+", default=[10, 100, 275])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Injected per round trip latency")
+    args = parser.parse_args()
+
+    connector = RootConnector()
+    configuration = await connector.parse_configuration(args.configuration)
+    clients = []
+
+    def factory():
+        clients.append(LatencyClient(libsql_client.create_client(configuration.credentials.url),
+                                     args.latency_ms / 1000))
+        return clients[-1]
+
+    read_pool = ClientPool("read", factory, max_size=1)
+    await read_pool.start()
+    state = State(read_pool=read_pool,
+                  write_pool=read_pool,
+                  plan_cache=PlanCache(max_size=configuration.plan_cache.max_size))
+
+    for limit in args.limits:
+        request = query_http_shape(limit)
+        (subquery_body, subquery), (batched_body, batched) = [
+            await measure(connector, configuration, state, clients, request, strategy, args.iterations)
+            for strategy in ("subquery", "batched")
+        ]
+        assert json.loads(subquery_body) == json.loads(batched_body), "The strategies disagree"
+        print(json.dumps(subquery))
+        print(json.dumps(batched))
+        print(f"limit {limit}: batched is {subquery['p50_ms'] / batched['p50_ms']:.2f}x the speed of subquery")
+    await read_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,551 @@
+"""
+Benchmark the connector end to end against chinook.sqlite and a scaled-up synthetic copy of it, in-process through
+RootConnector and over HTTP through the server.
+
+    python benchmarks/suite.py [--databases chinook synthetic] [--transports in_process http] [--scenarios ...]
+                               [--requests 200] [--concurrency 1 8] [--latency-ms 0] [--output results.json]
+                               [--baseline previous.json]
+
+Every scenario reports throughput and p50/p95/p99 latency. In-process runs also report the exact p50/p95/p99 of each
+stage (planning, database execution, decoding and response size). HTTP runs estimate them from the server's /metrics
+histograms. Scenarios that write run against a scratch copy of the database, so every run starts from the same data.
+The synthetic database is generated deterministically once per size and kept in --data-dir.
+
+--latency-ms adds a delay to every database round trip, a local stand-in for a remote Turso database. --output writes
+the results with the commit they were measured at, and --baseline compares them against an earlier output.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import aiohttp
+
+from benchmarks.latency import LatencyClient
+from benchmarks.relationships import query_http_shape
+from main import RootConnector
+from metrics import PREFIX, Histogram
+from models import Configuration, MutationRequest, QueryRequest
+from pool import ClientPool
+
+STAGES = ("plan_seconds", "execute_seconds", "decode_seconds", "response_bytes")
+QUANTILES = (0.5, 0.95, 0.99)
+TRACK_FIELDS = ["TrackId", "Name", "AlbumId", "MediaTypeId", "GenreId", "Composer", "Milliseconds", "Bytes", "UnitPrice"]
+ALBUMS = 347
+
+# A scenario builds the request of its i-th call: the kind of request and its body
+Scenario = Callable[[int], Tuple[str, Any]]
+
+
+def column(name: str) -> dict:
+    return {"type": "column", "column": name}
+
+
+def comparison(name: str, operator: str, value: dict) -> dict:
+    return {"type": "binary_comparison_operator", "column": {"type": "column", "name": name, "path": []},
+            "operator": operator, "value": value}
+
+
+def schema_scenario(i: int) -> Tuple[str, Any]:
+    return "schema", None
+
+
+def flat_scan(i: int) -> Tuple[str, Any]:
+    return "query", {
+        "collection": "Track",
+        "arguments": {},
+        "collection_relationships": {},
+        "query": {"fields": {f: column(f) for f in TRACK_FIELDS}, "limit": 5000}
+    }
+
+
+def filtered_lookup(i: int) -> Tuple[str, Any]:
+    return "query", {
+        "collection": "Track",
+        "arguments": {},
+        "collection_relationships": {},
+        "query": {
+            "fields": {"TrackId": column("TrackId"), "Name": column("Name"), "Milliseconds": column("Milliseconds")},
+            "predicate": {"type": "and", "expressions": [
+                comparison("AlbumId", "_eq", {"type": "scalar", "value": 1 + i % ALBUMS}),
+                comparison("Milliseconds", "_gt", {"type": "scalar", "value": 200000})
+            ]},
+            "order_by": {"elements": [{"order_direction": "asc", "target": {"type": "column", "name": "TrackId",
+                                                                           "column": None, "function": None,
+                                                                           "path": []}}]},
+            "limit": 50
+        }
+    }
+
+
+def nested_relationships(i: int) -> Tuple[str, Any]:
+    # Artist -> Albums -> Tracks, the shape of http_requests/query.http
+    return "query", json.loads(query_http_shape(25).model_dump_json(exclude_none=True))
+
+
+def variables_foreach(i: int) -> Tuple[str, Any]:
+    return "query", {
+        "collection": "Track",
+        "arguments": {},
+        "collection_relationships": {},
+        "variables": {str(v): {"AlbumId": 1 + (i + v) % ALBUMS} for v in range(20)},
+        "query": {
+            "fields": {"TrackId": column("TrackId"), "Name": column("Name")},
+            "predicate": comparison("AlbumId", "_eq", {"type": "variable", "name": "AlbumId"})
+        }
+    }
+
+
+def bulk_insert(i: int) -> Tuple[str, Any]:
+    return "mutation", {
+        "collection_relationships": {},
+        "operations": [{
+            "type": "procedure",
+            "name": "insert_Track_many",
+            "arguments": {"objects": [{
+                "Name": f"Benchmark Track {i}.{r}",
+                "AlbumId": 1 + r % ALBUMS,
+                "MediaTypeId": 1 + r % 5,
+                "GenreId": 1 + r % 25,
+                "Composer": None,
+                "Milliseconds": 200000 + r,
+                "Bytes": 5000000 + r,
+                "UnitPrice": 0.99
+            } for r in range(1000)]}
+        }]
+    }
+
+
+def update_by_pk(i: int) -> Tuple[str, Any]:
+    return "mutation", {
+        "collection_relationships": {},
+        "operations": [{
+            "type": "procedure",
+            "name": "update_Track_by_pk",
+            "arguments": {"pk_columns": {"TrackId": 1 + i % 3503}, "_set": {"Name": f"Benchmark Update {i}"}},
+            "fields": {"type": "object", "fields": {"TrackId": column("TrackId"), "Name": column("Name")}}
+        }]
+    }
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "schema": schema_scenario,
+    "flat_scan": flat_scan,
+    "filtered_lookup": filtered_lookup,
+    "nested_relationships": nested_relationships,
+    "variables_foreach": variables_foreach,
+    "bulk_insert": bulk_insert,
+    "update_by_pk": update_by_pk
+}
+
+
+def generate_synthetic(path: str, tracks: int, invoice_lines: int) -> None:
+    """
+    Copy chinook.sqlite and grow Track and InvoiceLine to the given sizes. Rows are derived from their position only,
+    so every generated copy is identical.
+    """
+    print(f"Generating {path} with {tracks} tracks and {invoice_lines} invoice lines", file=sys.stderr)
+    partial = path + ".partial"
+    shutil.copy(os.path.join(ROOT, "chinook.sqlite"), partial)
+    db = sqlite3.connect(partial)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    existing_tracks = db.execute("SELECT COUNT(*) FROM Track").fetchone()[0]
+    existing_lines = db.execute("SELECT COUNT(*) FROM InvoiceLine").fetchone()[0]
+    db.execute("""
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+INSERT INTO Track (Name, AlbumId, MediaTypeId, GenreId, Composer, Milliseconds, Bytes, UnitPrice)
+SELECT 'Synthetic Track ' || i, 1 + i % 347, 1 + i % 5, 1 + i % 25,
+       CASE WHEN i % 3 = 0 THEN NULL ELSE 'Composer ' || (i % 997) END,
+       120000 + i * 7919 % 300000, 2000000 + i * 104729 % 10000000, CASE WHEN i % 10 = 0 THEN 1.99 ELSE 0.99 END
+FROM n
+""", [max(tracks - existing_tracks, 0)])
+    db.execute("""
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+INSERT INTO InvoiceLine (InvoiceId, TrackId, UnitPrice, Quantity)
+SELECT 1 + i % 412, 1 + i * 7919 % ?, 0.99, 1 + i % 3
+FROM n
+""", [max(invoice_lines - existing_lines, 0), tracks])
+    db.commit()
+    db.close()
+    os.replace(partial, path)
+
+
+def database_path(name: str, data_dir: str, tracks: int, invoice_lines: int) -> str:
+    if name == "chinook":
+        return os.path.join(ROOT, "chinook.sqlite")
+    path = os.path.join(data_dir, f"chinook_synthetic_{tracks}_{invoice_lines}.sqlite")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        generate_synthetic(path, tracks, invoice_lines)
+    return path
+
+
+def write_configuration(directory: str, database: str) -> str:
+    with open(os.path.join(ROOT, "config.json")) as f:
+        raw = json.load(f)
+    raw["credentials"]["url"] = f"file:{database}"
+    path = os.path.join(directory, "config.json")
+    with open(path, "w") as f:
+        json.dump(raw, f)
+    return path
+
+
+class LatencyConnector(RootConnector):
+    """
+    The connector with every database round trip delayed by latency seconds.
+    """
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    async def try_init_state(self, configuration: Configuration, metrics: Any):
+        state = await super().try_init_state(configuration, metrics)
+        if self.latency <= 0:
+            return state
+        for name in ("read_pool", "write_pool"):
+            pool = getattr(state, name)
+            await pool.close()
+            delayed = ClientPool(pool.name,
+                                 lambda factory=pool.factory: LatencyClient(factory(), self.latency),
+                                 min_size=pool.min_size,
+                                 max_size=pool.max_size,
+                                 idle_timeout=pool.idle_timeout,
+                                 health_check_interval=pool.health_check_interval,
+                                 acquire_timeout=pool.acquire_timeout)
+            await delayed.start()
+            setattr(state, name, delayed)
+        return state
+
+
+class SampledHistogram(Histogram):
+    """
+    A histogram that also keeps every observation, for exact quantiles.
+    """
+
+    def __init__(self, histogram: Histogram):
+        super().__init__(histogram.name[len(PREFIX) + 1:], histogram.description, histogram.buckets)
+        self.samples: List[float] = []
+
+    def observe(self, labels, value: float) -> None:
+        super().observe(labels, value)
+        self.samples.append(value)
+
+
+def quantiles(samples: List[float], scale: float = 1.0) -> Dict[str, float]:
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    result = {f"p{round(q * 100)}": round(samples[min(int(q * len(samples)), len(samples) - 1)] * scale, 3)
+              for q in QUANTILES}
+    result["mean"] = round(sum(samples) / len(samples) * scale, 3)
+    return result
+
+
+def stage_summary(stage: str, summary: Dict[str, float]) -> Tuple[str, Dict[str, float]]:
+    # Times are reported in milliseconds, sizes in bytes
+    if stage.endswith("_seconds"):
+        return stage[:-len("_seconds")] + "_ms", summary
+    return stage, summary
+
+
+def parse_histograms(text: str) -> Dict[str, Dict[float, float]]:
+    """
+    The cumulative bucket counts of each stage in Prometheus text, summed over every label set.
+    """
+    histograms: Dict[str, Dict[float, float]] = {}
+    for line in text.splitlines():
+        for stage in STAGES:
+            prefix = f"{PREFIX}_{stage}_bucket{{"
+            if line.startswith(prefix):
+                labels, value = line[len(prefix):].rsplit("} ", 1)
+                le = labels.rsplit('le="', 1)[1].rstrip('"')
+                bound = float("inf") if le == "+Inf" else float(le)
+                buckets = histograms.setdefault(stage, {})
+                buckets[bound] = buckets.get(bound, 0) + float(value)
+    return histograms
+
+
+def bucket_quantiles(before: Dict[float, float], after: Dict[float, float], scale: float) -> Dict[str, float]:
+    """
+    Estimate quantiles from the difference of two cumulative bucket snapshots, interpolating within the bucket like
+    Prometheus' histogram_quantile does.
+    """
+    bounds = sorted(after)
+    counts = [after[b] - before.get(b, 0) for b in bounds]
+    total = counts[-1] if counts else 0
+    if not total:
+        return {}
+    result = {}
+    for q in QUANTILES:
+        rank = q * total
+        lower_bound, lower_count = 0.0, 0.0
+        for bound, count in zip(bounds, counts):
+            if count >= rank:
+                if bound == float("inf"):
+                    estimate = lower_bound
+                else:
+                    estimate = lower_bound + (bound - lower_bound) * (rank - lower_count) / max(count - lower_count, 1)
+                result[f"p{round(q * 100)}"] = round(estimate * scale, 3)
+                break
+            lower_bound, lower_count = bound, count
+    return result
+
+
+async def drive(call: Callable[[int], Any], requests: int, concurrency: int) -> Tuple[List[float], int, float]:
+    """
+    Issue the calls from concurrency workers. Returns the latency of each call, the number of failed calls and the
+    wall time.
+    """
+    latencies = []
+    errors = 0
+    next_call = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_call:
+            start = time.perf_counter()
+            try:
+                await call(i)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"First error: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+def result_record(database: str, transport: str, scenario: str, concurrency: int, latency_ms: float,
+                  latencies: List[float], errors: int, wall: float, stages: Dict[str, Dict[str, float]],
+                  stage_quantiles: str) -> dict:
+    return {
+        "database": database,
+        "transport": transport,
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "injected_latency_ms": latency_ms,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": quantiles(latencies, 1000),
+        "stages": stages,
+        # exact, or estimated from the server's histogram buckets
+        "stage_quantiles": stage_quantiles
+    }
+
+
+async def run_in_process(configuration_path: str, scenarios: List[str], args) -> List[dict]:
+    connector = LatencyConnector(args.latency_ms / 1000)
+    configuration = await connector.parse_configuration(configuration_path)
+    state = await connector.try_init_state(configuration, {})
+    sampled = {stage: SampledHistogram(getattr(state.metrics, stage)) for stage in STAGES}
+    for stage, histogram in sampled.items():
+        setattr(state.metrics, stage, histogram)
+
+    async def call(kind: str, body: Any):
+        if kind == "schema":
+            return await connector.get_schema(configuration)
+        if kind == "query":
+            return await connector.query(configuration, state, QueryRequest(**body))
+        return await connector.mutation(configuration, state, MutationRequest(**body))
+
+    results = []
+    try:
+        for scenario in scenarios:
+            build = SCENARIOS[scenario]
+            for concurrency in args.concurrency:
+                await drive(lambda i: call(*build(i)), args.warmup, 1)
+                for histogram in sampled.values():
+                    histogram.samples.clear()
+                latencies, errors, wall = await drive(lambda i: call(*build(i)), args.requests, concurrency)
+                stages = dict(stage_summary(stage, quantiles(histogram.samples,
+                                                             1000 if stage.endswith("_seconds") else 1))
+                              for stage, histogram in sampled.items() if histogram.samples)
+                results.append(result_record(args.database_name, "in_process", scenario, concurrency,
+                                             args.latency_ms, latencies, errors, wall, stages, "exact"))
+                print(json.dumps(results[-1]))
+    finally:
+        await state.read_pool.close()
+        await state.write_pool.close()
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_server(session: aiohttp.ClientSession, url: str, process: subprocess.Popen, log: str) -> None:
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited during startup, see {log}")
+        try:
+            async with session.get(f"{url}/capabilities") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("The server did not start")
+
+
+async def run_http(configuration_path: str, scenarios: List[str], args) -> List[dict]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    log = os.path.join(os.path.dirname(configuration_path), "server.log")
+    with open(log, "w") as output:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", configuration_path,
+                                    "--port", str(port), "--latency-ms", str(args.latency_ms)],
+                                   stdout=output, stderr=subprocess.STDOUT)
+    results = []
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max(args.concurrency))) as session:
+            await wait_for_server(session, url, process, log)
+
+            async def call(kind: str, body: Any):
+                if kind == "schema":
+                    request = session.get(f"{url}/schema")
+                else:
+                    request = session.post(f"{url}/{kind}", json=body)
+                async with request as response:
+                    await response.read()
+                    if response.status != 200:
+                        raise RuntimeError(f"{kind} returned {response.status}")
+
+            async def histograms() -> Dict[str, Dict[float, float]]:
+                async with session.get(f"{url}/metrics") as response:
+                    return parse_histograms(await response.text())
+
+            for scenario in scenarios:
+                build = SCENARIOS[scenario]
+                for concurrency in args.concurrency:
+                    await drive(lambda i: call(*build(i)), args.warmup, 1)
+                    before = await histograms()
+                    latencies, errors, wall = await drive(lambda i: call(*build(i)), args.requests, concurrency)
+                    after = await histograms()
+                    stages = dict(stage_summary(stage, bucket_quantiles(before.get(stage, {}), buckets,
+                                                                        1000 if stage.endswith("_seconds") else 1))
+                                  for stage, buckets in after.items())
+                    results.append(result_record(args.database_name, "http", scenario, concurrency,
+                                                 args.latency_ms, latencies, errors, wall, stages, "histogram"))
+                    print(json.dumps(results[-1]))
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def serve(configuration_path: str, port: int, latency_ms: float) -> None:
+    from hasura_ndc.server import ServerOptions, start_server
+    options = ServerOptions(configuration=configuration_path, port=port, service_token_secret="", log_level="warning",
+                            pretty_print_logs="")
+    asyncio.run(start_server(LatencyConnector(latency_ms / 1000), options))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(result: dict) -> tuple:
+        return (result["database"], result["transport"], result["scenario"], result["concurrency"],
+                result["injected_latency_ms"])
+
+    previous = {key(result): result for result in baseline["results"]}
+    print(f"Compared with {baseline.get('commit')}: p50, p99 and throughput ratios, below 1 is faster",
+          file=sys.stderr)
+    for result in results:
+        old = previous.get(key(result))
+        if not old or not old["latency_ms"] or not result["latency_ms"]:
+            continue
+        print(json.dumps({
+            "database": result["database"],
+            "transport": result["transport"],
+            "scenario": result["scenario"],
+            "concurrency": result["concurrency"],
+            "p50_ratio": round(result["latency_ms"]["p50"] / old["latency_ms"]["p50"], 3),
+            "p99_ratio": round(result["latency_ms"]["p99"] / old["latency_ms"]["p99"], 3),
+            "throughput_ratio": round(old["throughput_rps"] / result["throughput_rps"], 3)
+        }), file=sys.stderr)
+
+
+async def run_benchmarks(args) -> None:
+    results = []
+    for database in args.databases:
+        source = database_path(database, args.data_dir, args.tracks, args.invoice_lines)
+        args.database_name = database
+        for transport in args.transports:
+            # A scratch copy per run, so the writing scenarios never change the source and every run starts the same
+            with tempfile.TemporaryDirectory() as directory:
+                scratch = os.path.join(directory, "benchmark.sqlite")
+                shutil.copy(source, scratch)
+                configuration_path = write_configuration(directory, scratch)
+                run = run_in_process if transport == "in_process" else run_http
+                results.extend(await run(configuration_path, args.scenarios, args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "arguments": {k: v for k, v in vars(args).items() if k not in ("serve", "port", "database_name")},
+                "results": results
+            }, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--databases", nargs="+", choices=["chinook", "synthetic"], default=["chinook", "synthetic"])
+    parser.add_argument("--transports", nargs="+", choices=["in_process", "http"], default=["in_process", "http"])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Injected per round trip latency")
+    parser.add_argument("--tracks", type=int, default=2000000, help="Track rows in the synthetic database")
+    parser.add_argument("--invoice-lines", type=int, default=2000000,
+                        help="InvoiceLine rows in the synthetic database")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "ndc-turso-benchmarks"))
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Compare against the JSON results of an earlier run")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.latency_ms)
+    else:
+        asyncio.run(run_benchmarks(args))
+
+
+if __name__ == "__main__":
+    main()
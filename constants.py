@@ -1,6 +1,9 @@
 from hasura_ndc.models import ScalarType
 
 MAX_32_INT = 2147483647
+# Keyset pagination: the field every collection exposes with a row's cursor, and the argument it is passed back in
+CURSOR_FIELD = "_cursor"
+CURSOR_ARGUMENT = "cursor"
 SCALAR_TYPES = {
     "Int": ScalarType(**{
         "aggregate_functions": {
@@ -9,6 +12,24 @@ SCALAR_TYPES = {
                     "type": "named",
                     "name": "Int"
                 }
+            },
+            "avg": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Float"
+                }
+            },
+            "min": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Int"
+                }
+            },
+            "max": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Int"
+                }
             }
         },
         "comparison_operators": {
@@ -54,12 +75,30 @@ SCALAR_TYPES = {
     }),
     "Float": ScalarType(**{
         "aggregate_functions": {
-            # "sum": {
-            #     "result_type": {
-            #         "type": "named",
-            #         "name": "Float"
-            #     }
-            # }
+            "sum": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Float"
+                }
+            },
+            "avg": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Float"
+                }
+            },
+            "min": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Float"
+                }
+            },
+            "max": {
+                "result_type": {
+                    "type": "named",
+                    "name": "Float"
+                }
+            }
         },
         "comparison_operators": {
             "_eq": {
@@ -103,7 +142,20 @@ SCALAR_TYPES = {
         }
     }),
     "String": ScalarType(**{
-        "aggregate_functions": {},
+        "aggregate_functions": {
+            "min": {
+                "result_type": {
+                    "type": "named",
+                    "name": "String"
+                }
+            },
+            "max": {
+                "result_type": {
+                    "type": "named",
+                    "name": "String"
+                }
+            }
+        },
         "comparison_operators": {
             "_eq": {
                 "type": "equal"
@@ -6,11 +6,42 @@ except ImportError:
     from ..models import Configuration
 
 try:
-    from constants import SCALAR_TYPES
+    from constants import SCALAR_TYPES, CURSOR_FIELD, CURSOR_ARGUMENT
 except ImportError:
-    from ..constants import SCALAR_TYPES
+    from ..constants import SCALAR_TYPES, CURSOR_FIELD, CURSOR_ARGUMENT
 
-from typing import List
+try:
+    from tracing import span
+except ImportError:
+    from ..tracing import span
+
+from typing import List, Tuple
+from fastapi import Response
+from starlette.datastructures import Headers
+import hashlib
+
+
+class SchemaBytesResponse(Response):
+    """
+    A pre-serialized schema response that answers conditional requests itself.
+
+    The connector handler never sees the request, but the response is invoked with the request scope, so the
+    If-None-Match check happens here and unchanged schemas are answered with an empty 304.
+    """
+    media_type = "application/json"
+
+    def __init__(self, content: bytes, etag: str):
+        super().__init__(content=content, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        self.etag = etag
+
+    async def __call__(self, scope, receive, send) -> None:
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            if self.etag in tags or "*" in tags:
+                await Response(status_code=304, headers={"ETag": self.etag})(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
 
 
 def is_numeric_type(type_name: str) -> bool:
@@ -27,6 +58,12 @@ def is_numeric_type(type_name: str) -> bool:
     return type_name in numeric_types
 
 
+CURSOR_ARGUMENT_INFO = ArgumentInfo(
+    description="Continue after the row this cursor was read from, in the same order",
+    type=Type(type="nullable", underlying_type=Type(type="named", name="String"))
+)
+
+
 def get_field_operators(field_type):
     if field_type == 'Int' or field_type == 'Float':
         return {
@@ -96,9 +133,7 @@ def get_nested_where(cn, new_object_fields, nested=1):
     )
 
 
-async def get_schema(configuration: Configuration) -> SchemaResponse:
-    print("GET SCHEMA")
-
+async def build_schema(configuration: Configuration) -> SchemaResponse:
     if not configuration.config:
         raise ValueError('Configuration is missing')
 
@@ -135,7 +170,9 @@ async def get_schema(configuration: Configuration) -> SchemaResponse:
             collection_infos.append(CollectionInfo(
                 name=cn,
                 description=None,
-                arguments={},
+                arguments={
+                    CURSOR_ARGUMENT: CURSOR_ARGUMENT_INFO
+                },
                 type=cn,
                 uniqueness_constraints={
                     f'{cn[0].upper()}{cn[1:]}ByID': {
@@ -144,6 +181,16 @@ async def get_schema(configuration: Configuration) -> SchemaResponse:
                 },
                 foreign_keys=foreign_keys
             ))
+            new_object_types[cn] = ObjectType(
+                description=object_types[cn].description,
+                fields={
+                    **object_types[cn].fields,
+                    CURSOR_FIELD: ObjectField(
+                        description="An opaque cursor for this row, pass it as the cursor argument to continue after it",
+                        type=Type(type="named", name="String")
+                    )
+                }
+            )
 
             new_object_fields = {}
             for field_name in field_details.field_names:
@@ -223,7 +270,8 @@ async def get_schema(configuration: Configuration) -> SchemaResponse:
                                     "name": f"list_{cn}_bool_exp"
                                 }
                             }
-                        }
+                        },
+                        CURSOR_ARGUMENT: CURSOR_ARGUMENT_INFO
                     },
                     name=f"list_{cn}",
                     description="List the collection",
@@ -321,38 +369,78 @@ async def get_schema(configuration: Configuration) -> SchemaResponse:
             )
             procedures.append(insert_many_procedure)
 
+            # Define named object types for _set and _inc
+            set_type = ObjectType(
+                description=f"Fields to set for {cn}",
+                fields={field_name: ObjectField(
+                    type=Type(
+                        type="nullable",
+                        underlying_type=Type(type="named", name=field_details.field_types[field_name])
+                    )
+                ) for field_name in field_details.field_names}
+            )
+            inc_type = ObjectType(
+                description=f"Numeric fields to increment for {cn}",
+                fields={field_name: ObjectField(
+                    type=Type(
+                        type="nullable",
+                        underlying_type=Type(type="named", name=field_details.field_types[field_name])
+                    )
+                ) for field_name in field_details.field_names if
+                    is_numeric_type(field_details.field_types[field_name])}
+            )
+            new_object_types[f"{cn}_SetType"] = set_type
+            new_object_types[f"{cn}_IncType"] = inc_type
+
+            update_many_procedure = ProcedureInfo(
+                name=f"update_{cn}_many",
+                description=f"Update every record in the {cn} collection matching a filter.",
+                arguments={
+                    "where": {
+                        "description": f"The filter selecting the records to update in the {cn}",
+                        "type": {"type": "named", "name": f"list_{cn}_bool_exp"}
+                    },
+                    "_set": {
+                        "description": f"The fields to set for the {cn}",
+                        "type": {"type": "nullable", "underlying_type": {"type": "named", "name": f"{cn}_SetType"}}
+                    },
+                    "_inc": {
+                        "description": f"The numeric fields to increment for the {cn}",
+                        "type": {"type": "nullable", "underlying_type": {"type": "named", "name": f"{cn}_IncType"}}
+                    }
+                },
+                result_type={
+                    'type': "named",
+                    'name': "Int"  # The number of records updated
+                }
+            )
+            procedures.append(update_many_procedure)
+            delete_many_procedure = ProcedureInfo(
+                name=f"delete_{cn}_many",
+                description=f"Delete every record from the {cn} collection matching a filter.",
+                arguments={
+                    "where": {
+                        "description": f"The filter selecting the records to delete from the {cn}",
+                        "type": {"type": "named", "name": f"list_{cn}_bool_exp"}
+                    }
+                },
+                result_type={
+                    'type': "named",
+                    'name': "Int"  # The number of records deleted
+                }
+            )
+            procedures.append(delete_many_procedure)
+
             if len(field_details.primary_keys) > 0:
-                # Define named object types for pk_columns, _set, and _inc
+                # Define named object types for pk_columns
                 pk_columns_type = ObjectType(
                     description=f"Primary key columns for {cn}",
                     fields={pk: ObjectField(
                         type=Type(type="named", name=field_details.field_types[pk])
                     ) for pk in field_details.primary_keys}
                 )
-                set_type = ObjectType(
-                    description=f"Fields to set for {cn}",
-                    fields={field_name: ObjectField(
-                        type=Type(
-                            type="nullable",
-                            underlying_type=Type(type="named", name=field_details.field_types[field_name])
-                        )
-                    ) for field_name in field_details.field_names}
-                )
-                inc_type = ObjectType(
-                    description=f"Numeric fields to increment for {cn}",
-                    fields={field_name: ObjectField(
-                        type=Type(
-                            type="nullable",
-                            underlying_type=Type(type="named", name=field_details.field_types[field_name])
-                        )
-                    ) for field_name in field_details.field_names if
-                        is_numeric_type(field_details.field_types[field_name])}
-                )
-
                 # Add these new object types to new_object_types
                 new_object_types[f"{cn}_PKColumnsType"] = pk_columns_type
-                new_object_types[f"{cn}_SetType"] = set_type
-                new_object_types[f"{cn}_IncType"] = inc_type
 
                 # Define the update_by_pk procedure using named types
                 update_by_pk_procedure = ProcedureInfo(
@@ -414,3 +502,27 @@ async def get_schema(configuration: Configuration) -> SchemaResponse:
     )
 
     return schema_response
+
+
+async def serialize_schema(configuration: Configuration) -> Tuple[bytes, str]:
+    """
+    Build and serialize the schema, returning the response body and its ETag.
+    """
+    schema_response = await build_schema(configuration)
+    content = schema_response.model_dump_json().encode()
+    etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+    return content, etag
+
+
+async def prepare_schema(configuration: Configuration) -> None:
+    configuration._schema = await serialize_schema(configuration)
+
+
+async def get_schema(configuration: Configuration) -> Response:
+    with span("get_schema") as schema_span:
+        schema_span.set_attribute("ndc_turso.cached", configuration._schema is not None)
+        if configuration._schema is None:
+            await prepare_schema(configuration)
+        content, etag = configuration._schema
+        schema_span.set_attribute("ndc_turso.response_bytes", len(content))
+        return SchemaBytesResponse(content, etag)
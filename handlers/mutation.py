@@ -4,13 +4,37 @@ except ImportError:
     from ..models import *
 
 try:
-    from handlers.query import plan_queries, perform_query
+    from handlers.query import plan_queries, build_where, escape_single, escape_double, COMPARISON_OPERATORS
 except ImportError:
-    from query import plan_queries, perform_query
+    from query import plan_queries, build_where, escape_single, escape_double, COMPARISON_OPERATORS
+try:
+    from constants import CURSOR_ARGUMENT
+except ImportError:
+    from ..constants import CURSOR_ARGUMENT
+try:
+    from metrics import Labels
+except ImportError:
+    from ..metrics import Labels
+try:
+    from admission import admit, SMALL, LARGE
+except ImportError:
+    from ..admission import admit, SMALL, LARGE
+try:
+    from slow_query_log import record_statements
+except ImportError:
+    from ..slow_query_log import record_statements
+try:
+    from tracing import span, statement_attributes
+except ImportError:
+    from ..tracing import span, statement_attributes
 from hasura_ndc.models import QueryRequest
+from fastapi import Response
 from libsql_client import Statement, ResultSet
 from libsql_client.sqlite3 import LibsqlError
-from typing import List, Dict
+from typing import Any, List, Dict, Set, Tuple, Optional, Union
+from itertools import groupby
+import json
+import time
 
 
 class ConnectorError(Exception):
@@ -20,10 +44,58 @@ class ConnectorError(Exception):
         self.details = details if details is not None else {}
 
 
-async def execute_sql_transaction(state: State, statements: List[Statement]) -> List[ResultSet]:
-    client = state.client
+async def execute_timed_transaction(client, statements: List[Statement]) -> List[ResultSet]:
+    """
+    Execute the statements one by one inside a transaction, each in its own span so the trace shows how long each
+    one took.
+
+    This costs a round trip per statement on remote databases, so it is only used when timings are asked for.
+    """
+    transaction = client.transaction()
     try:
-        batch_results = await client.batch(statements)
+        results = []
+        for i, statement in enumerate(statements):
+            with span("execute_statement") as statement_span:
+                results.append(await transaction.execute(statement))
+                if statement_span.is_recording():
+                    statement_span.set_attributes(statement_attributes([statement]))
+                    statement_span.set_attribute("ndc_turso.statement_index", i)
+                    statement_span.set_attribute("ndc_turso.rows_affected", results[-1].rows_affected)
+        await transaction.commit()
+        return results
+    except Exception:
+        await transaction.rollback()
+        raise
+    finally:
+        transaction.close()
+
+
+async def execute_sql_transaction(state: State,
+                                  statements: List[Statement],
+                                  timed: bool = False,
+                                  labels: Labels = ("", "mutation")) -> List[ResultSet]:
+    # Single statement transactions are admitted before bulk ones
+    priority = SMALL if len(statements) <= 1 else LARGE
+    record_statements(statements)
+    try:
+        async with admit(state.write_admission, priority), state.write_pool.acquire() as client:
+            with span("execute_sql_transaction", {"ndc_turso.collection": labels[0],
+                                                  "ndc_turso.operation": labels[1]}) as execute_span:
+                start = time.perf_counter()
+                if timed:
+                    batch_results = await execute_timed_transaction(client, statements)
+                else:
+                    batch_results = await client.batch(statements)
+                state.metrics.execute_seconds.observe(labels, time.perf_counter() - start)
+                if execute_span.is_recording():
+                    execute_span.set_attributes(statement_attributes(statements))
+                    execute_span.set_attribute("ndc_turso.rows", sum(len(r.rows) for r in batch_results))
+                    execute_span.set_attribute("ndc_turso.rows_affected",
+                                               sum(r.rows_affected for r in batch_results))
+        state.metrics.statements.inc(labels, len(statements))
+        state.metrics.batches.inc(labels)
+        if state.replica:
+            state.replica.note_write()
         return batch_results
     except LibsqlError as e:
         raise ConnectorError(
@@ -33,56 +105,168 @@ async def execute_sql_transaction(state: State, statements: List[Statement]) ->
         )
 
 
-def build_insert_sql(table: str, data: list, returning: bool = False) -> tuple:
+def requested_fields(op: MutationOperation) -> Optional[Dict[str, Field]]:
+    fields = op.fields
+    # The requested object may be wrapped in any number of arrays
+    while fields is not None and not isinstance(fields.fields, dict):
+        fields = fields.fields
+    return fields.fields if fields is not None else None
+
+
+def returning_fields(configuration: Configuration, op: MutationOperation, table: str) -> Optional[Dict[str, str]]:
+    """
+    Resolve which columns a mutation should return, as a mapping of response key to column name.
+
+    Returns None when the caller passed a return of 0, and every column of the table when no fields were requested.
+    """
+    if op.arguments.get("return") is not None and int(op.arguments.get("return")) <= 0:
+        return None
+    fields = requested_fields(op)
+    field_names = configuration.config.object_fields[table].field_names
+    if fields is None:
+        return {name: name for name in field_names}
+    columns = {}
+    for alias, field in fields.items():
+        if field.type != "column":
+            raise ValueError(f"Only column fields can be returned from mutations, got {field.type} for {alias}")
+        # The collection's object type also has the computed cursor field, which has no column to return
+        if field.column not in field_names:
+            raise ValueError(f"Only the table's columns can be returned from mutations, got {field.column} for {alias}")
+        columns[alias] = field.column
+    return columns
+
+
+def build_returning_clause(returning: Optional[Dict[str, str]]) -> str:
+    # Each returned row is a single JSON object built by SQLite, so nothing is re-encoded on the way out
+    if returning is None:
+        return ""
+    pairs = ", ".join([f"{escape_single(alias)}, {escape_double(column)}" for alias, column in returning.items()])
+    return f"RETURNING JSON_OBJECT({pairs})"
+
+
+def build_insert_sql(table: str, data: list, returning: Optional[Dict[str, str]] = None) -> tuple:
     if not data:
         return "", []
 
-    columns = ', '.join([f'"{col}"' for col in data[0].keys()])
-    placeholders = '(' + ', '.join(['?'] * len(data[0])) + ')'
+    returning_clause = build_returning_clause(returning)
+    column_names = list(data[0].keys())
+    if not column_names:
+        return f"INSERT INTO \"{table}\" DEFAULT VALUES {returning_clause}", []
+    columns = ', '.join([f'"{col}"' for col in column_names])
+    placeholders = '(' + ', '.join(['?'] * len(column_names)) + ')'
     values_tuple = ', '.join([placeholders] * len(data))
-    returning_clause = "RETURNING *" if returning else ""
     sql = f"INSERT INTO \"{table}\" ({columns}) VALUES {values_tuple} {returning_clause}"
-    values = [val for item in data for val in item.values()]
+    values = [item[col] for item in data for col in column_names]
     return sql, values
 
 
-def build_update_sql(table: str, pk_columns: dict, set_arguments: dict, inc_arguments: dict,
-                     returning: bool = False) -> tuple:
+def chunk_insert_data(data: list, max_parameters: int, max_rows: int) -> List[list]:
+    """
+    Split the objects to insert into chunks that each fit a single multi-row INSERT.
+
+    Consecutive objects providing the same set of keys are grouped, so the rows are still inserted, and returned, in
+    the order they were given. Each chunk is sized so that its bound parameters stay within max_parameters. Objects
+    without any keys have to be inserted one at a time.
+    """
+    chunks = []
+    for key_set, run in groupby(data, key=lambda item: tuple(sorted(item.keys()))):
+        items = list(run)
+        if key_set:
+            rows_per_chunk = max(1, min(max_rows, max_parameters // len(key_set)))
+        else:
+            rows_per_chunk = 1
+        for i in range(0, len(items), rows_per_chunk):
+            chunks.append(items[i:i + rows_per_chunk])
+    return chunks
+
+
+def build_set_clauses(set_arguments: dict, inc_arguments: dict, args: List) -> List[str]:
     set_clauses = []
-    args = []
 
     # Handle _set argument
     if set_arguments:
         for column, value in set_arguments.items():
-            set_clauses.append(f'"{column}" = ?')
+            set_clauses.append(f'{escape_double(column)} = ?')
             args.append(value)
 
     # Handle _inc argument
     if inc_arguments:
         for column, increment_value in inc_arguments.items():
-            set_clauses.append(f'"{column}" = "{column}" + ?')
+            set_clauses.append(f'{escape_double(column)} = {escape_double(column)} + ?')
             args.append(increment_value)
+    return set_clauses
+
+
+def build_update_sql(table: str, pk_columns: dict, set_arguments: dict, inc_arguments: dict,
+                     returning: Optional[Dict[str, str]] = None) -> tuple:
+    args = []
+    set_clauses = build_set_clauses(set_arguments, inc_arguments, args)
 
     where_clause = ' AND '.join([f'"{column}" = ?' for column in pk_columns.keys()])
     args.extend(pk_columns.values())
 
     if set_clauses:
         set_clause = ', '.join(set_clauses)
-        returning_clause = "RETURNING *" if returning else ""
+        returning_clause = build_returning_clause(returning)
         sql = f"UPDATE \"{table}\" SET {set_clause} WHERE {where_clause} {returning_clause}"
         return sql, args
     else:
         return "", []
 
 
-def build_delete_sql(table: str, pk_columns: dict, returning: bool = False) -> tuple:
+def build_delete_sql(table: str, pk_columns: dict, returning: Optional[Dict[str, str]] = None) -> tuple:
     where_clause = ' AND '.join([f'"{column}" = ?' for column in pk_columns.keys()])
     args = list(pk_columns.values())
-    returning_clause = "RETURNING *" if returning else ""
+    returning_clause = build_returning_clause(returning)
     sql = f"DELETE FROM \"{table}\" WHERE {where_clause} {returning_clause}"
     return sql, args
 
 
+def table_columns(configuration: Configuration, table: str) -> List[str]:
+    if not configuration.config or table not in configuration.config.object_fields:
+        raise ConnectorError(
+            status_code=400,
+            message=f"Unknown collection {table}",
+            details={}
+        )
+    return configuration.config.object_fields[table].field_names
+
+
+def check_columns(columns: List[str], names: Any) -> None:
+    for name in names:
+        if name not in columns:
+            raise ConnectorError(
+                status_code=400,
+                message=f"Unknown column {name}",
+                details={}
+            )
+
+
+def build_update_many_sql(table: str, columns: List[str], where: Dict[str, Any], set_arguments: dict,
+                          inc_arguments: dict) -> tuple:
+    """
+    Build a single UPDATE for every row matching the list_<table>_bool_exp filter.
+    """
+    check_columns(columns, list((set_arguments or {}).keys()) + list((inc_arguments or {}).keys()))
+    args = []
+    set_clauses = build_set_clauses(set_arguments, inc_arguments, args)
+    if not set_clauses:
+        return "", []
+    where_clause = build_where(build_expression(where, columns), args, {})
+    sql = f"UPDATE {escape_double(table)} SET {', '.join(set_clauses)} WHERE {where_clause}"
+    return sql, args
+
+
+def build_delete_many_sql(table: str, columns: List[str], where: Dict[str, Any]) -> tuple:
+    """
+    Build a single DELETE for every row matching the list_<table>_bool_exp filter.
+    """
+    args = []
+    where_clause = build_where(build_expression(where, columns), args, {})
+    sql = f"DELETE FROM {escape_double(table)} WHERE {where_clause}"
+    return sql, args
+
+
 def build_binary_expression(field_name: str, operator: str, value: Any) -> Expression:
     return Expression(
         type='binary_comparison_operator',
@@ -92,21 +276,52 @@ def build_binary_expression(field_name: str, operator: str, value: Any) -> Expre
     )
 
 
+def build_is_null_expression(field_name: str, is_null: bool) -> Expression:
+    expression = Expression(
+        type='unary_comparison_operator',
+        column=ComparisonTarget(type='column', name=field_name, path=[]),
+        operator='is_null'
+    )
+    return expression if is_null else Expression(type='not', expression=expression)
+
+
 def build_field_expressions(field_name: str, conditions: Any) -> List[Expression]:
     # Build expressions for each condition on a specific field
     if isinstance(conditions, dict):
         # Single condition for a field
-        return [build_binary_expression(field_name, operator, value) for operator, value in conditions.items()]
+        for operator in conditions:
+            if operator != '_is_null' and operator not in COMPARISON_OPERATORS:
+                raise ConnectorError(
+                    status_code=400,
+                    message=f"Unknown operator {operator} on column {field_name}",
+                    details={}
+                )
+        return [build_is_null_expression(field_name, value) if operator == '_is_null'
+                else build_binary_expression(field_name, operator, value) for operator, value in conditions.items()]
     elif isinstance(conditions, list):
         # Multiple conditions for a field
-        return [build_expression(cond) for cond in conditions]
+        return [expression for cond in conditions for expression in build_field_expressions(field_name, cond)]
     else:
-        raise ValueError(f"Invalid condition format for field '{field_name}'")
+        raise ConnectorError(
+            status_code=400,
+            message=f"Invalid condition format for field '{field_name}'",
+            details={}
+        )
 
 
-def build_expression(where: Dict[str, Any]) -> Expression | None:
+def build_expression(where: Dict[str, Any], columns: List[str]) -> Expression | None:
+    """
+    Turn a <table>_bool_exp into an expression. Every column and operator is checked against the table, the column
+    names end up in the SQL.
+    """
     if where is None:
         return None
+    if not isinstance(where, dict):
+        raise ConnectorError(
+            status_code=400,
+            message="Invalid boolean expression",
+            details={}
+        )
 
     expressions = []
 
@@ -116,16 +331,17 @@ def build_expression(where: Dict[str, Any]) -> Expression | None:
             if key == '_not':
                 expressions.append(Expression(
                     type='not',
-                    expression=build_expression(value)
+                    expression=build_expression(value, columns)
                 ))
             else:
-                sub_expressions = [build_expression(cond) for cond in value]
+                sub_expressions = [build_expression(cond, columns) for cond in value]
                 expressions.append(Expression(
                     type=key[1:],  # Removing the underscore from '_and' or '_or'
                     expressions=sub_expressions
                 ))
         else:
             # Handle binary comparison operators for specific fields
+            check_columns(columns, [key])
             field_expressions = build_field_expressions(key, value)
             expressions.extend(field_expressions)
 
@@ -138,106 +354,264 @@ def build_expression(where: Dict[str, Any]) -> Expression | None:
         )
 
 
-def build_query_request(operation: MutationOperation,
+def build_query_request(configuration: Configuration,
+                        operation: MutationOperation,
                         collection_relationships: Dict[str, Relationship]) -> QueryRequest:
+    collection = operation.name[len("list_"):]
+    columns = table_columns(configuration, collection)
+    fields = requested_fields(operation)
+    if fields is None:
+        fields = {name: Field(type="column", column=name) for name in columns}
     q = Query(
         aggregates=None,
-        fields=operation.fields,
+        fields=fields,
         limit=operation.arguments.get("limit"),
         offset=operation.arguments.get("offset"),
-        where=build_expression(operation.arguments.get("where", None))
+        predicate=build_expression(operation.arguments.get("where", None), columns)
     )
+    cursor = operation.arguments.get(CURSOR_ARGUMENT)
     qr = QueryRequest(
-        arguments={},
+        arguments={CURSOR_ARGUMENT: {"type": "literal", "value": cursor}} if cursor else {},
         variables=None,
-        collection=operation.name[len("list_"):],
+        collection=collection,
         collection_relationships=collection_relationships,
         query=q
     )
     return qr
 
 
-async def mutation(configuration: Configuration, state: State, mutation_request: MutationRequest) -> MutationResponse:
+def affected_tables(configuration: Configuration, tables: Set[str]) -> Set[str]:
+    """
+    The tables written to, plus every table that references them through a foreign key, as a cascading delete or
+    update can change those too.
+    """
+    affected = set(tables)
+    pending = list(tables)
+    while pending:
+        table = pending.pop()
+        for name, details in configuration.config.object_fields.items():
+            if name not in affected and any(fk.table == table for fk in details.foreign_keys.values()):
+                affected.add(name)
+                pending.append(name)
+    return affected
+
+
+def operation_labels(op: MutationOperation) -> Labels:
+    """
+    The collection and kind of a procedure, like ("Album", "update_by_pk") for update_Album_by_pk.
+    """
+    for prefix in ("insert_", "update_", "delete_"):
+        if op.name.startswith(prefix):
+            for suffix in ("_one", "_many", "_by_pk"):
+                if op.name.endswith(suffix):
+                    return op.name[len(prefix):-len(suffix)], prefix + suffix[1:]
+    if op.name.startswith("list_"):
+        return op.name[len("list_"):], "list"
+    return "", op.name
+
+
+def plan_operation(configuration: Configuration, op: MutationOperation) -> Tuple[List[Statement], bool, str]:
+    """
+    Build the statements for an insert, update or delete procedure, whether its result is an affected row count, and
+    the table it writes to.
+    """
     statements = []
+    counted = False
+    if op.name.startswith('insert_'):
+        prefix_len = len('insert_')
+        suffix_len = len('_one') if op.name.endswith('_one') else len('_many')
+        table = op.name[prefix_len:-suffix_len]
+        data = [op.arguments['object']] if op.name.endswith('_one') else op.arguments['objects']
+        returning = returning_fields(configuration, op, table)
+        if not data:
+            raise ConnectorError(
+                status_code=400,
+                message=f"No data to insert for operation {op.name}",
+                details={}
+            )
+        for chunk in chunk_insert_data(data,
+                                       configuration.mutations.max_parameters,
+                                       configuration.mutations.max_rows_per_statement):
+            sql, args = build_insert_sql(table, chunk, returning=returning)
+            statements.append(Statement(sql=sql, args=args))
+    elif op.name.startswith('update_'):
+        if op.name.endswith("_by_pk"):
+            table = op.name[len('update_'):-len('_by_pk')]
+            pk_columns = op.arguments["pk_columns"]
+            assert isinstance(pk_columns, dict)
+            _set = op.arguments.get("_set", {})
+            _inc = op.arguments.get("_inc", {})
+            returning = returning_fields(configuration, op, table)
+            sql, args = build_update_sql(table, pk_columns, _set, _inc, returning=returning)
+            if not sql:
+                raise ConnectorError(
+                    status_code=400,
+                    message=f"No update set for operation {op.name}",
+                    details={}
+                )
+            statements.append(Statement(sql=sql, args=args))
+        elif op.name.endswith("_many"):
+            table = op.name[len('update_'):-len('_many')]
+            sql, args = build_update_many_sql(table,
+                                              table_columns(configuration, table),
+                                              op.arguments["where"],
+                                              op.arguments.get("_set", {}),
+                                              op.arguments.get("_inc", {}))
+            counted = True
+            if not sql:
+                raise ConnectorError(
+                    status_code=400,
+                    message=f"No update set for operation {op.name}",
+                    details={}
+                )
+            statements.append(Statement(sql=sql, args=args))
+        else:
+            raise ConnectorError(
+                status_code=400,
+                message=f"Unknown procedure {op.name}",
+                details={}
+            )
+    elif op.name.startswith("delete_"):
+        if op.name.endswith("_by_pk"):
+            table = op.name[len('delete_'):-len('_by_pk')]
+            pk_columns = op.arguments["pk_columns"]
+            assert isinstance(pk_columns, dict)
+            returning = returning_fields(configuration, op, table)
+            sql, args = build_delete_sql(table, pk_columns, returning=returning)
+            if not sql:
+                raise ConnectorError(
+                    status_code=400,
+                    message=f"No primary key provided for delete operation {op.name}",
+                    details={}
+                )
+            statements.append(Statement(sql=sql, args=args))
+        elif op.name.endswith("_many"):
+            table = op.name[len('delete_'):-len('_many')]
+            sql, args = build_delete_many_sql(table, table_columns(configuration, table), op.arguments["where"])
+            statements.append(Statement(sql=sql, args=args))
+            counted = True
+        else:
+            raise ConnectorError(
+                status_code=400,
+                message=f"Unknown procedure {op.name}",
+                details={}
+            )
+    else:
+        raise ConnectorError(
+            status_code=400,
+            message=f"Unknown procedure {op.name}",
+            details={}
+        )
+    return statements, counted, table
+
+
+async def mutation(configuration: Configuration,
+                   state: State,
+                   mutation_request: MutationRequest) -> Union[MutationResponse, Response]:
+    statements = []
+    # The operation each statement belongs to, and the operations that return an affected row count
+    statement_operations = []
+    counted_operations = set()
+    written_tables = set()
+    labels_by_operation = {}
+    sync_operations = []
+    list_operations = set()
     results = []
-    for op in mutation_request.operations:
+    for index, op in enumerate(mutation_request.operations):
+        labels = labels_by_operation[index] = operation_labels(op)
         if op.type == 'procedure':
-            if op.name.startswith('insert_'):
-                prefix_len = len('insert_')
-                suffix_len = len('_one') if op.name.endswith('_one') else len('_many')
-                table = op.name[prefix_len:-suffix_len]
-                data = [op.arguments['object']] if op.name.endswith('_one') else op.arguments['objects']
-                # returning = not (op.arguments.get("return") is None or int(op.arguments.get("return")) <= 0)
-                sql, args = build_insert_sql(table, data, returning=True)
-                if sql:
-                    statements.append(Statement(sql=sql, args=args))
-                else:
-                    print(f"No data to insert for operation {op.name}")
-            elif op.name.startswith('update_'):
-                if op.name.endswith("_by_pk"):
-                    table = op.name[len('update_'):-len('_by_pk')]
-                    pk_columns = op.arguments["pk_columns"]
-                    assert isinstance(pk_columns, dict)
-                    _set = op.arguments.get("_set", {})
-                    _inc = op.arguments.get("_inc", {})
-                    # returning = not (op.arguments.get("return") is None or int(op.arguments.get("return")) <= 0)
-                    sql, args = build_update_sql(table, pk_columns, _set, _inc, returning=True)
-                    if sql:
-                        statements.append(Statement(sql=sql, args=args))
-                    else:
-                        print(f"No update set for operation {op.name}")
-                else:
-                    raise NotImplemented("This is not implemented")
-            elif op.name.startswith("delete_"):
-                if op.name.endswith("_by_pk"):
-                    table = op.name[len('delete_'):-len('_by_pk')]
-                    pk_columns = op.arguments["pk_columns"]
-                    assert isinstance(pk_columns, dict)
-                    # Returning is always none for SQLite, MySQL, but for things like Postgres it might not be.
-                    # returning = not (op.arguments.get("return") is None or int(op.arguments.get("return")) <= 0)
-                    sql, args = build_delete_sql(table, pk_columns, returning=True)
-                    if sql:
-                        statements.append(Statement(sql=sql, args=args))
-                    else:
-                        print(f"No primary key provided for delete operation {op.name}")
-                else:
-                    raise NotImplemented("This is not implemented")
+            if op.name == "sync":
+                if state.replica is None:
+                    raise ConnectorError(
+                        status_code=400,
+                        message="The sync procedure requires an embedded replica",
+                        details={}
+                    )
+                # Synced after the transaction, so the replica also picks up the writes made before the sync
+                sync_operations.append(index)
+                counted_operations.add(index)
+                continue
             elif op.name.startswith("list_"):
-                print(mutation_request.model_dump_json(indent=4))
-                query_request = build_query_request(op,
-                                                    collection_relationships=mutation_request.collection_relationships)
-                query_plans = await plan_queries(configuration, query_request)
-                query_response = await perform_query(state, query_plans)
-                res = MutationResponse(
-                    operation_results=[
-                        MutationOperationResults(
-                            affected_rows=len(query_response),
-                            returning=[
-                                {"__value": query_response[0].get("rows")}
-                            ]
-                        )
-                    ]
-                )
-                return res
+                with span("plan_operation", {"ndc_turso.collection": labels[0],
+                                             "ndc_turso.operation": labels[1]}) as plan_span:
+                    start = time.perf_counter()
+                    query_request = build_query_request(configuration, op, mutation_request.collection_relationships)
+                    query_plans = await plan_queries(configuration, state, query_request)
+                    state.metrics.plan_seconds.observe(labels, time.perf_counter() - start)
+                    if plan_span.is_recording():
+                        plan_span.set_attributes(statement_attributes(query_plans))
+                # Read inside the transaction, so the list sees the writes of the operations before it. The
+                # procedure returns the rows array, not the row set object the query wraps it in.
+                statements.extend(Statement(sql=f"SELECT JSON_EXTRACT(data, '$.rows') FROM ({plan.sql})",
+                                            args=plan.args) for plan in query_plans)
+                statement_operations.extend([index] * len(query_plans))
+                list_operations.add(index)
             else:
-                raise NotImplemented("This is not implemented")
+                with span("plan_operation", {"ndc_turso.collection": labels[0],
+                                             "ndc_turso.operation": labels[1]}) as plan_span:
+                    start = time.perf_counter()
+                    op_statements, counted, table = plan_operation(configuration, op)
+                    state.metrics.plan_seconds.observe(labels, time.perf_counter() - start)
+                    if plan_span.is_recording():
+                        plan_span.set_attributes(statement_attributes(op_statements))
+                written_tables.add(table)
+                statements.extend(op_statements)
+                statement_operations.extend([index] * len(op_statements))
+                if counted:
+                    counted_operations.add(index)
+    # A transaction mixing several kinds of operations is not attributed to any of them
+    transaction_labels = set(labels_by_operation.values())
+    transaction_labels = transaction_labels.pop() if len(transaction_labels) == 1 else ("", "mutation")
     if len(statements) > 0:
-        results = await execute_sql_transaction(state, statements)
-    returning = []
-    for r in results:
-        for values in r.rows:
-            if len(returning) == 0:
-                returning.append({"__value": []})
-            returning[0]["__value"].append(dict(zip(r.columns, values)))
-    else:
-        if len(returning) == 0:
-            returning.append({"__value": None})
+        results = await execute_sql_transaction(state,
+                                                statements,
+                                                timed=configuration.mutations.statement_timings,
+                                                labels=transaction_labels)
+        if state.result_cache is not None:
+            state.result_cache.invalidate(affected_tables(configuration, written_tables))
+        if state.single_flight is not None:
+            # Queries starting after the write must not join an execution that may have missed it
+            state.single_flight.forget()
+    # Statements without a RETURNING clause have no rows, the rest return one JSON object per row
+    returning = {index: [] for index in range(len(mutation_request.operations))}
+    affected_rows = {index: 0 for index in counted_operations}
+    for index, r in zip(statement_operations, results):
+        if index in counted_operations:
+            affected_rows[index] += r.rows_affected
+        else:
+            returning[index].extend(values[0] for values in r.rows)
+    for index in sync_operations:
+        # The procedure returns the number of frames replicated
+        affected_rows[index] = await state.replica.sync()
+        if state.result_cache is not None:
+            # The sync can bring in writes to any table
+            state.result_cache.clear()
+    for index, rows in returning.items():
+        state.metrics.rows.inc(labels_by_operation[index], affected_rows.get(index, len(rows)))
+    if configuration.json_passthrough:
+        operation_results = []
+        for index, rows in returning.items():
+            if index in counted_operations:
+                result = str(affected_rows[index])
+            elif index in list_operations:
+                result = rows[0]
+            else:
+                result = f"[{','.join(rows)}]" if rows else "null"
+            operation_results.append(f'{{"type":"procedure","result":{result}}}')
+        response = Response(content=f'{{"operation_results":[{",".join(operation_results)}]}}'.encode(),
+                            media_type="application/json")
+        state.metrics.response_bytes.observe(transaction_labels, len(response.body))
+        return response
+    start = time.perf_counter()
     response = MutationResponse(
         operation_results=[
             MutationOperationResults(
                 type="procedure",
-                result=item["__value"]
-            ) for item in returning
+                result=affected_rows[index] if index in counted_operations
+                else json.loads(rows[0]) if index in list_operations
+                else [json.loads(value) for value in rows] if rows else None
+            ) for index, rows in returning.items()
         ]
     )
+    state.metrics.decode_seconds.observe(transaction_labels, time.perf_counter() - start)
     return response
@@ -0,0 +1,39 @@
+try:
+    from models import Configuration, State, MutationRequest, ExplainResponse
+except ImportError:
+    from ..models import Configuration, State, MutationRequest, ExplainResponse
+
+try:
+    from handlers.query import plan_queries
+    from handlers.query_explain import explain_statements
+    from handlers.mutation import plan_operation, build_query_request
+except ImportError:
+    from query import plan_queries
+    from query_explain import explain_statements
+    from mutation import plan_operation, build_query_request
+import time
+
+
+async def mutation_explain(configuration: Configuration,
+                           state: State,
+                           mutation_request: MutationRequest) -> ExplainResponse:
+    start = time.perf_counter()
+    statements = []
+    for op in mutation_request.operations:
+        if op.type != 'procedure' or op.name == "sync":
+            continue
+        if op.name.startswith("list_"):
+            query_request = build_query_request(configuration,
+                                                op,
+                                                collection_relationships=mutation_request.collection_relationships)
+            statements.extend(await plan_queries(configuration, state, query_request))
+        else:
+            statements.extend(plan_operation(configuration, op)[0])
+    sql_generation_time = time.perf_counter() - start
+    if not statements:
+        return ExplainResponse(details={})
+    # The plans are only prepared, never run, but they are taken against the primary like the writes would be
+    async with state.write_pool.acquire() as client:
+        details = await explain_statements(client, statements)
+    details["sql_generation_time_ms"] = f"{sql_generation_time * 1000:.3f}"
+    return ExplainResponse(details=details)
@@ -1,25 +1,55 @@
 try:
     from models import Configuration, State, QueryRequest, QueryResponse, Query, Expression, MutationResponse, \
-        MutationOperationResults
+        MutationOperationResults, Aggregate
 except ImportError:
     from ..models import Configuration, State, QueryRequest, QueryResponse, Query, Expression, MutationResponse, \
-        MutationOperationResults
-from typing import List, Any, Dict, Optional
+        MutationOperationResults, Aggregate
+from typing import Awaitable, Callable, List, Any, Dict, Optional, Set, Tuple, Union
+import hashlib
 import json
+import time
+from fastapi import Response
 from libsql_client import Statement
 
 try:
-    from constants import MAX_32_INT
+    from constants import MAX_32_INT, CURSOR_FIELD, CURSOR_ARGUMENT
 except ImportError:
-    from ..constants import MAX_32_INT
+    from ..constants import MAX_32_INT, CURSOR_FIELD, CURSOR_ARGUMENT
+
+try:
+    from metrics import Labels
+except ImportError:
+    from ..metrics import Labels
+
+try:
+    from admission import admit, SMALL, LARGE
+except ImportError:
+    from ..admission import admit, SMALL, LARGE
+
+try:
+    from slow_query_log import record_statements
+except ImportError:
+    from ..slow_query_log import record_statements
+
+try:
+    from tracing import span, statement_attributes
+except ImportError:
+    from ..tracing import span, statement_attributes
+
+
+VARIABLES_ALIAS = "__vars"
+# The names a rowid table's rowid can be read through
+ROWID_ALIASES = ["rowid", "_rowid_", "oid"]
 
 
 def escape_single(s: Any) -> str:
-    return f"'{s}'"
+    # Single quotes inside a string literal are escaped by doubling them
+    return "'" + str(s).replace("'", "''") + "'"
 
 
 def escape_double(s: Any) -> str:
-    return f'"{s}"'
+    # Double quotes inside an identifier are escaped by doubling them
+    return '"' + str(s).replace('"', '""') + '"'
 
 
 def wrap_data(s: str) -> str:
@@ -31,10 +61,35 @@ SELECT
 """
 
 
-def wrap_rows(s: str) -> str:
+def wrap_foreach(s: str) -> str:
+    # Evaluates the query once per distinct variable set, then fans the results back out in request order
+    return f"""
+WITH {escape_double(VARIABLES_ALIAS)} AS (
+  SELECT key, value FROM JSON_EACH(?)
+),
+"__data" AS MATERIALIZED (
+  SELECT
+    {escape_double(VARIABLES_ALIAS)}.key as k,
+    ({s}) as data
+  FROM {escape_double(VARIABLES_ALIAS)}
+)
+SELECT
+  "__data".data as data
+FROM JSON_EACH(?) as "__index"
+JOIN "__data" ON "__data".k = "__index".value
+ORDER BY "__index".key
+"""
+
+
+def wrap_rows(s: str, aggregates: Optional[List[str]] = None, rows: bool = True) -> str:
+    row_set = []
+    if aggregates is not None:
+        row_set.append(f"'aggregates', JSON_OBJECT({', '.join(aggregates)})")
+    if rows:
+        row_set.append("'rows', JSON_GROUP_ARRAY(JSON(r))")
     return f"""
 SELECT
-  JSON_OBJECT('rows', JSON_GROUP_ARRAY(JSON(r)))
+  JSON_OBJECT({', '.join(row_set)})
 FROM
   (
     {s}
@@ -42,56 +97,213 @@ FROM
 """
 
 
-def build_where(expression: Expression, args: List, variables: Dict[str, Any]) -> str:
+AGGREGATE_FUNCTIONS = {
+    "sum": "SUM",
+    "avg": "AVG",
+    "min": "MIN",
+    "max": "MAX"
+}
+
+
+def build_aggregates(aggregates: Dict[str, Aggregate], select_columns: List[str]) -> List[str]:
+    """
+    Build the JSON_OBJECT arguments computing each aggregate over the row set.
+
+    Aggregated columns are added to select_columns under positional aliases so the outer query can reach them.
+    """
+    aggregate_sql = []
+    for aggregate_name, aggregate in aggregates.items():
+        aggregate_sql.append(escape_single(aggregate_name))
+        if aggregate.type == 'star_count':
+            aggregate_sql.append("COUNT(*)")
+            continue
+        alias = escape_double(f"__agg_{len(select_columns)}")
+        select_columns.append(f"{escape_double(aggregate.column)} as {alias}")
+        if aggregate.type == 'column_count':
+            aggregate_sql.append(f"COUNT({'DISTINCT ' if aggregate.distinct else ''}{alias})")
+        elif aggregate.type == 'single_column':
+            if aggregate.function not in AGGREGATE_FUNCTIONS:
+                raise ValueError(f"Unknown Aggregate Function {aggregate.function}")
+            aggregate_sql.append(f"{AGGREGATE_FUNCTIONS[aggregate.function]}({alias})")
+        else:
+            raise ValueError("Unknown Aggregate Type")
+    return aggregate_sql
+
+
+def variable_reference(name: str, variables_alias: str) -> str:
+    variables = f"{escape_double(variables_alias)}.value"
+    if '"' in name:
+        # A JSON path label cannot contain a double quote, so the variable is looked up by key instead
+        return f"(SELECT value FROM JSON_EACH({variables}) WHERE key = {escape_single(name)})"
+    # Quoting the label keeps dots and brackets in the name from being read as path steps
+    path = escape_single(f'$."{name}"')
+    return f"JSON_EXTRACT({variables}, {path})"
+
+
+def order_by_columns(q: Query) -> List[Tuple[str, str]]:
+    if not q.order_by:
+        return []
+    return [(elem.target.name, elem.order_direction) for elem in q.order_by.elements
+            if elem.target.type == 'column' and not elem.target.path]
+
+
+def selects_cursor(q: Query) -> bool:
+    return any(field.type == 'column' and field.column == CURSOR_FIELD for field in (q.fields or {}).values())
+
+
+def keyset_columns(config: Configuration, table: str, q: Query) -> List[Tuple[str, str]]:
+    """
+    The columns a cursor encodes with their sort direction: the order by columns, then the primary key to break ties,
+    sorted the same way as the last order by column.
+
+    Tables without a primary key are ordinary rowid tables, WITHOUT ROWID tables always have one. NULLs compare as
+    unknown, so ordering by a nullable column would skip rows and is rejected.
+    """
+    if not config.config or table not in config.config.object_fields:
+        raise ValueError(f"Keyset pagination is not supported for {table}")
+    fields = config.config.object_fields[table]
+    columns = order_by_columns(q)
+    if q.order_by and len(columns) != len(q.order_by.elements):
+        raise ValueError("Keyset pagination can only order by the collection's own columns")
+    nullable = [column for column, _ in columns if column in fields.nullable_keys]
+    if nullable:
+        raise ValueError(f"Keyset pagination cannot order by the nullable columns {', '.join(nullable)}")
+    primary_keys = fields.primary_keys
+    if not primary_keys:
+        # A column can shadow rowid, but not all of its aliases
+        rowid = next((alias for alias in ROWID_ALIASES if alias not in fields.field_names), None)
+        if rowid is None:
+            raise ValueError(f"Keyset pagination is not supported for {table}, it has no primary key")
+        primary_keys = [rowid]
+    ordered = [column for column, _ in columns]
+    direction = columns[-1][1] if columns else 'asc'
+    columns.extend((column, direction) for column in primary_keys if column not in ordered)
+    return columns
+
+
+def build_order_by(config: Configuration, table: str, q: Query, keyset: bool) -> str:
+    """
+    The ORDER BY clause of a level. A level read with a cursor, or returning one, is ordered by its whole keyset so
+    that the order is total and the cursor describes where a row is in it.
+    """
+    if keyset:
+        order_elems = [f'{escape_double(column)} {direction}' for column, direction in keyset_columns(config, table, q)]
+    elif q.order_by:
+        order_elems = [f'{escape_double(elem.target.name)} {elem.order_direction}' for elem in
+                       q.order_by.elements if elem.target.type == 'column']
+    else:
+        order_elems = []
+    return f'ORDER BY {", ".join(order_elems)}' if order_elems else ""
+
+
+def column_sql(config: Configuration, table: str, q: Query, column: str) -> str:
+    if column == CURSOR_FIELD:
+        # The cursor is opaque to clients, but it is just the row's keyset values as a hex encoded JSON array
+        keyset = ", ".join(escape_double(c) for c, _ in keyset_columns(config, table, q))
+        return f"HEX(JSON_ARRAY({keyset}))"
+    return escape_double(column)
+
+
+def cursor_argument(query_request: QueryRequest) -> Optional[List[Any]]:
+    argument = query_request.arguments.get(CURSOR_ARGUMENT)
+    if argument is None:
+        return None
+    if argument.type != 'literal':
+        raise ValueError("The cursor must be passed as a literal")
+    if argument.value is None:
+        return None
+    try:
+        cursor = json.loads(bytes.fromhex(argument.value).decode())
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(cursor, list):
+        raise ValueError("Invalid cursor")
+    return cursor
+
+
+def build_cursor_condition(keyset: List[Tuple[str, str]], cursor: List[Any], args: List) -> str:
+    """
+    Compile a cursor into the predicate selecting the rows after it.
+
+    When every column sorts the same way this is a single row value comparison, which SQLite can answer with an
+    index seek; mixed directions expand into the equivalent OR of prefixes.
+    """
+    if len(cursor) != len(keyset):
+        raise ValueError("The cursor does not match the order of the query")
+    columns = [escape_double(column) for column, _ in keyset]
+    directions = {direction for _, direction in keyset}
+    if len(directions) == 1:
+        args.extend(cursor)
+        operator = '<' if directions == {'desc'} else '>'
+        return f"({', '.join(columns)}) {operator} ({', '.join(['?'] * len(cursor))})"
+    clauses = []
+    for i, (_, direction) in enumerate(keyset):
+        terms = [f"{column} = ?" for column in columns[:i]]
+        terms.append(f"{columns[i]} {'<' if direction == 'desc' else '>'} ?")
+        args.extend(cursor[:i + 1])
+        clauses.append(f"({' AND '.join(terms)})")
+    return f"({' OR '.join(clauses)})"
+
+
+# The binary comparison operators build_where knows how to translate
+COMPARISON_OPERATORS = ["_eq", "_like", "_glob", "_neq", "_gt", "_lt", "_gte", "_lte"]
+
+
+def build_where(expression: Expression, args: List, variables: Dict[str, Any],
+                variables_alias: Optional[str] = None) -> str:
     if expression.type == 'unary_comparison_operator':
         if expression.operator == 'is_null':
-            sql = f"{expression.column.name} IS NULL"
+            sql = f"{escape_double(expression.column.name)} IS NULL"
         else:
             raise ValueError("Unknown Unary Comparison Operator")
     elif expression.type == 'binary_comparison_operator':
         value_type = expression.value.type
+        placeholder = "?"
         if value_type == 'scalar':
             args.append(expression.value.value)
         elif value_type == 'variable':
-            if variables:
+            if variables_alias:
+                placeholder = variable_reference(expression.value.name, variables_alias)
+            elif variables:
                 args.append(variables[expression.value.name])
         elif value_type == 'column':
             raise ValueError("Column type in binary comparison not implemented")
         else:
             raise ValueError("Unknown Binary Comparison Value Type")
         operator_type = expression.operator
+        column = escape_double(expression.column.name)
         if operator_type == '_eq':
-            sql = f"{expression.column.name} = ?"
+            sql = f"{column} = {placeholder}"
         elif operator_type == '_like':
-            sql = f"{expression.column.name} LIKE ?"
+            sql = f"{column} LIKE {placeholder}"
         elif operator_type == '_glob':
-            sql = f"{expression.column.name} GLOB ?"
+            sql = f"{column} GLOB {placeholder}"
         elif operator_type == '_neq':
-            sql = f"{expression.column.name} != ?"
+            sql = f"{column} != {placeholder}"
         elif operator_type == '_gt':
-            sql = f"{expression.column.name} > ?"
+            sql = f"{column} > {placeholder}"
         elif operator_type == '_lt':
-            sql = f"{expression.column.name} < ?"
+            sql = f"{column} < {placeholder}"
         elif operator_type == '_gte':
-            sql = f"{expression.column.name} >= ?"
+            sql = f"{column} >= {placeholder}"
         elif operator_type == '_lte':
-            sql = f"{expression.column.name} <= ?"
+            sql = f"{column} <= {placeholder}"
         else:
             raise ValueError("Invalid Expression Operator Name")
     elif expression.type == 'and':
         if not expression.expressions:
             sql = "1"
         else:
-            clauses = [build_where(expr, args, variables) for expr in expression.expressions]
+            clauses = [build_where(expr, args, variables, variables_alias) for expr in expression.expressions]
             sql = f"({' AND '.join(clauses)})"
     elif expression.type == 'or':
         if not expression.expressions:
             sql = "1"
         else:
-            clauses = [build_where(expr, args, variables) for expr in expression.expressions]
+            clauses = [build_where(expr, args, variables, variables_alias) for expr in expression.expressions]
             sql = f"({' OR '.join(clauses)})"
     elif expression.type == 'not':
-        not_result = build_where(expression.expression, args, variables)
+        not_result = build_where(expression.expression, args, variables, variables_alias)
         sql = f"NOT ({not_result})"
     elif expression.type == 'binary_array_comparison_operator':
         raise ValueError("Binary Array Comparison Operator not implemented")
@@ -108,13 +320,16 @@ def build_query(config: Configuration,
                 path: List[str],
                 variables: Dict[str, Any],
                 args: List[Any],
-                relationship_key: Optional[str]) -> Dict[str, Any]:
+                relationship_key: Optional[str],
+                variables_alias: Optional[str] = None) -> Dict[str, Any]:
     path.append(collection)
     collection_alias = "_".join(path)
+    table = collection
+    if len(path) > 1 and relationship_key is not None:
+        table = query_request.collection_relationships[relationship_key].target_collection
 
     limit_sql = ""
     offset_sql = ""
-    order_by_sql = ""
     collect_rows = []
     where_conditions = ["WHERE 1"]
 
@@ -123,7 +338,7 @@ def build_query(config: Configuration,
         for field_name, field_value in q.fields.items():
             collect_rows.append(escape_single(field_name))
             if field_value.type == 'column':
-                collect_rows.append(escape_double(field_value.column))
+                collect_rows.append(column_sql(config, table, q, field_value.column))
             elif field_value.type == 'relationship':
                 rel_query = build_query(config,
                                         query_request,
@@ -132,7 +347,8 @@ def build_query(config: Configuration,
                                         path.copy(),
                                         variables,
                                         args,
-                                        field_value.relationship)
+                                        field_value.relationship,
+                                        variables_alias)
                 collect_rows.append(f"({rel_query['sql']})")
 
     # Default to selecting all columns if no specific fields are provided
@@ -153,33 +369,46 @@ def build_query(config: Configuration,
     # Build WHERE clause
 
     if q.predicate:
-        where_conditions.append(f'({build_where(q.predicate, args, variables)})')
+        where_conditions.append(f'({build_where(q.predicate, args, variables, variables_alias)})')
+
+    # Keyset pagination continues after the cursor's row, the collection's arguments only apply at the top level
+    cursor = cursor_argument(query_request) if len(path) == 1 else None
+    if cursor is not None:
+        where_conditions.append(build_cursor_condition(keyset_columns(config, table, q), cursor, args))
 
     # Build ORDER BY clause
-    if q.order_by:
-        order_elems = [f'{escape_double(elem.target.name)} {elem.order_direction}' for elem in
-                       q.order_by.elements if elem.target.type == 'column']
-        if order_elems:
-            order_by_sql = f'ORDER BY {", ".join(order_elems)}'
+    order_by_sql = build_order_by(config, table, q, cursor is not None or selects_cursor(q))
 
     # Handle LIMIT and OFFSET
+    # These are bound rather than inlined so that requests differing only in page size share a cached plan
     if q.limit:
-        limit_sql = f'LIMIT {escape_single(q.limit)}'
+        limit_sql = 'LIMIT ?'
+        args.append(q.limit)
     if q.offset:
         if not q.limit:
             limit_sql = f'LIMIT {MAX_32_INT}'
-        offset_sql = f'OFFSET {escape_single(q.offset)}'
+        offset_sql = 'OFFSET ?'
+        args.append(q.offset)
+
+    # Aggregates are computed over the same filtered and paginated rows, rows are skipped if no fields are requested
+    select_columns = []
+    include_rows = not (q.aggregates and q.fields is None)
+    if include_rows:
+        select_columns.append(f'JSON_OBJECT({", ".join(collect_rows)}) as r')
+    aggregates = build_aggregates(q.aggregates, select_columns) if q.aggregates else None
+    if not select_columns:
+        select_columns.append('1')
 
     # Construct the final SQL
     sql = wrap_rows(f"""
 SELECT
-JSON_OBJECT({", ".join(collect_rows)}) as r
+{", ".join(select_columns)}
 FROM {from_sql}
 {" AND ".join(where_conditions)}
 {order_by_sql}
 {limit_sql}
 {offset_sql}
-""")
+""", aggregates, include_rows)
 
     # Wrap in data select for top-level queries
     if len(path) == 1:
@@ -188,58 +417,329 @@ FROM {from_sql}
     return {'sql': sql, 'args': args}
 
 
-async def plan_queries(configuration: Configuration, q: QueryRequest) -> List[Statement]:
+def fingerprint_expression(expression: Expression, slots: List[Tuple[str, Any]]) -> Any:
+    """
+    Describe the structure of a predicate with every bound value replaced by a slot.
+
+    Slots are appended in the same order as build_where appends args.
+    """
+    if expression.type == 'unary_comparison_operator':
+        return ['u', expression.column.name, expression.operator]
+    elif expression.type == 'binary_comparison_operator':
+        value_type = expression.value.type
+        if value_type == 'scalar':
+            slots.append(('scalar', expression.value.value))
+        elif value_type == 'variable':
+            slots.append(('variable', expression.value.name))
+            # Variables are read inline by name when they are iterated inside SQLite
+            return ['b', expression.column.name, expression.operator, value_type, expression.value.name]
+        return ['b', expression.column.name, expression.operator, value_type]
+    elif expression.type in ('and', 'or'):
+        return [expression.type, [fingerprint_expression(expr, slots) for expr in expression.expressions or []]]
+    elif expression.type == 'not':
+        return ['not', fingerprint_expression(expression.expression, slots)]
+    return [expression.type]
+
+
+def fingerprint_query(q: Query, slots: List[Tuple[str, Any]], cursor_args: Optional[List[Any]] = None) -> Any:
+    """
+    Describe the shape of a query, mirroring the traversal order of build_query.
+    """
+    fields = []
+    if q.fields:
+        for field_name, field_value in q.fields.items():
+            if field_value.type == 'column':
+                fields.append([field_name, 'c', field_value.column])
+            elif field_value.type == 'relationship':
+                fields.append([field_name, 'r', field_value.relationship, fingerprint_query(field_value.query, slots)])
+    predicate = fingerprint_expression(q.predicate, slots) if q.predicate else None
+    if cursor_args is not None:
+        slots.extend(('literal', value) for value in cursor_args)
+    order_by = None
+    if q.order_by:
+        order_by = [[elem.target.type, elem.target.name, elem.order_direction] for elem in q.order_by.elements]
+    aggregates = None
+    if q.aggregates:
+        aggregates = [[name, a.type, a.column, a.distinct, a.function] for name, a in q.aggregates.items()]
+    if q.limit:
+        slots.append(('literal', q.limit))
+    if q.offset:
+        slots.append(('literal', q.offset))
+    cursor = len(cursor_args) if cursor_args is not None else None
+    return [fields, aggregates, q.fields is None, predicate, cursor, order_by, bool(q.limit), bool(q.offset)]
+
+
+def fingerprint_request(query_request: QueryRequest,
+                        variables_mode: str = "batch") -> Tuple[str, List[Tuple[str, Any]]]:
+    """
+    Compute a normalized fingerprint of a query request, along with the slots needed to bind its args.
+
+    Two requests with the same fingerprint compile to the same SQL text.
+    """
+    slots = []
+    cursor = cursor_argument(query_request)
+    cursor_args = None
+    if cursor is not None:
+        cursor_args = []
+        # The cursor's length is fixed by the order by and primary key, which are both part of the shape, so only its
+        # values become slots. The primary key columns after the order by sort like the last order by column.
+        columns = order_by_columns(query_request.query)
+        direction = columns[-1][1] if columns else 'asc'
+        keyset = columns[:len(cursor)]
+        keyset.extend(('', direction) for _ in range(len(cursor) - len(keyset)))
+        build_cursor_condition(keyset, cursor, cursor_args)
+    shape = [
+        variables_mode,
+        query_request.collection,
+        fingerprint_query(query_request.query, slots, cursor_args),
+        {k: [v.target_collection, v.column_mapping] for k, v in sorted(query_request.collection_relationships.items())}
+    ]
+    key = hashlib.sha1(json.dumps(shape, separators=(',', ':'), default=str).encode()).hexdigest()
+    return key, slots
+
+
+def bind_args(slots: List[Tuple[str, Any]], variables: Dict[str, Any], inline_variables: bool = False) -> List[Any]:
+    args = []
+    for kind, value in slots:
+        if kind == 'variable':
+            if inline_variables:
+                continue
+            if variables:
+                args.append(variables[value])
+        else:
+            args.append(value)
+    return args
+
+
+def plan_foreach(configuration: Configuration, state: State, q: QueryRequest) -> Statement:
+    """
+    Plan a query with variables as a single statement that iterates the variable sets inside SQLite.
+
+    Identical variable sets are only evaluated once.
+    """
+    unique_sets: Dict[str, int] = {}
+    index = []
+    for var_set in q.variables.values():
+        encoded = json.dumps(var_set, sort_keys=True, separators=(',', ':'))
+        index.append(unique_sets.setdefault(encoded, len(unique_sets)))
+    variables_json = f"[{','.join(unique_sets.keys())}]"
+
+    key, slots = fingerprint_request(q, "json_each")
+    sql = state.plan_cache.get(key)
+    if sql is None:
+        qp = build_query(configuration,
+                         q,
+                         q.collection,
+                         q.query,
+                         [],
+                         {},
+                         [],
+                         None,
+                         VARIABLES_ALIAS)
+        sql = wrap_foreach(qp["sql"])
+        if qp["args"] == bind_args(slots, {}, inline_variables=True):
+            state.plan_cache.put(key, sql)
+
+    args = [variables_json, *bind_args(slots, {}, inline_variables=True), json.dumps(index)]
+    return Statement(sql=sql, args=args)
+
+
+async def plan_queries(configuration: Configuration, state: State, q: QueryRequest) -> List[Statement]:
+    with span("plan_queries", {"ndc_turso.collection": q.collection}) as plan_span:
+        query_plans = build_query_plans(configuration, state, q)
+        if plan_span.is_recording():
+            plan_span.set_attributes(statement_attributes(query_plans))
+        return query_plans
+
+
+def build_query_plans(configuration: Configuration, state: State, q: QueryRequest) -> List[Statement]:
     if not configuration.config:
         raise ValueError("Connector is not properly configured")
 
-    query_plan = []
-    if q.variables:
-        for var_set in q.variables.values():
-            qp = build_query(configuration,
-                             q,
-                             q.collection,
-                             q.query,
-                             [],
-                             var_set,
-                             [],
-                             None)
-            st = Statement(sql=qp["sql"], args=qp["args"])
-            query_plan.append(st)
-    else:
+    if q.variables and configuration.variables_mode == "json_each":
+        return [plan_foreach(configuration, state, q)]
+
+    variable_sets = list(q.variables.values()) if q.variables else [{}]
+    key, slots = fingerprint_request(q)
+    sql = state.plan_cache.get(key)
+    if sql is None:
         qp = build_query(configuration,
                          q,
                          q.collection,
                          q.query,
                          [],
-                         {},
+                         variable_sets[0],
                          [],
                          None)
-        st = Statement(sql=qp["sql"], args=qp["args"])
-        query_plan.append(st)
-    return query_plan
+        sql = qp["sql"]
+        # Only cache the plan if the slots reproduce exactly the args the builder produced
+        if qp["args"] == bind_args(slots, variable_sets[0]):
+            state.plan_cache.put(key, sql)
+
+    return [Statement(sql=sql, args=bind_args(slots, var_set)) for var_set in variable_sets]
+
+
+def request_tables(query_request: QueryRequest) -> Set[str]:
+    """
+    Every table a query request can read: its collection and the targets of the relationships it uses.
+    """
+    collection = query_request.collection
+    if collection.startswith("list_"):
+        collection = collection[len("list_"):]
+    return {collection, *(r.target_collection for r in query_request.collection_relationships.values())}
+
+
+def request_priority(configuration: Configuration, query_request: QueryRequest) -> int:
+    """
+    Single-collection reads with a small limit are admitted before nested, aggregated or unlimited ones.
+    """
+    q = query_request.query
+    if configuration.admission is None or q.limit is None or q.limit > configuration.admission.small_query_limit:
+        return LARGE
+    if q.aggregates or len(query_request.variables or {}) > 1:
+        return LARGE
+    if any(field.type == 'relationship' for field in (q.fields or {}).values()):
+        return LARGE
+    return SMALL
+
+
+async def execute_query_plans(state: State, query_plans: List[Statement], labels: Labels, priority: int) -> List[str]:
+    if state.replica and state.replica.read_your_writes:
+        await state.replica.catch_up()
+    record_statements(query_plans)
+    async with admit(state.read_admission, priority), state.read_pool.acquire() as client:
+        with span("execute_query_plans", {"ndc_turso.collection": labels[0]}) as execute_span:
+            start = time.perf_counter()
+            results = await client.batch(query_plans)
+            state.metrics.execute_seconds.observe(labels, time.perf_counter() - start)
+            # A foreach statement returns one row per variable set, every other statement returns exactly one row
+            row_sets = [row["data"] for r in results for row in r.rows]
+            if execute_span.is_recording():
+                execute_span.set_attributes(statement_attributes(query_plans))
+                execute_span.set_attribute("ndc_turso.response_bytes", sum(len(data) for data in row_sets))
+    state.metrics.statements.inc(labels, len(query_plans))
+    state.metrics.batches.inc(labels)
+    return row_sets
+
 
+def query_plans_key(query_plans: List[Statement]) -> str:
+    return hashlib.sha1(json.dumps([[p.sql, p.args] for p in query_plans], default=str).encode()).hexdigest()
 
-async def perform_query(state: State, query_plans: List[Statement]) -> QueryResponse:
-    client = state.client
-    results = await client.batch(query_plans)
-    res = [json.loads(r.rows[0]["data"]) for r in results]
+
+async def cached_row_sets(state: State,
+                          key: str,
+                          tables: Optional[Set[str]],
+                          execute: Callable[[], Awaitable[List[str]]],
+                          coalesce: bool = True) -> List[str]:
+    """
+    Return the row sets cached under key, or run execute for them. Results are cached when the result cache is enabled
+    and the tables read are known. Concurrent executions under the same key share one run unless coalesce is off.
+    """
+    cache = state.result_cache if tables is not None else None
+    single_flight = state.single_flight if coalesce else None
+    if cache is None and single_flight is None:
+        return await execute()
+    if cache is not None:
+        row_sets = cache.get(key)
+        if row_sets is not None:
+            return row_sets
+        versions = cache.versions(tables)
+    if single_flight is not None:
+        row_sets = await single_flight.run(key, execute)
+    else:
+        row_sets = await execute()
+    if cache is not None:
+        cache.put(key, row_sets, sum(len(data) for data in row_sets), versions)
+    return row_sets
+
+
+async def perform_query_raw(state: State,
+                            query_plans: List[Statement],
+                            tables: Optional[Set[str]] = None,
+                            coalesce: bool = True,
+                            labels: Labels = ("", "query"),
+                            priority: int = LARGE) -> List[str]:
+    """
+    Execute the query plans and return the JSON text SQLite built for each row set, without decoding it.
+
+    Results are cached and coalesced on the SQL and args, see cached_row_sets.
+    """
+    if (state.result_cache is None or tables is None) and (state.single_flight is None or not coalesce):
+        return await execute_query_plans(state, query_plans, labels, priority)
+    return await cached_row_sets(state,
+                                 query_plans_key(query_plans),
+                                 tables,
+                                 lambda: execute_query_plans(state, query_plans, labels, priority),
+                                 coalesce)
+
+
+async def decode_query(state: State,
+                       query_plans: List[Statement],
+                       tables: Optional[Set[str]],
+                       labels: Labels,
+                       priority: int) -> QueryResponse:
+    row_sets = await perform_query_raw(state, query_plans, tables, coalesce=False, labels=labels, priority=priority)
+    with span("decode_query", {"ndc_turso.collection": labels[0]}) as decode_span:
+        start = time.perf_counter()
+        res = [json.loads(data) for data in row_sets]
+        state.metrics.decode_seconds.observe(labels, time.perf_counter() - start)
+        response_bytes = sum(len(data) for data in row_sets)
+        rows = sum(len(row_set.get("rows") or []) for row_set in res)
+        decode_span.set_attribute("ndc_turso.response_bytes", response_bytes)
+        decode_span.set_attribute("ndc_turso.rows", rows)
+    state.metrics.response_bytes.observe(labels, response_bytes)
+    state.metrics.rows.inc(labels, rows)
     return res
 
 
-async def query(configuration: Configuration, state: State, query_request: QueryRequest) -> QueryResponse:
+async def perform_query(state: State,
+                        query_plans: List[Statement],
+                        tables: Optional[Set[str]] = None,
+                        coalesce: bool = True,
+                        labels: Labels = ("", "query"),
+                        priority: int = LARGE) -> QueryResponse:
+    if coalesce and state.single_flight is not None:
+        # Concurrent callers share the decoded result as well as the execution
+        return await state.single_flight.run(("decoded", query_plans_key(query_plans)),
+                                             lambda: decode_query(state, query_plans, tables, labels, priority))
+    res = await decode_query(state, query_plans, tables, labels, priority)
+    return res
+
+
+def raw_query_response(row_sets: List[str]) -> Response:
+    # The row sets are already complete JSON documents, so the response body is just their concatenation
+    return Response(content=f"[{','.join(row_sets)}]".encode(), media_type="application/json")
+
+
+def rewrite_function_collection(query_request: QueryRequest) -> None:
+    """
+    Turn a request for a list_ function into a request for its table, taking the limit and offset from the
+    function's arguments. The query's own predicate is kept.
+    """
     if query_request.collection.startswith("list_"):
-        # This won't work. :/ Blocked again.
-        # Functional Queries just can't return Anything? I'm so confused.
         query_request.collection = query_request.collection[len("list_"):]
-        if query_request.arguments.get("limit") is not None:
-            limit = query_request.arguments.get("limit", None)
-            if limit is not None and limit.value is not None:
-                limit = limit.value
-            offset = None
-            where = None
-            query_request.query.limit = limit
-            query_request.query.offset = offset
-            query_request.query.where = where
-    query_plans = await plan_queries(configuration, query_request)
-    query_response = await perform_query(state, query_plans)
+        limit = query_request.arguments.get("limit")
+        if limit is not None:
+            offset = query_request.arguments.get("offset")
+            query_request.query.limit = limit.value
+            query_request.query.offset = offset.value if offset is not None else None
+
+
+async def query(configuration: Configuration,
+                state: State,
+                query_request: QueryRequest) -> Union[QueryResponse, Response]:
+    rewrite_function_collection(query_request)
+    labels = (query_request.collection, "query")
+    start = time.perf_counter()
+    query_plans = await plan_queries(configuration, state, query_request)
+    state.metrics.plan_seconds.observe(labels, time.perf_counter() - start)
+    tables = request_tables(query_request)
+    priority = request_priority(configuration, query_request)
+    if configuration.json_passthrough:
+        # The body is never decoded, so its rows are not counted
+        row_sets = await perform_query_raw(state, query_plans, tables, labels=labels, priority=priority)
+        response = raw_query_response(row_sets)
+        state.metrics.response_bytes.observe(labels, len(response.body))
+        return response
+    query_response = await perform_query(state, query_plans, tables, labels=labels, priority=priority)
     return query_response
@@ -0,0 +1,294 @@
+try:
+    from models import Configuration, State, QueryRequest, QueryResponse, Query, Field
+except ImportError:
+    from ..models import Configuration, State, QueryRequest, QueryResponse, Query, Field
+
+try:
+    from handlers.query import build_query, build_where, escape_double, column_sql, cursor_argument, \
+        keyset_columns, build_cursor_condition, build_order_by, selects_cursor, cached_row_sets, request_tables, \
+        raw_query_response
+except ImportError:
+    from query import build_query, build_where, escape_double, column_sql, cursor_argument, keyset_columns, \
+        build_cursor_condition, build_order_by, selects_cursor, cached_row_sets, request_tables, raw_query_response
+from typing import List, Any, Callable, Dict, Optional, Tuple, Union
+from operator import itemgetter
+import hashlib
+import json
+import time
+from fastapi import Response
+from libsql_client import Statement
+
+try:
+    from constants import MAX_32_INT
+except ImportError:
+    from ..constants import MAX_32_INT
+
+try:
+    from admission import admit, LARGE
+except ImportError:
+    from ..admission import admit, LARGE
+
+try:
+    from slow_query_log import record_statements
+except ImportError:
+    from ..slow_query_log import record_statements
+
+try:
+    from tracing import span, statement_attributes
+except ImportError:
+    from ..tracing import span, statement_attributes
+
+# The strategy can be picked per request, or per relationship field, with a literal argument of this name
+STRATEGY_ARGUMENT = "relationship_strategy"
+ROW_NUMBER_ALIAS = "__rn"
+
+
+def strategy_argument(arguments: Optional[Dict[str, Any]]) -> Optional[str]:
+    argument = (arguments or {}).get(STRATEGY_ARGUMENT)
+    if argument is None:
+        return None
+    if argument.type != 'literal' or argument.value not in ("subquery", "batched"):
+        raise ValueError(f"{STRATEGY_ARGUMENT} must be the literal subquery or batched")
+    return argument.value
+
+
+def request_strategy(configuration: Configuration, query_request: QueryRequest) -> str:
+    return strategy_argument(query_request.arguments) or configuration.relationship_strategy
+
+
+def field_strategy(default: str, field: Field) -> str:
+    # Aggregates are only computed by the correlated subquery
+    if field.query.aggregates or not field.query.fields:
+        return "subquery"
+    return strategy_argument(field.arguments) or default
+
+
+def use_batched_relationships(configuration: Configuration, query_request: QueryRequest) -> bool:
+    q = query_request.query
+    # Requests with variables are iterated inside SQLite by the subquery strategy in a single statement, batching
+    # them would cost a round trip per variable set and level
+    if query_request.collection.startswith("list_") or q.aggregates or not q.fields or query_request.variables:
+        return False
+    default = request_strategy(configuration, query_request)
+    return any(field.type == 'relationship' and field_strategy(default, field) == "batched"
+               for field in q.fields.values())
+
+
+def key_getter(positions: List[int]) -> Callable[[tuple], tuple]:
+    # itemgetter only returns a tuple for two or more items
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda values: (values[position],)
+    if not positions:
+        return lambda values: ()
+    return itemgetter(*positions)
+
+
+def build_level(configuration: Configuration,
+                query_request: QueryRequest,
+                table: str,
+                q: Query,
+                path: List[str],
+                variables: Dict[str, Any],
+                default: str,
+                key_columns: Optional[List[str]] = None,
+                keys: Optional[List[list]] = None) -> Tuple[Statement, Dict[str, tuple], List[int]]:
+    """
+    Build the statement fetching one level of rows, restricted to the rows matching one of keys when key_columns are
+    given. Limit and offset apply per key, through ROW_NUMBER over the key columns.
+
+    Returns the statement, how to read each field from a result row, and the positions of the key columns.
+    """
+    collection_alias = "_".join(path)
+    columns = []
+    args = []
+
+    def select(expression: str) -> int:
+        columns.append(expression)
+        return len(columns) - 1
+
+    fields = {}
+    for field_name, field_value in q.fields.items():
+        if field_value.type == 'column':
+            fields[field_name] = ('column', select(column_sql(configuration, table, q, field_value.column)))
+        elif field_strategy(default, field_value) == "batched":
+            relationship = query_request.collection_relationships[field_value.relationship]
+            fields[field_name] = ('batched', [select(escape_double(c)) for c in relationship.column_mapping.keys()])
+        else:
+            rel_query = build_query(configuration,
+                                    query_request,
+                                    field_name,
+                                    field_value.query,
+                                    path.copy(),
+                                    variables,
+                                    args,
+                                    field_value.relationship)
+            fields[field_name] = ('subquery', select(f"({rel_query['sql']})"))
+
+    where_conditions = ["WHERE 1"]
+    key_positions = []
+    if key_columns:
+        key_positions = [select(escape_double(c)) for c in key_columns]
+        extracts = ", ".join(f"JSON_EXTRACT(value, '$[{i}]')" for i in range(len(key_columns)))
+        where_conditions.append(f"({', '.join(escape_double(c) for c in key_columns)}) IN "
+                                f"(SELECT {extracts} FROM JSON_EACH(?))")
+        args.append(json.dumps(keys))
+    if q.predicate:
+        where_conditions.append(f'({build_where(q.predicate, args, variables)})')
+    cursor = cursor_argument(query_request) if len(path) == 1 else None
+    if cursor is not None:
+        where_conditions.append(build_cursor_condition(keyset_columns(configuration, table, q), cursor, args))
+
+    order_by_sql = build_order_by(configuration, table, q, cursor is not None or selects_cursor(q))
+
+    paged = key_columns and (q.limit or q.offset)
+    if paged:
+        # Number the rows of each parent, so that one pass can keep the page of every parent
+        partition = ", ".join(escape_double(c) for c in key_columns)
+        select(f"ROW_NUMBER() OVER (PARTITION BY {partition} {order_by_sql}) as {escape_double(ROW_NUMBER_ALIAS)}")
+
+    sql = f"""
+SELECT
+{", ".join(columns)}
+FROM {escape_double(table)} as {escape_double(collection_alias)}
+{" AND ".join(where_conditions)}
+"""
+    if paged:
+        sql = f"""
+SELECT * FROM ({sql})
+WHERE {escape_double(ROW_NUMBER_ALIAS)} > ? AND {escape_double(ROW_NUMBER_ALIAS)} <= ?
+ORDER BY {escape_double(ROW_NUMBER_ALIAS)}
+"""
+        args.append(q.offset or 0)
+        args.append((q.offset or 0) + q.limit if q.limit else MAX_32_INT)
+    else:
+        sql += order_by_sql
+        if q.limit:
+            sql += "\nLIMIT ?"
+            args.append(q.limit)
+        if q.offset:
+            if not q.limit:
+                sql += f"\nLIMIT {MAX_32_INT}"
+            sql += "\nOFFSET ?"
+            args.append(q.offset)
+    return Statement(sql=sql, args=args), fields, key_positions
+
+
+async def fetch_level(configuration: Configuration,
+                      state: State,
+                      query_request: QueryRequest,
+                      table: str,
+                      q: Query,
+                      path: List[str],
+                      variables: Dict[str, Any],
+                      default: str,
+                      key_columns: Optional[List[str]] = None,
+                      keys: Optional[List[list]] = None) -> List[Tuple[tuple, dict]]:
+    """
+    Fetch one level of rows and, level by level, the rows of its batched relationships, stitching them onto their
+    parents. Returns each row with the values of its key columns.
+    """
+    labels = (query_request.collection, "query")
+    start = time.perf_counter()
+    statement, fields, key_positions = build_level(configuration, query_request, table, q, path, variables, default,
+                                                   key_columns, keys)
+    state.metrics.plan_seconds.observe(labels, time.perf_counter() - start)
+    record_statements([statement])
+    # Batching is only picked for relationships, which are never small queries
+    async with admit(state.read_admission, LARGE), state.read_pool.acquire() as client:
+        with span("fetch_level", {"ndc_turso.collection": table}) as execute_span:
+            start = time.perf_counter()
+            result_set = (await client.batch([statement]))[0]
+            state.metrics.execute_seconds.observe(labels, time.perf_counter() - start)
+            if execute_span.is_recording():
+                execute_span.set_attributes(statement_attributes([statement]))
+                execute_span.set_attribute("ndc_turso.path", ".".join(path))
+                execute_span.set_attribute("ndc_turso.rows", len(result_set.rows))
+    state.metrics.statements.inc(labels)
+    state.metrics.batches.inc(labels)
+    result_rows = [row.astuple() for row in result_set.rows]
+
+    children = {}
+    for field_name, (kind, positions) in fields.items():
+        if kind != 'batched':
+            continue
+        field_value = q.fields[field_name]
+        relationship = query_request.collection_relationships[field_value.relationship]
+        get_key = key_getter(positions)
+        # Rows with a NULL in the key can never match a child
+        parent_keys = list(dict.fromkeys(key for key in map(get_key, result_rows) if None not in key))
+        rows_by_key = {}
+        if parent_keys:
+            child_rows = await fetch_level(configuration,
+                                           state,
+                                           query_request,
+                                           relationship.target_collection,
+                                           field_value.query,
+                                           path + [field_name],
+                                           variables,
+                                           default,
+                                           list(relationship.column_mapping.values()),
+                                           [list(key) for key in parent_keys])
+            for key, row in child_rows:
+                rows_by_key.setdefault(key, []).append(row)
+        children[field_name] = (get_key, rows_by_key)
+
+    # Every field is first read from a column of the result row, which keeps the fields in the requested order, then
+    # the relationship fields are replaced with their rows
+    start = time.perf_counter()
+    field_names = list(fields)
+    get_values = key_getter([kind_position[1] if kind_position[0] != 'batched' else kind_position[1][0]
+                             for kind_position in fields.values()])
+    subqueries = [field_name for field_name, (kind, _) in fields.items() if kind == 'subquery']
+    get_row_key = key_getter(key_positions)
+    rows = []
+    for result_row in result_rows:
+        row = dict(zip(field_names, get_values(result_row)))
+        for field_name in subqueries:
+            if row[field_name] is not None:
+                row[field_name] = json.loads(row[field_name])
+        for field_name, (get_key, rows_by_key) in children.items():
+            row[field_name] = {"rows": rows_by_key.get(get_key(result_row), [])}
+        rows.append((get_row_key(result_row), row))
+    state.metrics.decode_seconds.observe(labels, time.perf_counter() - start)
+    return rows
+
+
+async def query_batched(configuration: Configuration,
+                        state: State,
+                        query_request: QueryRequest) -> Union[QueryResponse, Response]:
+    """
+    Answer the query with one statement per relationship level, instead of a correlated subquery per parent row.
+    Requests with variables are left to the subquery strategy, see use_batched_relationships.
+    """
+    if not configuration.config:
+        raise ValueError("Connector is not properly configured")
+    if query_request.variables:
+        raise ValueError("Requests with variables use the subquery strategy")
+    if state.replica and state.replica.read_your_writes:
+        await state.replica.catch_up()
+
+    default = request_strategy(configuration, query_request)
+    labels = (query_request.collection, "query")
+
+    async def fetch() -> List[str]:
+        rows = await fetch_level(configuration,
+                                 state,
+                                 query_request,
+                                 query_request.collection,
+                                 query_request.query,
+                                 [query_request.collection],
+                                 {},
+                                 default)
+        state.metrics.rows.inc(labels, len(rows))
+        return [json.dumps({"rows": [row for _, row in rows]}, separators=(",", ":"), ensure_ascii=False)]
+
+    # Cached and coalesced like the subquery strategy, on the request since the statements of the lower levels
+    # depend on the rows above them
+    key = hashlib.sha1(f"batched:{default}:{query_request.model_dump_json()}".encode()).hexdigest()
+    row_sets = await cached_row_sets(state, key, request_tables(query_request), fetch)
+    if configuration.json_passthrough:
+        response = raw_query_response(row_sets)
+        state.metrics.response_bytes.observe(labels, len(response.body))
+        return response
+    return [json.loads(data) for data in row_sets]
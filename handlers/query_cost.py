@@ -0,0 +1,221 @@
+try:
+    from models import Configuration, State, QueryRequest, Query, Expression
+except ImportError:
+    from ..models import Configuration, State, QueryRequest, Query, Expression
+from typing import List, Optional, Tuple
+import time
+
+try:
+    from table_statistics import TableStatistics, load_table_statistics
+except ImportError:
+    from ..table_statistics import TableStatistics, load_table_statistics
+
+EQUALITY_OPERATORS = ["_eq"]
+RANGE_OPERATORS = ["_gt", "_lt", "_gte", "_lte"]
+
+# The fraction of rows assumed to pass a comparison no index serves, and of an index range scan
+PREDICATE_SELECTIVITY = 0.25
+# How many of the most expensive levels are described when a query is rejected
+MAX_REASONS = 3
+
+
+class QueryTooExpensive(ValueError):
+    """
+    Raised at plan time for a query whose estimated cost or depth is over the configured maximum.
+    """
+
+
+class LevelCost:
+    """
+    The estimate for one level of a query: the collection, or a relationship field, read once per parent row.
+    """
+
+    def __init__(self, path: str, parents: float, scanned: float, rows: float, access: str):
+        self.path = path
+        self.parents = parents
+        # Rows read per parent row, and rows returned in total
+        self.scanned = scanned
+        self.rows = rows
+        self.access = access
+
+    @property
+    def cost(self) -> float:
+        return self.parents * self.scanned
+
+    def describe(self) -> str:
+        return f"{self.path}: {self.access}, {self.scanned:,.0f} rows read per parent row x {self.parents:,.0f} " \
+               f"parent rows"
+
+
+def predicate_columns(expression: Optional[Expression], equality: List[str], ranges: List[str]) -> None:
+    """
+    Collect the columns compared in the top-level conjunction, only these can be served by a single index.
+    """
+    if expression is None:
+        return
+    if expression.type == 'and':
+        for sub_expression in expression.expressions or []:
+            predicate_columns(sub_expression, equality, ranges)
+    elif expression.type == 'unary_comparison_operator' and not expression.column.path:
+        equality.append(expression.column.name)
+    elif expression.type == 'binary_comparison_operator' and not expression.column.path:
+        if expression.operator in EQUALITY_OPERATORS:
+            equality.append(expression.column.name)
+        elif expression.operator in RANGE_OPERATORS:
+            ranges.append(expression.column.name)
+
+
+def request_collection(query_request: QueryRequest) -> str:
+    collection = query_request.collection
+    if collection.startswith("list_"):
+        collection = collection[len("list_"):]
+    return collection
+
+
+def apply_limits(configuration: Configuration, query_request: QueryRequest) -> QueryRequest:
+    """
+    Give every level without a limit its collection's default limit, falling back to the maximum limit, and reject
+    limits over the maximum. Levels with aggregates are left alone, their aggregates are computed over the page.
+    Returns a limited copy, the incoming request is left as the client sent it.
+    """
+    query_cost = configuration.query_cost
+    query_request = query_request.model_copy(deep=True)
+
+    def apply(table: str, path: str, q: Query) -> None:
+        limits = query_cost.collections.get(table)
+        default_limit = limits.default_limit if limits and limits.default_limit is not None else \
+            query_cost.default_limit
+        max_limit = limits.max_limit if limits and limits.max_limit is not None else query_cost.max_limit
+        if q.limit is None and not q.aggregates:
+            q.limit = default_limit if default_limit is not None else max_limit
+        if max_limit is not None and q.limit is not None and q.limit > max_limit:
+            raise QueryTooExpensive(f"The limit {q.limit} of {path} is over the maximum limit {max_limit} of "
+                                    f"{table}")
+        for field_name, field_value in (q.fields or {}).items():
+            if field_value.type == 'relationship':
+                relationship = query_request.collection_relationships[field_value.relationship]
+                apply(relationship.target_collection, f"{path}.{field_name}", field_value.query)
+
+    collection = request_collection(query_request)
+    limit_argument = query_request.arguments.get("limit")
+    if query_request.collection.startswith("list_") and limit_argument is not None and \
+            limit_argument.value is not None:
+        # Function collections take their limit from the argument, which replaces the query's limit
+        query_request.query.limit = limit_argument.value
+    apply(collection, collection, query_request.query)
+    return query_request
+
+
+def estimate_level(statistics: TableStatistics,
+                   query_request: QueryRequest,
+                   table: str,
+                   path: str,
+                   q: Query,
+                   parent_table: Optional[str],
+                   join_columns: List[str],
+                   parents: float,
+                   levels: List[LevelCost]) -> int:
+    """
+    Estimate the rows each level reads and returns, and return the relationship depth below it.
+
+    A level is read once per row of its parent level. The join columns and equality predicates are served by the
+    longest index prefix they cover, otherwise the whole table is scanned. Without sqlite_stat1 a join spreads the
+    table's rows evenly over the parent table's rows. Every comparison the index does not serve keeps
+    PREDICATE_SELECTIVITY of the rows. Without an ORDER BY the scan stops once the limit is reached.
+    """
+    equality = []
+    ranges = []
+    predicate_columns(q.predicate, equality, ranges)
+    table_rows = statistics.table_rows(table)
+
+    prefix = statistics.index_prefix(table, join_columns + equality)
+    if prefix:
+        fan_out = None
+        if parent_table is not None and set(prefix) <= set(join_columns):
+            fan_out = max(table_rows / max(statistics.table_rows(parent_table), 1), 1)
+        available = statistics.rows_per_key(table, prefix, fan_out)
+        access = f"index lookup on {', '.join(prefix)}"
+    elif ranges and statistics.index_prefix(table, ranges[:1]):
+        available = table_rows * PREDICATE_SELECTIVITY
+        prefix = (ranges[0],)
+        access = f"index range on {ranges[0]}"
+    else:
+        available = table_rows
+        access = "full scan" + (f", no index on {', '.join(join_columns)}" if join_columns else "")
+
+    selectivity = PREDICATE_SELECTIVITY ** len([c for c in join_columns + equality + ranges if c not in prefix])
+    matching = available * selectivity
+    scanned = available
+    if q.limit:
+        wanted = q.limit + (q.offset or 0)
+        if not q.order_by or not q.order_by.elements:
+            scanned = min(available, wanted / selectivity)
+        matching = min(matching, wanted)
+    else:
+        access += ", no limit"
+    rows = parents * matching
+    levels.append(LevelCost(path, parents, scanned, rows, access))
+
+    child_depth = 0
+    for field_name, field_value in (q.fields or {}).items():
+        if field_value.type == 'relationship':
+            relationship = query_request.collection_relationships[field_value.relationship]
+            child_depth = max(child_depth, 1 + estimate_level(statistics,
+                                                              query_request,
+                                                              relationship.target_collection,
+                                                              f"{path}.{field_name}",
+                                                              field_value.query,
+                                                              table,
+                                                              list(relationship.column_mapping.values()),
+                                                              rows,
+                                                              levels))
+    return child_depth
+
+
+def estimate_cost(statistics: TableStatistics, query_request: QueryRequest) -> Tuple[float, int, List[LevelCost]]:
+    """
+    The estimated rows read by the whole request, its relationship depth and the estimate of every level.
+    """
+    collection = request_collection(query_request)
+    levels = []
+    depth = estimate_level(statistics, query_request, collection, collection, query_request.query, None, [], 1, levels)
+    variable_sets = max(len(query_request.variables or {}), 1)
+    return sum(level.cost for level in levels) * variable_sets, depth, levels
+
+
+async def get_table_statistics(configuration: Configuration, state: State) -> TableStatistics:
+    statistics = state.table_statistics
+    if statistics is None or time.monotonic() - statistics.loaded_at > configuration.query_cost.statistics_ttl:
+        object_fields = configuration.config.object_fields
+        async with state.read_pool.acquire() as client:
+            statistics = await load_table_statistics(
+                client,
+                configuration.config.collection_names,
+                {table: fields.primary_keys for table, fields in object_fields.items()},
+                {table: fields.unique_keys for table, fields in object_fields.items()})
+        state.table_statistics = statistics
+    return statistics
+
+
+async def check_query_cost(configuration: Configuration,
+                           state: State,
+                           query_request: QueryRequest) -> Tuple[QueryRequest, Optional[float]]:
+    """
+    Apply the configured limits to a copy of the request, then reject it if it is too deep or its estimated cost is
+    over the maximum. Returns the limited request to run and the estimated cost, or the request unchanged and None
+    when no query cost settings are configured.
+    """
+    query_cost = configuration.query_cost
+    if query_cost is None or not configuration.config:
+        return query_request, None
+    query_request = apply_limits(configuration, query_request)
+    statistics = await get_table_statistics(configuration, state)
+    cost, depth, levels = estimate_cost(statistics, query_request)
+    if query_cost.max_depth is not None and depth > query_cost.max_depth:
+        raise QueryTooExpensive(f"The query nests relationships {depth} deep, the maximum is {query_cost.max_depth}")
+    if query_cost.max_cost is not None and cost > query_cost.max_cost:
+        reasons = sorted(levels, key=lambda level: level.cost, reverse=True)[:MAX_REASONS]
+        raise QueryTooExpensive(f"The query is estimated to read {cost:,.0f} rows, the maximum is "
+                                f"{query_cost.max_cost:,.0f}. Add limits or filter on indexed columns. Most "
+                                f"expensive: {'; '.join(level.describe() for level in reasons)}")
+    return query_request, cost
@@ -3,6 +3,100 @@ try:
 except ImportError:
     from ..models import Configuration, State, QueryRequest, ExplainResponse
 
+try:
+    from handlers.query import plan_queries, rewrite_function_collection
+except ImportError:
+    from query import plan_queries, rewrite_function_collection
+
+try:
+    from handlers.query_cost import check_query_cost
+except ImportError:
+    from query_cost import check_query_cost
+from libsql_client import Client, LibsqlError, Statement
+from typing import Dict, List
+import json
+import re
+import time
+
+# A SCAN step reads every row of its source, we only flag it for tables, not for subqueries, JSON_EACH or constants
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW|\()(\S+)(?!.*VIRTUAL TABLE)")
+TEMP_B_TREE = "USE TEMP B-TREE FOR "
+
+
+def format_plan(rows: List) -> str:
+    """
+    Render EXPLAIN QUERY PLAN rows as the tree the sqlite3 shell prints.
+    """
+    depths = {0: -1}
+    lines = ["QUERY PLAN"]
+    for row in rows:
+        node_id, parent, _, detail = row
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append(f"{'   ' * depths[node_id]}|--{detail}")
+    return "\n".join(lines)
+
+
+async def explain_statements(client: Client, statements: List[Statement]) -> Dict[str, str]:
+    """
+    Run EXPLAIN QUERY PLAN for each statement and describe the SQL, its args and the plan the engine chose.
+
+    When there is more than one statement the keys are prefixed with the statement's position.
+    """
+    start = time.perf_counter()
+    results = await client.batch([Statement(f"EXPLAIN QUERY PLAN {s.sql}", s.args) for s in statements])
+    planning_time = time.perf_counter() - start
+
+    details = {}
+    full_scans = []
+    temp_b_trees = []
+    for i, (statement, result) in enumerate(zip(statements, results)):
+        prefix = f"{i}." if len(statements) > 1 else ""
+        details[f"{prefix}sql"] = statement.sql
+        details[f"{prefix}args"] = json.dumps(list(statement.args or []), default=str)
+        details[f"{prefix}plan"] = format_plan(result.rows)
+        for row in result.rows:
+            detail = row[3]
+            match = FULL_SCAN.match(detail)
+            if match and not match.group(1).startswith("__"):
+                full_scans.append(match.group(1))
+            elif detail.startswith(TEMP_B_TREE):
+                temp_b_trees.append(detail[len(TEMP_B_TREE):])
+    details["planning_time_ms"] = f"{planning_time * 1000:.3f}"
+    details["full_table_scan"] = json.dumps(bool(full_scans))
+    details["full_table_scans"] = ", ".join(full_scans)
+    details["temp_b_tree_order_by"] = json.dumps("ORDER BY" in temp_b_trees)
+    details["temp_b_trees"] = ", ".join(temp_b_trees)
+    return details
+
+
+async def explain_plans(pool, statements: List[Statement]) -> List[str]:
+    """
+    The plan of each statement, or the error explaining it. One statement that cannot be explained, like a statement
+    against a table dropped since, fails the batch, so the statements are then explained one at a time.
+    """
+    explain = [Statement(f"EXPLAIN QUERY PLAN {s.sql}", s.args) for s in statements]
+    async with pool.acquire() as client:
+        try:
+            return [format_plan(result.rows) for result in await client.batch(explain)]
+        except LibsqlError:
+            plans = []
+            for statement in explain:
+                try:
+                    plans.append(format_plan((await client.execute(statement)).rows))
+                except LibsqlError as e:
+                    plans.append(f"EXPLAIN failed: {e}")
+            return plans
+
 
 async def query_explain(configuration: Configuration, state: State, query_request: QueryRequest) -> ExplainResponse:
-    pass
+    start = time.perf_counter()
+    query_request, estimated_cost = await check_query_cost(configuration, state, query_request)
+    rewrite_function_collection(query_request)
+    query_plans = await plan_queries(configuration, state, query_request)
+    sql_generation_time = time.perf_counter() - start
+    async with state.read_pool.acquire() as client:
+        details = await explain_statements(client, query_plans)
+    details["sql_generation_time_ms"] = f"{sql_generation_time * 1000:.3f}"
+    if estimated_cost is not None:
+        details["estimated_cost"] = f"{estimated_cost:.0f}"
+    return ExplainResponse(details=details)
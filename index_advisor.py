@@ -0,0 +1,195 @@
+"""
+Suggest indexes for a workload of observed query shapes.
+
+Every shape is planned like the connector would plan it and run through EXPLAIN QUERY PLAN. For the shapes that scan a
+table or sort in a temporary B-tree, candidate indexes are derived from the relationship join columns, the equality and
+then range predicates, and the sort keys. Candidates already served by an existing index or primary key are dropped, as
+are candidates that are a prefix of another one.
+
+    python index_advisor.py --configuration config.json --shapes http_requests/query.http [--replay]
+
+The shapes file is a JSON query request, a JSON list of them, one per line, or a .http file. With --replay the shapes
+are timed before and after creating the indexes on a copy of the database.
+"""
+from main import RootConnector
+from models import Configuration, State, QueryRequest, Query
+from handlers.query import plan_queries, escape_double
+from handlers.query_explain import explain_statements
+from handlers.query_cost import predicate_columns
+from table_statistics import load_table_statistics
+from libsql_client import Statement
+import libsql_client
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# (table, columns) -> the reasons the index was suggested
+Candidates = Dict[Tuple[str, Tuple[str, ...]], List[str]]
+
+
+def load_shapes(path: str) -> List[QueryRequest]:
+    with open(path, "r") as f:
+        text = f.read()
+    if path.endswith(".http"):
+        # Each request's body follows the first blank line, requests are separated by ###
+        bodies = [request.split("\n\n", 1)[1] for request in text.split("###") if "\n\n" in request.strip()]
+        return [QueryRequest(**json.loads(body)) for body in bodies]
+    try:
+        shapes = json.loads(text)
+    except json.JSONDecodeError:
+        shapes = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(shapes, dict):
+        shapes = [shapes]
+    return [QueryRequest(**shape) for shape in shapes]
+
+
+def collect_candidates(query_request: QueryRequest,
+                       collection: str,
+                       q: Query,
+                       relationship_key: Optional[str],
+                       candidates: Candidates) -> None:
+    table = collection
+    join_columns = []
+    if relationship_key is not None:
+        relationship = query_request.collection_relationships[relationship_key]
+        table = relationship.target_collection
+        join_columns = list(relationship.column_mapping.values())
+
+    equality = []
+    ranges = []
+    predicate_columns(q.predicate, equality, ranges)
+    order_by = [elem.target.name for elem in (q.order_by.elements if q.order_by else [])
+                if elem.target.type == 'column' and not elem.target.path]
+
+    # Equality columns first, then either the sort keys or a single range column
+    columns = list(dict.fromkeys(join_columns + equality + (order_by or ranges[:1])))
+    if columns:
+        reasons = candidates.setdefault((table, tuple(columns)), [])
+        reasons.append(", ".join(
+            part for part in [f"join on {', '.join(join_columns)}" if join_columns else "",
+                              f"equality on {', '.join(equality)}" if equality else "",
+                              f"sort on {', '.join(order_by)}" if order_by else "",
+                              f"range on {ranges[0]}" if ranges and not order_by else ""] if part))
+
+    for field_value in (q.fields or {}).values():
+        if field_value.type == 'relationship':
+            collect_candidates(query_request, table, field_value.query, field_value.relationship, candidates)
+
+
+async def existing_indexes(configuration: Configuration, state: State, tables: List[str]) -> Dict[str, List[List[str]]]:
+    """
+    The column lists of every index on the tables, including the primary key.
+    """
+    primary_keys = {table: configuration.config.object_fields[table].primary_keys for table in tables
+                    if table in configuration.config.object_fields}
+    async with state.read_pool.acquire() as client:
+        statistics = await load_table_statistics(client, tables, primary_keys)
+    return statistics.indexes
+
+
+def minimal_indexes(candidates: Candidates, indexes: Dict[str, List[List[str]]]) -> Candidates:
+    """
+    Drop candidates already served by an existing index, or by a longer candidate they are a prefix of.
+    """
+    kept: Candidates = {}
+    for (table, columns), reasons in sorted(candidates.items(), key=lambda item: -len(item[0][1])):
+        if any(tuple(index[:len(columns)]) == columns for index in indexes.get(table, [])):
+            continue
+        longer = next((key for key in kept if key[0] == table and key[1][:len(columns)] == columns), None)
+        if longer:
+            kept[longer].extend(reasons)
+        else:
+            kept[(table, columns)] = list(reasons)
+    return kept
+
+
+def create_index_sql(table: str, columns: Tuple[str, ...]) -> str:
+    name = f"idx_{table}_{'_'.join(columns)}"
+    return f"CREATE INDEX IF NOT EXISTS {escape_double(name)} ON {escape_double(table)} " \
+           f"({', '.join(escape_double(column) for column in columns)})"
+
+
+async def time_shapes(client: libsql_client.Client, plans: List[List[Statement]], iterations: int) -> List[float]:
+    timings = []
+    for statements in plans:
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await client.batch(statements)
+            samples.append(time.perf_counter() - start)
+        samples.sort()
+        timings.append(samples[len(samples) // 2])
+    return timings
+
+
+async def replay(configuration: Configuration, plans: List[List[Statement]], statements: List[str], iterations: int):
+    url = configuration.credentials.url
+    if not url.startswith("file:"):
+        print("Replay needs a local database file, skipping")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "replay.sqlite")
+        shutil.copy(url[len("file:"):].split("?")[0], path)
+        client = libsql_client.create_client(f"file:{path}")
+        try:
+            before = await time_shapes(client, plans, iterations)
+            await client.batch(statements + ["ANALYZE"])
+            after = await time_shapes(client, plans, iterations)
+        finally:
+            await client.close()
+    for i, (b, a) in enumerate(zip(before, after)):
+        print(json.dumps({"shape": i, "before_ms": round(b * 1000, 3), "after_ms": round(a * 1000, 3),
+                          "speedup": round(b / a, 2) if a else None}))
+
+
+async def advise(configuration_path: str, shapes_path: str, replay_shapes: bool, iterations: int) -> List[str]:
+    connector = RootConnector()
+    configuration = await connector.parse_configuration(configuration_path)
+    state = await connector.try_init_state(configuration, {})
+
+    candidates: Candidates = {}
+    plans = []
+    for i, shape in enumerate(load_shapes(shapes_path)):
+        statements = await plan_queries(configuration, state, shape)
+        plans.append(statements)
+        async with state.read_pool.acquire() as client:
+            details = await explain_statements(client, statements)
+        print(json.dumps({"shape": i, "collection": shape.collection, "full_table_scans": details["full_table_scans"],
+                          "temp_b_trees": details["temp_b_trees"]}))
+        if details["full_table_scan"] == "true" or details["temp_b_trees"]:
+            collect_candidates(shape, shape.collection, shape.query, None, candidates)
+
+    tables = sorted({table for table, _ in candidates})
+    suggestions = minimal_indexes(candidates, await existing_indexes(configuration, state, tables))
+    statements = []
+    for (table, columns), reasons in suggestions.items():
+        print(f"-- {table}({', '.join(columns)}): {'; '.join(dict.fromkeys(reasons))}")
+        statements.append(create_index_sql(table, columns))
+        print(statements[-1] + ";")
+    if not statements:
+        print("-- No indexes to suggest")
+
+    if replay_shapes and statements:
+        await replay(configuration, plans, statements, iterations)
+    await state.read_pool.close()
+    await state.write_pool.close()
+    if state.replica:
+        await state.replica.close()
+    return statements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configuration", default="config.json")
+    parser.add_argument("--shapes", required=True, help="The observed query requests")
+    parser.add_argument("--replay", action="store_true",
+                        help="Time the shapes before and after creating the indexes on a copy of the database")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(advise(args.configuration, args.shapes, args.replay, args.iterations))
@@ -1,18 +1,67 @@
 # from hasura_ndc import *
 from hasura_ndc.models import *
 from hasura_ndc.main import start
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Union
+from fastapi import Response
+import functools
+import itertools
+import math
 import libsql_client
-from models import Configuration, State
-from handlers.query_explain import query_explain
-from handlers.get_schema import get_schema
+from models import Configuration, State, PoolSchema
+from plan_cache import PlanCache
+from result_cache import ResultCache
+from single_flight import SingleFlight
+from admission import AdmissionController, AdmissionRejected
+from slow_query_log import SlowQueryLog, track
+from tracing import sample_request
+from pool import ClientPool
+from replica import EmbeddedReplica
+from stored_sql import create_stored_sql_client, is_remote_url
+from handlers.query_explain import query_explain, explain_plans
+from handlers.mutation_explain import mutation_explain
+from handlers.get_schema import get_schema, prepare_schema
 # from handlers.update_configuration import update_configuration
 from handlers.query import query
-from handlers.mutation import mutation
+from handlers.query_cost import check_query_cost
+from handlers.query_batched import query_batched, use_batched_relationships
+from handlers.mutation import mutation, operation_labels
 from hasura_ndc.connector import Connector
 import json
 
 
+def client_factory(configuration: Configuration, urls: List[str]) -> Callable[[], libsql_client.Client]:
+    # Each new client goes to the next URL, spreading pooled read clients across replicas
+    next_url = itertools.cycle(urls).__next__
+    auth_token = configuration.credentials.auth_token
+
+    def create() -> libsql_client.Client:
+        url = next_url()
+        if configuration.remote.stored_sql and is_remote_url(url):
+            return create_stored_sql_client(url,
+                                            auth_token=auth_token,
+                                            max_stored_sql=configuration.remote.max_stored_sql)
+        return libsql_client.create_client(url, auth_token=auth_token)
+    return create
+
+
+def create_pool(name: str, pool: PoolSchema, factory: Callable[[], libsql_client.Client]) -> ClientPool:
+    return ClientPool(name,
+                      factory,
+                      min_size=pool.min_size,
+                      max_size=pool.max_size,
+                      idle_timeout=pool.idle_timeout,
+                      health_check_interval=pool.health_check_interval,
+                      acquire_timeout=pool.acquire_timeout)
+
+
+def overloaded_response(e: AdmissionRejected) -> Response:
+    # The server answers every exception with a 400, so the 503 has to be returned as a response
+    return Response(status_code=503,
+                    content=json.dumps({"message": str(e), "details": {}}).encode(),
+                    media_type="application/json",
+                    headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
 class RootConnector(Connector[Configuration, State]):
 
     def __init__(self):
@@ -22,27 +71,74 @@ class RootConnector(Connector[Configuration, State]):
         with open(configuration_dir, "r") as f:
             configuration = json.load(f)
         config = Configuration(**configuration)
+        if config.config:
+            await prepare_schema(config)
         return config
 
     async def try_init_state(self, configuration: Configuration, metrics: Any) -> State:
-        credentials = configuration.credentials.model_dump()
-        client = libsql_client.create_client(**credentials)
+        primary_url = configuration.credentials.url
+        read_urls = configuration.read_pool.read_urls or [primary_url]
+        replica = None
+        if configuration.replica:
+            # Reads are served from the local replica file, writes still go to the primary
+            replica = EmbeddedReplica(configuration.replica.path,
+                                      primary_url,
+                                      auth_token=configuration.credentials.auth_token,
+                                      sync_interval=configuration.replica.sync_interval,
+                                      read_your_writes=configuration.replica.read_your_writes,
+                                      read_your_writes_timeout=configuration.replica.read_your_writes_timeout)
+            await replica.start()
+            read_urls = [replica.url]
+        read_pool = create_pool("read", configuration.read_pool, client_factory(configuration, read_urls))
+        write_pool = create_pool("write", configuration.write_pool, client_factory(configuration, [primary_url]))
+        await read_pool.start()
+        await write_pool.start()
+        admission = configuration.admission
+        slow_query_log = None
+        if configuration.slow_query_log:
+            log = configuration.slow_query_log
+            slow_query_log = SlowQueryLog(log.path,
+                                          log.threshold,
+                                          explain=functools.partial(explain_plans, read_pool) if log.explain else None,
+                                          sample_rate=log.sample_rate,
+                                          max_per_second=log.max_per_second,
+                                          max_bytes=log.max_bytes,
+                                          backup_count=log.backup_count,
+                                          redact_args=log.redact_args,
+                                          max_statements=log.max_statements,
+                                          max_args=log.max_args,
+                                          max_sql_length=log.max_sql_length)
         return State(
-            client=client
+            read_pool=read_pool,
+            write_pool=write_pool,
+            replica=replica,
+            plan_cache=PlanCache(max_size=configuration.plan_cache.max_size),
+            result_cache=ResultCache(max_bytes=configuration.result_cache.max_bytes,
+                                     ttl=configuration.result_cache.ttl) if configuration.result_cache else None,
+            single_flight=SingleFlight() if configuration.coalesce_queries else None,
+            read_admission=AdmissionController("read",
+                                               admission.max_concurrent_reads,
+                                               admission.max_queued_reads,
+                                               admission.max_queue_time) if admission else None,
+            write_admission=AdmissionController("write",
+                                                admission.max_concurrent_writes,
+                                                admission.max_queued_writes,
+                                                admission.max_queue_time) if admission else None,
+            slow_query_log=slow_query_log
         )
 
     async def get_capabilities(self, configuration: Configuration) -> CapabilitiesResponse:
         return CapabilitiesResponse(
             version="^0.1.0",
             capabilities=Capabilities(
+                # Not explain: hasura_ndc 0.10 serves /query/explain with query, so it would answer with rows
                 query=QueryCapabilities(
                     aggregates=LeafCapability(),
-                    variables=LeafCapability(),
-                    explain=LeafCapability()
+                    variables=LeafCapability()
                 ),
                 mutation=MutationCapabilities(
                     transactional=LeafCapability(),
-                    explain=None
+                    explain=LeafCapability()
                 ),
                 relationships=RelationshipCapabilities(
                     relation_comparisons=LeafCapability(),
@@ -52,33 +148,79 @@ class RootConnector(Connector[Configuration, State]):
         )
 
     async def get_schema(self,
-                         configuration: Configuration) -> SchemaResponse:
-        return await get_schema(configuration)
+                         configuration: Configuration) -> Union[SchemaResponse, Response]:
+        with sample_request(configuration.tracing.sample_rate):
+            return await get_schema(configuration)
 
     async def query_explain(self,
                             configuration: Configuration,
                             state: State,
                             request: QueryRequest) -> ExplainResponse:
-        return await query_explain(configuration, state, request)
+        # hasura_ndc 0.10 serves /query/explain with query rather than query_explain, so the capability is not
+        # advertised and over HTTP this only runs once the SDK routes it here
+        with sample_request(configuration.tracing.sample_rate):
+            return await query_explain(configuration, state, request)
 
     async def mutation_explain(self,
                                configuration: Configuration,
                                state: State,
                                request: MutationRequest) -> ExplainResponse:
-        pass
+        with sample_request(configuration.tracing.sample_rate):
+            return await mutation_explain(configuration, state, request)
 
-    async def query(self, configuration: Configuration, state: State, request: QueryRequest) -> QueryResponse:
-        return await query(configuration, state, request)
+    async def query(self,
+                    configuration: Configuration,
+                    state: State,
+                    request: QueryRequest) -> Union[QueryResponse, Response]:
+        labels = (request.collection, "query")
+        with track(state.slow_query_log, "query", request), sample_request(configuration.tracing.sample_rate):
+            try:
+                request, _ = await check_query_cost(configuration, state, request)
+                if use_batched_relationships(configuration, request):
+                    return await query_batched(configuration, state, request)
+                return await query(configuration, state, request)
+            except AdmissionRejected as e:
+                return overloaded_response(e)
+            except Exception:
+                state.metrics.errors.inc(labels)
+                raise
 
     async def mutation(self, configuration: Configuration,
                        state: State,
-                       request: MutationRequest) -> MutationResponse:
-        return await mutation(configuration, state, request)
+                       request: MutationRequest) -> Union[MutationResponse, Response]:
+        with track(state.slow_query_log, "mutation", request), sample_request(configuration.tracing.sample_rate):
+            try:
+                return await mutation(configuration, state, request)
+            except AdmissionRejected as e:
+                return overloaded_response(e)
+            except Exception:
+                labels = {operation_labels(op) for op in request.operations}
+                state.metrics.errors.inc(labels.pop() if len(labels) == 1 else ("", "mutation"))
+                raise
 
     async def fetch_metrics(self,
                             configuration: Configuration,
-                            state: State) -> Optional[None]:
-        pass
+                            state: State) -> Optional[Any]:
+        stats = {
+            "plan_cache": state.plan_cache.stats()
+        }
+        if state.result_cache is not None:
+            stats["result_cache"] = state.result_cache.stats()
+        if state.single_flight is not None:
+            stats["single_flight"] = state.single_flight.stats()
+        for name, admission in (("read_admission", state.read_admission), ("write_admission", state.write_admission)):
+            if admission is not None:
+                stats[name] = admission.stats()
+        if state.slow_query_log is not None:
+            stats["slow_query_log"] = state.slow_query_log.stats()
+        if state.replica:
+            stats["replica"] = state.replica.stats()
+        for name, pool in (("read_pool", state.read_pool), ("write_pool", state.write_pool)):
+            stats[name] = pool.stats()
+            client_stats = pool.client_stats()
+            if client_stats:
+                stats[f"{name}_clients"] = client_stats
+        return Response(content=state.metrics.render(stats), media_type="text/plain; version=0.0.4; charset=utf-8")
 
     async def health_check(self,
                            configuration: Configuration,
@@ -0,0 +1,136 @@
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from slow_query_log import record_value
+except ImportError:
+    from .slow_query_log import record_value
+
+# (collection, operation)
+Labels = Tuple[str, str]
+
+PREFIX = "ndc_turso"
+LABEL_NAMES = ("collection", "operation")
+# Seconds, from 50us to 10s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+# Bytes, from 256B to 64MB
+SIZE_BUCKETS = tuple(float(256 * 4 ** i) for i in range(10))
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A counter per label set. inc is a dict lookup and an addition, so it is cheap enough for the hot path.
+
+    With a stage, every increment is also added to the slow query log's record of the current request.
+    """
+
+    def __init__(self, name: str, description: str, stage: Optional[str] = None):
+        self.name = f"{PREFIX}_{name}"
+        self.description = description
+        self.stage = stage
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+        if self.stage is not None:
+            record_value(labels, self.stage, amount)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(LABEL_NAMES, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    A histogram per label set. Each observation increments a single bucket, the buckets are only made cumulative
+    when rendered. Like a counter, a histogram with a stage also adds its observations to the current request's record.
+    """
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float], stage: Optional[str] = None):
+        self.name = f"{PREFIX}_{name}"
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.stage = stage
+        # Per label set: the count of each bucket, then the count above the last bucket, then the sum
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+        if self.stage is not None:
+            record_value(labels, self.stage, value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        names = LABEL_NAMES + ("le",)
+        for labels, series in sorted(self._series.items()):
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), series):
+                count += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + (format_value(bound),))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(LABEL_NAMES, labels)} {format_value(series[-1])}")
+            lines.append(f"{self.name}_count{format_labels(LABEL_NAMES, labels)} {count}")
+        return lines
+
+
+def render_stats(name: str, stats: Any, labels: Tuple[Tuple[str, Any], ...] = ()) -> List[str]:
+    """
+    Render the numeric values of a stats dict, or a list of them, as untyped gauges.
+    """
+    if isinstance(stats, list):
+        return [line for i, item in enumerate(stats) for line in render_stats(name, item, labels + (("client", i),))]
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            metric = f"{PREFIX}_{name}_{key}"
+            lines.append(f"{metric}{format_labels([n for n, _ in labels], [v for _, v in labels])} "
+                         f"{format_value(float(value) if isinstance(value, bool) else value)}")
+    return lines
+
+
+class ConnectorMetrics:
+    """
+    Where the time of each request goes, by collection and operation: the query or the kind of mutation procedure.
+    """
+
+    def __init__(self):
+        self.plan_seconds = Histogram("plan_seconds", "Time spent planning SQL", LATENCY_BUCKETS, "plan")
+        self.execute_seconds = Histogram("execute_seconds", "Time spent executing a batch in the database",
+                                         LATENCY_BUCKETS, "execute")
+        self.decode_seconds = Histogram("decode_seconds", "Time spent decoding JSON results", LATENCY_BUCKETS, "decode")
+        self.response_bytes = Histogram("response_bytes", "Size of response bodies", SIZE_BUCKETS, "response_bytes")
+        self.rows = Counter("rows_total", "Rows returned or affected", "rows")
+        self.statements = Counter("statements_total", "Statements executed")
+        self.batches = Counter("batches_total", "Batches executed")
+        self.errors = Counter("errors_total", "Requests that failed")
+
+    def render(self, stats: Dict[str, Any]) -> str:
+        lines = []
+        for metric in (self.plan_seconds, self.execute_seconds, self.decode_seconds, self.response_bytes, self.rows,
+                       self.statements, self.batches, self.errors):
+            lines.extend(metric.render())
+        for name, value in stats.items():
+            lines.extend(render_stats(name, value))
+        return "\n".join(lines) + "\n"
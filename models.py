@@ -1,7 +1,17 @@
 from hasura_ndc.models import *
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+import pydantic
 from libsql_client import Client
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal, Tuple
+from plan_cache import PlanCache
+from result_cache import ResultCache
+from single_flight import SingleFlight
+from metrics import ConnectorMetrics
+from admission import AdmissionController
+from table_statistics import TableStatistics
+from slow_query_log import SlowQueryLog
+from pool import ClientPool
+from replica import EmbeddedReplica
 
 
 class ForeignKeyDetail(BaseModel):
@@ -13,15 +23,27 @@ class ObjectFieldDetails(BaseModel):
     field_names: List[str]
     field_types: Dict[str, str]
     primary_keys: List[str]
-    unique_keys: List[str]
+    # One list of columns per unique index
+    unique_keys: List[List[str]]
     nullable_keys: List[str]
     foreign_keys: Dict[str, ForeignKeyDetail]
 
+    @pydantic.field_validator("unique_keys", mode="before")
+    @classmethod
+    def group_unique_keys(cls, value):
+        # Older configurations flattened every unique index into one list of columns, which can only be read back
+        # as a single composite key until the configuration is updated
+        if value and all(isinstance(column, str) for column in value):
+            return [value]
+        return value
+
 
 class ConfigurationSchema(BaseModel):
     collection_names: List[str]
     object_types: Dict[str, ObjectType]
     object_fields: Dict[str, ObjectFieldDetails]
+    schema_version: Optional[int] = None
+    table_hashes: Dict[str, str] = {}
 
 
 class CredentialsSchema(BaseModel):
@@ -29,13 +51,137 @@ class CredentialsSchema(BaseModel):
     auth_token: Optional[str] = None
 
 
+class PlanCacheSchema(BaseModel):
+    max_size: int = 256
+
+
+class RemoteSchema(BaseModel):
+    stored_sql: bool = True
+    max_stored_sql: int = 1000
+
+
+class PoolSchema(BaseModel):
+    min_size: int = 1
+    max_size: int = 1
+    idle_timeout: float = 300.0
+    health_check_interval: float = 30.0
+    acquire_timeout: Optional[float] = None
+
+
+class ReadPoolSchema(PoolSchema):
+    max_size: int = 4
+    read_urls: List[str] = []
+
+
+class ReplicaSchema(BaseModel):
+    path: str
+    sync_interval: float = 60.0
+    # Every read waits for a sync after any write through the connector, not just the writer's own reads
+    read_your_writes: bool = False
+    read_your_writes_timeout: float = 5.0
+
+
+class MutationSchema(BaseModel):
+    # SQLite's default SQLITE_MAX_VARIABLE_NUMBER since 3.32.0
+    max_parameters: int = 32766
+    max_rows_per_statement: int = 4096
+    statement_timings: bool = False
+
+
+class ResultCacheSchema(BaseModel):
+    max_bytes: int = 64 * 1024 * 1024
+    ttl: float = 5.0
+
+
+class AdmissionSchema(BaseModel):
+    max_concurrent_reads: int = 4
+    max_concurrent_writes: int = 1
+    max_queued_reads: int = 64
+    max_queued_writes: int = 64
+    # Seconds a request may wait for a slot before it is rejected, None waits as long as it takes
+    max_queue_time: Optional[float] = 1.0
+    # Single-collection reads with at most this limit are admitted before everything else
+    small_query_limit: int = 100
+
+
+class CollectionLimitsSchema(BaseModel):
+    default_limit: Optional[int] = None
+    max_limit: Optional[int] = None
+
+
+class QueryCostSchema(BaseModel):
+    # Applied to every collection, or relationship field, queried without a limit
+    default_limit: Optional[int] = None
+    # Larger limits are rejected, and the default limit when there is none
+    max_limit: Optional[int] = None
+    # Per collection overrides of the limits
+    collections: Dict[str, CollectionLimitsSchema] = {}
+    # The deepest nesting of relationship fields allowed
+    max_depth: Optional[int] = None
+    # Queries estimated to read more rows than this are rejected
+    max_cost: Optional[float] = 10000000
+    # Seconds before the row counts and indexes are read again
+    statistics_ttl: float = 300.0
+
+
+class SlowQueryLogSchema(BaseModel):
+    path: str = "slow_queries.ndjson"
+    # Requests taking at least this many seconds are logged
+    threshold: float = 1.0
+    # The fraction of slow requests logged, and at most this many per second
+    sample_rate: float = 1.0
+    max_per_second: float = 10.0
+    # The file is rotated once it reaches max_bytes, keeping backup_count old files
+    max_bytes: int = 64 * 1024 * 1024
+    backup_count: int = 5
+    # Log the type of each bound arg instead of its value
+    redact_args: bool = False
+    explain: bool = True
+    max_statements: int = 20
+    max_args: int = 100
+    max_sql_length: int = 10000
+
+
+class TracingSchema(BaseModel):
+    # The fraction of traced requests whose connector spans are recorded
+    sample_rate: float = 1.0
+
+
 class Configuration(BaseModel):
     credentials: CredentialsSchema
     config: Optional[ConfigurationSchema] = None
+    plan_cache: PlanCacheSchema = PlanCacheSchema()
+    variables_mode: Literal["batch", "json_each"] = "json_each"
+    relationship_strategy: Literal["subquery", "batched"] = "subquery"
+    remote: RemoteSchema = RemoteSchema()
+    read_pool: ReadPoolSchema = ReadPoolSchema()
+    write_pool: PoolSchema = PoolSchema()
+    replica: Optional[ReplicaSchema] = None
+    json_passthrough: bool = True
+    mutations: MutationSchema = MutationSchema()
+    result_cache: Optional[ResultCacheSchema] = None
+    coalesce_queries: bool = True
+    admission: Optional[AdmissionSchema] = None
+    query_cost: Optional[QueryCostSchema] = None
+    slow_query_log: Optional[SlowQueryLogSchema] = None
+    tracing: TracingSchema = TracingSchema()
+
+    # The serialized schema response and its ETag, computed once per parsed configuration
+    _schema: Optional[Tuple[bytes, str]] = PrivateAttr(default=None)
 
 
 class State(BaseModel):
-    client: Client
+    read_pool: ClientPool
+    write_pool: ClientPool
+    replica: Optional[EmbeddedReplica] = None
+    plan_cache: PlanCache
+    result_cache: Optional[ResultCache] = None
+    single_flight: Optional[SingleFlight] = None
+    metrics: ConnectorMetrics = pydantic.Field(default_factory=ConnectorMetrics)
+    read_admission: Optional[AdmissionController] = None
+    write_admission: Optional[AdmissionController] = None
+    table_statistics: Optional[TableStatistics] = None
+    slow_query_log: Optional[SlowQueryLog] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class PlanCache:
+    """
+    A bounded LRU cache of compiled query SQL, keyed on a normalized request fingerprint.
+
+    Only the SQL text is stored; the bound arguments for a request are re-extracted from the request itself, so
+    two requests that differ only in literal values share one entry.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._plans: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        sql = self._plans.get(key)
+        if sql is None:
+            self.misses += 1
+            return None
+        self._plans.move_to_end(key)
+        self.hits += 1
+        return sql
+
+    def put(self, key: str, sql: str) -> None:
+        if self.max_size <= 0:
+            return
+        self._plans[key] = sql
+        self._plans.move_to_end(key)
+        while len(self._plans) > self.max_size:
+            self._plans.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._plans.clear()
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._plans),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
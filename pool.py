@@ -0,0 +1,189 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import time
+
+from libsql_client import Client, LibsqlError
+
+
+class ClientPool:
+    """
+    A bounded pool of database clients.
+
+    Clients are created lazily up to max_size and handed out one request at a time. Idle clients above min_size are
+    closed after idle_timeout seconds. Every health_check_interval seconds the idle clients are probed one at a time,
+    so the others stay available, and the ones that fail are closed and replaced up to min_size.
+    """
+
+    def __init__(self,
+                 name: str,
+                 factory: Callable[[], Client],
+                 min_size: int = 1,
+                 max_size: int = 4,
+                 idle_timeout: float = 300.0,
+                 health_check_interval: float = 30.0,
+                 acquire_timeout: Optional[float] = None):
+        self.name = name
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._idle: Deque[Tuple[Client, float]] = deque()
+        # Every open client, idle or checked out
+        self._clients: Set[Client] = set()
+        self._closing: Set[asyncio.Task] = set()
+        self._size = 0
+        self._waiting = 0
+        self._condition = asyncio.Condition()
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.health_check_failures = 0
+
+    def _create(self) -> Client:
+        client = self.factory()
+        self._clients.add(client)
+        self._size += 1
+        return client
+
+    def _close_later(self, client: Client) -> None:
+        self._clients.discard(client)
+        self._size -= 1
+        task = asyncio.ensure_future(client.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _fill(self) -> None:
+        while self._size < self.min_size and not self._closed:
+            self._idle.append((self._create(), time.monotonic()))
+
+    async def start(self) -> None:
+        async with self._condition:
+            self._fill()
+        if self.health_check_interval > 0:
+            self._maintenance_task = asyncio.create_task(self._maintain())
+
+    async def _acquire(self) -> Client:
+        if self._closed:
+            raise LibsqlError(f"The {self.name} pool is closed", "CLIENT_CLOSED")
+        start = time.monotonic()
+        waited = False
+        async with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(self._condition.wait(), self.acquire_timeout)
+                except asyncio.TimeoutError:
+                    raise LibsqlError(f"Timed out waiting for a {self.name} connection", "POOL_TIMEOUT")
+                finally:
+                    self._waiting -= 1
+            if self._idle:
+                client, _ = self._idle.pop()
+            else:
+                client = self._create()
+
+        self.acquisitions += 1
+        if waited:
+            elapsed = time.monotonic() - start
+            self.waits += 1
+            self.wait_time_total += elapsed
+            self.wait_time_max = max(self.wait_time_max, elapsed)
+        return client
+
+    async def _release(self, client: Client, discard: bool = False) -> None:
+        async with self._condition:
+            if discard or self._closed or client.closed:
+                self._close_later(client)
+                self._fill()
+            else:
+                self._idle.append((client, time.monotonic()))
+            self._condition.notify()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Client]:
+        client = await self._acquire()
+        discard = False
+        try:
+            yield client
+        except LibsqlError as e:
+            # Connection level failures poison the client, statement errors do not
+            discard = e.code in ("CLIENT_CLOSED", "HRANA_WEBSOCKET_ERROR", "STREAM_CLOSED")
+            raise
+        finally:
+            await self._release(client, discard)
+
+    async def _maintain(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            await self._evict_idle()
+            await self._probe_idle()
+
+    async def _evict_idle(self) -> None:
+        now = time.monotonic()
+        async with self._condition:
+            # The oldest idle clients sit at the left of the deque
+            while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+                client, _ = self._idle.popleft()
+                self._close_later(client)
+
+    async def _probe_idle(self) -> None:
+        async with self._condition:
+            probing = list(self._idle)
+        for entry in probing:
+            async with self._condition:
+                # Clients checked out since are probed by their requests
+                if entry not in self._idle:
+                    continue
+                self._idle.remove(entry)
+            client, last_used = entry
+            try:
+                await client.execute("SELECT 1")
+            except Exception:
+                self.health_check_failures += 1
+                await self._release(client, discard=True)
+            else:
+                async with self._condition:
+                    # Back in its place, the idle clients stay ordered by when they were last used
+                    position = next((i for i, (_, used) in enumerate(self._idle) if used > last_used), len(self._idle))
+                    self._idle.insert(position, (client, last_used))
+                    self._condition.notify()
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+        async with self._condition:
+            while self._idle:
+                client, _ = self._idle.pop()
+                self._clients.discard(client)
+                self._size -= 1
+                await client.close()
+            self._condition.notify_all()
+
+    def client_stats(self) -> List[Dict[str, Any]]:
+        return [client.stats() for client in self._clients if hasattr(client, "stats")]
+
+    def stats(self) -> Dict[str, float]:
+        in_use = self._size - len(self._idle)
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": in_use,
+            "max_size": self.max_size,
+            "saturated": int(in_use >= self.max_size),
+            "waiting": self._waiting,
+            "acquisitions": self.acquisitions,
+            "waits": self.waits,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max,
+            "health_check_failures": self.health_check_failures
+        }
@@ -0,0 +1,156 @@
+from typing import Any, Dict, Optional, Set
+import asyncio
+import time
+
+try:
+    import libsql_experimental as libsql
+except ImportError:
+    libsql = None
+
+
+class EmbeddedReplica:
+    """
+    A local SQLite file kept in sync with the remote primary database.
+
+    The replica file is a regular SQLite database, so reads go through an ordinary file: URL client pointed at it. Only
+    syncing goes through libsql, which applies the frames replicated from the primary to the local file.
+    """
+
+    def __init__(self,
+                 path: str,
+                 sync_url: str,
+                 auth_token: Optional[str] = None,
+                 sync_interval: float = 60.0,
+                 read_your_writes: bool = False,
+                 read_your_writes_timeout: float = 5.0):
+        if libsql is None:
+            raise ValueError("Embedded replicas require the libsql-experimental package")
+        self.path = path
+        self.sync_url = sync_url
+        self.auth_token = auth_token
+        self.sync_interval = sync_interval
+        self.read_your_writes = read_your_writes
+        self.read_your_writes_timeout = read_your_writes_timeout
+
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._sync_task: Optional[asyncio.Task] = None
+        # Catch-up syncs a reader stopped waiting for, they keep the lock until their thread is done with the connection
+        self._catch_ups: Set[asyncio.Task] = set()
+
+        # Writes are numbered as they commit on the primary, a sync covers every write numbered before it started
+        self.writes = 0
+        self.synced_through = 0
+
+        self.syncs = 0
+        self.sync_errors = 0
+        self.frames_synced = 0
+        self.last_sync_at: Optional[float] = None
+        self.last_sync_duration = 0.0
+
+    @property
+    def url(self) -> str:
+        return f"file:{self.path}"
+
+    def _connect(self):
+        return libsql.connect(self.path,
+                              sync_url=self.sync_url,
+                              auth_token=self.auth_token or "",
+                              check_same_thread=False)
+
+    def _sync(self) -> int:
+        if self._conn is None:
+            self._conn = self._connect()
+        replicated = self._conn.sync()
+        # Newer drivers report what was replicated, older ones return nothing
+        frames = getattr(replicated, "frames_synced", replicated)
+        return frames if isinstance(frames, int) else 0
+
+    async def sync(self) -> int:
+        async with self._lock:
+            return await self._sync_locked()
+
+    async def _sync_locked(self) -> int:
+        target = self.writes
+        start = time.monotonic()
+        try:
+            frames = await asyncio.to_thread(self._sync)
+        except Exception:
+            self.sync_errors += 1
+            raise
+        self.synced_through = max(self.synced_through, target)
+        self.syncs += 1
+        self.frames_synced += frames
+        self.last_sync_at = time.time()
+        self.last_sync_duration = time.monotonic() - start
+        return frames
+
+    def note_write(self) -> None:
+        self.writes += 1
+
+    async def catch_up(self) -> None:
+        """
+        Wait until every write made through this connector is visible in the replica.
+
+        The SDK does not pass request headers to the connector, so writes cannot be told apart by caller: after any
+        mutation every read waits for a sync. This is why read_your_writes is off unless configured. Reads fall back to
+        the possibly stale replica when the sync fails or takes longer than read_your_writes_timeout.
+
+        Concurrent readers share one sync: whoever gets the lock first syncs, and the rest find themselves covered. A
+        reader that times out stops waiting, but the sync runs to completion under the lock, since its thread cannot be
+        cancelled and the connection must not be used by two syncs at once.
+        """
+        if self.synced_through >= self.writes:
+            return
+        target = self.writes
+
+        async def sync_through_target():
+            async with self._lock:
+                if self.synced_through < target:
+                    await self._sync_locked()
+
+        task = asyncio.ensure_future(sync_through_target())
+        self._catch_ups.add(task)
+        task.add_done_callback(self._catch_up_done)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.read_your_writes_timeout)
+        except asyncio.TimeoutError:
+            print(f"Replica did not catch up within {self.read_your_writes_timeout}s, reading possibly stale data")
+        except Exception as e:
+            print(f"Replica sync failed, reading possibly stale data: {e}")
+
+    def _catch_up_done(self, task: asyncio.Task) -> None:
+        self._catch_ups.discard(task)
+        # A failure nobody waited for is already counted in sync_errors
+        if not task.cancelled():
+            task.exception()
+
+    async def _sync_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Background replica sync failed: {e}")
+
+    async def start(self) -> None:
+        await self.sync()
+        if self.sync_interval > 0:
+            self._sync_task = asyncio.create_task(self._sync_periodically())
+
+    async def close(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "frames_synced": self.frames_synced,
+            "pending_writes": self.writes - self.synced_through,
+            "last_sync_at": self.last_sync_at,
+            "last_sync_duration": self.last_sync_duration
+        }
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+import time
+
+
+class CachedResult(NamedTuple):
+    value: Any
+    size: int
+    expires_at: float
+    versions: Tuple[Tuple[str, int], ...]
+
+
+class ResultCache:
+    """
+    A cache of query results bounded by total size in bytes, evicting the least recently used results first.
+
+    Every result records the version of each table it read. Writing to a table bumps its version, which drops every
+    result that read it. Writes the connector does not see, like other clients or triggers, are only bounded by the
+    TTL.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 5.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._results: OrderedDict[str, CachedResult] = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._keys_by_table: Dict[str, Set[str]] = {}
+
+    def versions(self, tables: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+        """
+        Snapshot the versions of the tables, to be taken before the query runs and passed to put.
+        """
+        return tuple((table, self._versions.get(table, 0)) for table in sorted(set(tables)))
+
+    def get(self, key: str) -> Optional[Any]:
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        if result.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._results.move_to_end(key)
+        self.hits += 1
+        return result.value
+
+    def put(self, key: str, value: Any, size: int, versions: Tuple[Tuple[str, int], ...]) -> None:
+        # A table written to while the query ran makes its result stale before it is even cached
+        if size > self.max_bytes or versions != self.versions(table for table, _ in versions):
+            return
+        if key in self._results:
+            self._remove(key)
+        self._results[key] = CachedResult(value, size, time.monotonic() + self.ttl, versions)
+        self.bytes += size
+        for table, _ in versions:
+            self._keys_by_table.setdefault(table, set()).add(key)
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._results)))
+            self.evictions += 1
+
+    def invalidate(self, tables: Iterable[str]) -> None:
+        for table in tables:
+            self._versions[table] = self._versions.get(table, 0) + 1
+            for key in self._keys_by_table.pop(table, set()):
+                if key in self._results:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        # Bumping every known table also rejects the results of queries that are still running
+        self.invalidate(list(self._keys_by_table.keys()) + list(self._versions.keys()))
+
+    def _remove(self, key: str) -> None:
+        result = self._results.pop(key)
+        self.bytes -= result.size
+        for table, _ in result.versions:
+            keys = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table]
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._results),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
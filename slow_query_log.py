@@ -0,0 +1,234 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Any, Awaitable, Callable, ContextManager, Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import random
+import time
+
+from libsql_client import Statement
+
+# Keys of a query request whose values are data rather than shape
+QUERY_VALUE_KEYS = ("value", "limit", "offset")
+# Values recorded in seconds, logged in milliseconds
+TIMING_VALUES = ("plan", "execute", "decode")
+
+
+class RequestRecord:
+    """
+    What one request did, filled in by the metrics and the executors while it runs.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.labels: Set[Tuple[str, str]] = set()
+        self.values: Dict[str, float] = {}
+        self.statements: List[Statement] = []
+        self.error: Optional[str] = None
+
+
+# The record of the request being served, None unless the slow query log is enabled
+current_request: ContextVar[Optional[RequestRecord]] = ContextVar("current_request", default=None)
+
+
+def record_value(labels: Tuple[str, str], name: str, value: float) -> None:
+    record = current_request.get()
+    if record is not None:
+        record.labels.add(labels)
+        record.values[name] = record.values.get(name, 0) + value
+
+
+def record_statements(statements: List[Statement]) -> None:
+    record = current_request.get()
+    if record is not None:
+        record.statements.extend(statements)
+
+
+def mask_values(value: Any) -> Any:
+    """
+    Replace every scalar with ?, and every list with its first item, keeping only the keys.
+    """
+    if isinstance(value, dict):
+        return {k: mask_values(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [mask_values(value[0])] if value else []
+    return "?"
+
+
+def mask_query_values(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: "?" if k in QUERY_VALUE_KEYS and v is not None else mask_query_values(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [mask_query_values(v) for v in value]
+    return value
+
+
+def request_shape(kind: str, request: Any) -> Any:
+    """
+    The request without its values: literals, limits and variables of queries, every argument value of mutations.
+    """
+    if kind == "query":
+        shape = mask_query_values(request.model_dump(exclude_none=True, exclude={"variables"}))
+        if request.variables:
+            shape["variables"] = {"sets": len(request.variables),
+                                  "names": sorted(next(iter(request.variables.values()), {}))}
+        return shape
+    return [{"name": op.name,
+             "arguments": mask_values(op.arguments),
+             "fields": op.fields.model_dump(exclude_none=True) if op.fields is not None else None}
+            for op in request.operations]
+
+
+class SlowQueryLog:
+    """
+    Writes the requests that took longer than the threshold to a rotating NDJSON file.
+
+    Slow requests are sampled and rate limited, so a spike of them cannot flood the disk. The EXPLAIN QUERY PLAN of
+    their statements is run and the line written in a background task, after the response has been sent.
+    """
+
+    def __init__(self,
+                 path: str,
+                 threshold: float,
+                 explain: Optional[Callable[[List[Statement]], Awaitable[List[str]]]] = None,
+                 sample_rate: float = 1.0,
+                 max_per_second: float = 10.0,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 backup_count: int = 5,
+                 redact_args: bool = False,
+                 max_statements: int = 20,
+                 max_args: int = 100,
+                 max_sql_length: int = 10000,
+                 max_pending: int = 4):
+        self.threshold = threshold
+        self.explain = explain
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.redact_args = redact_args
+        self.max_statements = max_statements
+        self.max_args = max_args
+        self.max_sql_length = max_sql_length
+        self.max_pending = max_pending
+        self._tokens = max(max_per_second, 1.0)
+        self._refilled_at = time.monotonic()
+        self._pending: Set[asyncio.Task] = set()
+
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._logger = logging.getLogger(f"ndc_turso.slow_queries.{path}")
+        self._logger.handlers = [handler]
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+
+        self.slow = 0
+        self.written = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self.explain_errors = 0
+
+    @contextmanager
+    def track(self, kind: str, request: Any) -> Iterator[RequestRecord]:
+        record = RequestRecord(kind)
+        token = current_request.set(record)
+        try:
+            yield record
+        except Exception as e:
+            record.error = str(e)
+            raise
+        finally:
+            current_request.reset(token)
+            self.finish(record, request)
+
+    def _allow(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(max(self.max_per_second, 1.0),
+                           self._tokens + (now - self._refilled_at) * self.max_per_second)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def finish(self, record: RequestRecord, request: Any) -> None:
+        elapsed = time.perf_counter() - record.start
+        if elapsed < self.threshold:
+            return
+        self.slow += 1
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        if not self._allow():
+            self.rate_limited += 1
+            return
+        entry = self.entry(record, request, elapsed)
+        statements = record.statements[:self.max_statements]
+        explain = self.explain if statements and len(self._pending) < self.max_pending else None
+        task = asyncio.ensure_future(self._write(entry, statements, explain))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def format_args(self, args: Optional[List[Any]]) -> List[Any]:
+        args = list(args or [])[:self.max_args]
+        if self.redact_args:
+            return [f"<{type(arg).__name__}>" for arg in args]
+        return args
+
+    def entry(self, record: RequestRecord, request: Any, elapsed: float) -> Dict[str, Any]:
+        collections = sorted({collection for collection, _ in record.labels if collection})
+        if not collections and getattr(request, "collection", None):
+            collections = [request.collection]
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "kind": record.kind,
+            "collections": collections,
+            "operations": sorted({operation for _, operation in record.labels}),
+            "total_ms": round(elapsed * 1000, 3)
+        }
+        for name in TIMING_VALUES:
+            if name in record.values:
+                entry[f"{name}_ms"] = round(record.values[name] * 1000, 3)
+        entry["response_bytes"] = record.values.get("response_bytes")
+        entry["rows"] = record.values.get("rows")
+        entry["error"] = record.error
+        entry["shape"] = request_shape(record.kind, request)
+        entry["statement_count"] = len(record.statements)
+        entry["statements"] = [{"sql": s.sql if len(s.sql) <= self.max_sql_length else
+                                s.sql[:self.max_sql_length] + "...",
+                                "args": self.format_args(s.args),
+                                "arg_count": len(s.args or [])}
+                               for s in record.statements[:self.max_statements]]
+        return entry
+
+    async def _write(self,
+                     entry: Dict[str, Any],
+                     statements: List[Statement],
+                     explain: Optional[Callable[[List[Statement]], Awaitable[List[str]]]]) -> None:
+        if explain is not None:
+            try:
+                for statement, plan in zip(entry["statements"], await explain(statements)):
+                    statement["plan"] = plan
+            except Exception as e:
+                self.explain_errors += 1
+                entry["explain_error"] = str(e)
+        self._logger.info(json.dumps(entry, default=str, ensure_ascii=False))
+        self.written += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "slow": self.slow,
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "rate_limited": self.rate_limited,
+            "explain_errors": self.explain_errors,
+            "pending": len(self._pending)
+        }
+
+
+def track(slow_query_log: Optional[SlowQueryLog], kind: str, request: Any) -> ContextManager:
+    if slow_query_log is None:
+        return nullcontext()
+    return slow_query_log.track(kind, request)
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import json
+import urllib.parse
+
+from libsql_client import Client, InArgs, InStatement, LibsqlError, ResultSet, Transaction
+from libsql_client.hrana.client import HranaClient
+from libsql_client.hrana.conn import HranaConn
+from libsql_client.hrana.convert import (
+    _stmt_to_proto, _result_set_from_proto,
+    _batch_to_proto, _batch_results_from_proto,
+)
+
+REMOTE_SCHEMES = {"libsql": "wss", "https": "wss", "http": "ws", "wss": "wss", "ws": "ws"}
+
+
+def is_remote_url(url: str) -> bool:
+    return urllib.parse.urlparse(url).scheme in REMOTE_SCHEMES
+
+
+def websocket_url(url: str) -> str:
+    parsed = urllib.parse.urlparse(url)
+    return urllib.parse.urlunparse((REMOTE_SCHEMES[parsed.scheme], parsed.netloc, parsed.path, "", "", ""))
+
+
+class StoredSqlClient(Client):
+    """
+    A client for remote databases that keeps one persistent Hrana connection and registers every distinct SQL text
+    on it once, so that subsequent executions only send the stored SQL id and the args.
+
+    Stored SQL only lives as long as the connection, so everything is re-registered after a reconnect.
+    """
+
+    def __init__(self, url: str, auth_token: Optional[str] = None, max_stored_sql: int = 1000):
+        self._client = HranaClient(websocket_url(url), auth_token)
+        self.max_stored_sql = max_stored_sql
+        self._conn: Optional[HranaConn] = None
+        self._sql_ids: OrderedDict[str, int] = OrderedDict()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        self.last_request_bytes = 0
+        self.registrations = 0
+        self.reconnects = 0
+
+    def _sql_id(self, conn: HranaConn, sql: str) -> int:
+        if self._conn is not conn:
+            if self._conn is not None:
+                self.reconnects += 1
+            self._conn = conn
+            self._sql_ids.clear()
+
+        sql_id = self._sql_ids.get(sql)
+        if sql_id is not None:
+            self._sql_ids.move_to_end(sql)
+            self.bytes_saved += len(sql.encode())
+            return sql_id
+
+        while len(self._sql_ids) >= self.max_stored_sql > 0:
+            _, evicted_id = self._sql_ids.popitem(last=False)
+            conn.close_sql(evicted_id)
+
+        # A registration only fails when the connection does, and the ids are forgotten with it on reconnect
+        sql_id = conn.store_sql(sql)
+        self._sql_ids[sql] = sql_id
+        self._count({"type": "store_sql", "sql_id": sql_id, "sql": sql})
+        self.registrations += 1
+        return sql_id
+
+    def _to_stored(self, conn: HranaConn, proto_stmt: dict) -> dict:
+        sql = proto_stmt.pop("sql")
+        proto_stmt["sql_id"] = self._sql_id(conn, sql)
+        return proto_stmt
+
+    def _count(self, request: dict) -> int:
+        size = len(json.dumps(request).encode())
+        self.bytes_sent += size
+        return size
+
+    async def execute(self, stmt: InStatement, args: InArgs = None) -> ResultSet:
+        with self._client._open_stream() as stream:
+            proto_stmt = self._to_stored(stream._conn, _stmt_to_proto(stmt, args))
+            self.requests += 1
+            self.last_request_bytes = self._count({"type": "execute", "stmt": proto_stmt})
+            proto_result_fut = stream.execute(proto_stmt)
+        return _result_set_from_proto(await proto_result_fut)
+
+    async def batch(self, stmts: List[InStatement]) -> List[ResultSet]:
+        with self._client._open_stream() as stream:
+            proto_batch = _batch_to_proto(stmts)
+            # The first step is BEGIN and the last two are COMMIT and ROLLBACK, which are tiny
+            for step in proto_batch["steps"][1:-2]:
+                self._to_stored(stream._conn, step["stmt"])
+            self.requests += 1
+            self.last_request_bytes = self._count({"type": "batch", "batch": proto_batch})
+            proto_result_fut = stream.batch(proto_batch)
+        return _batch_results_from_proto(await proto_result_fut, len(stmts))
+
+    def transaction(self) -> Transaction:
+        return self._client.transaction()
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._client.closed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "stored_sql": len(self._sql_ids),
+            "registrations": self.registrations,
+            "reconnects": self.reconnects,
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "bytes_saved": self.bytes_saved,
+            "last_request_bytes": self.last_request_bytes
+        }
+
+
+def create_stored_sql_client(url: str, *, auth_token: Optional[str] = None, max_stored_sql: int = 1000) -> Client:
+    if not is_remote_url(url):
+        raise LibsqlError(f"Stored SQL requires a remote database URL, got {url!r}", "URL_SCHEME_NOT_SUPPORTED")
+    return StoredSqlClient(url, auth_token=auth_token, max_stored_sql=max_stored_sql)
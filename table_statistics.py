@@ -0,0 +1,124 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import time
+
+from libsql_client import Client, LibsqlError, Statement
+
+# SQLite's own guess for the rows matching one key of an index it has no statistics for
+DEFAULT_ROWS_PER_KEY = 10
+# Tables the row count cannot be read for, like WITHOUT ROWID tables without statistics
+DEFAULT_TABLE_ROWS = 1000000
+
+
+class TableStatistics:
+    """
+    Estimated row counts and the indexes of every table, used to estimate query costs.
+
+    Row counts come from sqlite_stat1 when ANALYZE has been run, otherwise from the largest rowid. sqlite_stat1 also
+    gives the average number of rows per key of each index prefix.
+    """
+
+    def __init__(self,
+                 rows: Dict[str, int],
+                 indexes: Dict[str, List[List[str]]],
+                 unique_indexes: Dict[str, List[List[str]]],
+                 rows_per_key: Dict[Tuple[str, Tuple[str, ...]], float]):
+        self.rows = rows
+        self.indexes = indexes
+        self.unique_indexes = unique_indexes
+        self._rows_per_key = rows_per_key
+        self.loaded_at = time.monotonic()
+
+    def table_rows(self, table: str) -> int:
+        return self.rows.get(table, DEFAULT_TABLE_ROWS)
+
+    def index_prefix(self, table: str, columns: Iterable[str]) -> Tuple[str, ...]:
+        """
+        The longest index prefix made only of the given columns, the part of a lookup an index can serve.
+        """
+        columns = set(columns)
+        best: Tuple[str, ...] = ()
+        for index in self.indexes.get(table, []):
+            prefix = []
+            for column in index:
+                if column not in columns:
+                    break
+                prefix.append(column)
+            if len(prefix) > len(best):
+                best = tuple(prefix)
+        return best
+
+    def is_unique(self, table: str, columns: Sequence[str]) -> bool:
+        return any(set(index) <= set(columns) for index in self.unique_indexes.get(table, []))
+
+    def rows_per_key(self, table: str, columns: Tuple[str, ...], default: Optional[float] = None) -> float:
+        if self.is_unique(table, columns):
+            return 1
+        rows_per_key = self._rows_per_key.get((table, columns))
+        if rows_per_key is not None:
+            return rows_per_key
+        return min(DEFAULT_ROWS_PER_KEY if default is None else default, self.table_rows(table))
+
+
+async def load_table_statistics(client: Client,
+                                tables: List[str],
+                                primary_keys: Dict[str, List[str]],
+                                unique_keys: Optional[Dict[str, List[List[str]]]] = None) -> TableStatistics:
+    """
+    Read the indexes, sqlite_stat1 and row counts of the tables. The primary and unique keys from the introspected
+    configuration count as indexes, which covers rowid primary keys that have no index of their own. Each table's
+    unique keys are a list of column lists, one per unique index.
+    """
+    indexes = {table: [] for table in tables}
+    unique_indexes = {table: [] for table in tables}
+    for table in tables:
+        for keys in [primary_keys.get(table), *(unique_keys or {}).get(table, [])]:
+            if keys:
+                indexes[table].append(list(keys))
+                unique_indexes[table].append(list(keys))
+
+    index_rows, stat_tables = await client.batch([
+        Statement("SELECT m.name AS table_name, il.name AS index_name, il.[unique] AS is_unique, ii.name AS column_name "
+                  "FROM sqlite_master AS m JOIN pragma_index_list(m.name) AS il JOIN pragma_index_info(il.name) AS ii "
+                  "WHERE m.type = 'table' ORDER BY m.name, il.name, ii.seqno"),
+        Statement("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+    ])
+    index_columns: Dict[str, Tuple[str, bool, List[str]]] = {}
+    for row in index_rows.rows:
+        if row["table_name"] in indexes:
+            index_columns.setdefault(row["index_name"], (row["table_name"], bool(row["is_unique"]), []))[2].append(
+                row["column_name"])
+    for table, unique, columns in index_columns.values():
+        indexes[table].append(columns)
+        if unique:
+            unique_indexes[table].append(columns)
+
+    rows: Dict[str, int] = {}
+    rows_per_key: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+    if stat_tables.rows:
+        for row in (await client.execute("SELECT tbl, idx, stat FROM sqlite_stat1")).rows:
+            stat = [int(value) for value in str(row["stat"]).split() if value.isdigit()]
+            if not stat or row["tbl"] not in indexes:
+                continue
+            rows[row["tbl"]] = stat[0]
+            if row["idx"] in index_columns:
+                columns = index_columns[row["idx"]][2]
+                for i, average in enumerate(stat[1:len(columns) + 1]):
+                    rows_per_key[(row["tbl"], tuple(columns[:i + 1]))] = average
+
+    # The largest rowid is read from the end of the table B-tree, it overestimates tables with deleted rows
+    missing = [table for table in tables if table not in rows]
+    statements = [Statement(f'SELECT MAX(rowid) AS row_count FROM "{table}"') for table in missing]
+    try:
+        results = await client.batch(statements) if statements else []
+    except LibsqlError:
+        # A WITHOUT ROWID table fails the whole batch, retry one table at a time
+        results = []
+        for statement in statements:
+            try:
+                results.append(await client.execute(statement))
+            except LibsqlError:
+                results.append(None)
+    for table, result in zip(missing, results):
+        if result is not None:
+            rows[table] = result.rows[0]["row_count"] or 0
+    return TableStatistics(rows, indexes, unique_indexes, rows_per_key)
@@ -0,0 +1,45 @@
+import asyncio
+import json
+import pathlib
+import shutil
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# hasura_ndc has to be imported before the connector's models
+from main import RootConnector  # noqa: E402
+
+
+@pytest.fixture
+def connector(tmp_path):
+    """
+    Run a test coroutine against a connector serving a copy of chinook.sqlite, so mutations never touch the original.
+
+    The coroutine is called with the connector, its configuration and its state. Keyword arguments override
+    top-level configuration settings, responses are decoded unless json_passthrough is overridden.
+    """
+    database = tmp_path / "chinook.sqlite"
+    shutil.copy(ROOT / "chinook.sqlite", database)
+
+    def run(test, **settings):
+        configuration = json.loads((ROOT / "config.json").read_text())
+        configuration["credentials"]["url"] = f"file:{database}"
+        configuration["json_passthrough"] = False
+        configuration.update(settings)
+        configuration_path = tmp_path / "config.json"
+        configuration_path.write_text(json.dumps(configuration))
+
+        async def main():
+            c = RootConnector()
+            parsed = await c.parse_configuration(str(configuration_path))
+            state = await c.try_init_state(parsed, {})
+            try:
+                return await test(c, parsed, state)
+            finally:
+                await state.read_pool.close()
+                await state.write_pool.close()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,74 @@
+import pytest
+
+from models import QueryRequest, MutationRequest
+
+
+def track_query(order, cursor=None, limit=500, strategy=None):
+    request = {
+        "collection": "Track",
+        "arguments": {},
+        "collection_relationships": {"album": {"column_mapping": {"AlbumId": "AlbumId"},
+                                               "relationship_type": "object",
+                                               "target_collection": "Album",
+                                               "arguments": {}}},
+        "query": {
+            "fields": {"id": {"type": "column", "column": "TrackId"},
+                       "c": {"type": "column", "column": "_cursor"},
+                       "album": {"type": "relationship", "relationship": "album", "arguments": {},
+                                 "query": {"fields": {"Title": {"type": "column", "column": "Title"}}}}},
+            "limit": limit,
+            "order_by": {"elements": [{"target": {"type": "column", "name": name, "column": None,
+                                                  "function": None, "path": []},
+                                       "order_direction": direction} for name, direction in order]}
+        }
+    }
+    if cursor is not None:
+        request["arguments"]["cursor"] = {"type": "literal", "value": cursor}
+    if strategy is not None:
+        request["arguments"]["relationship_strategy"] = {"type": "literal", "value": strategy}
+    return QueryRequest(**request)
+
+
+@pytest.mark.parametrize("strategy", ["subquery", "batched"])
+@pytest.mark.parametrize("order", [[], [("MediaTypeId", "desc")], [("MediaTypeId", "asc"), ("Milliseconds", "desc")]])
+def test_pages_cover_every_row_once(connector, order, strategy):
+    async def test(c, configuration, state):
+        ids, cursor = [], None
+        while True:
+            rows = (await c.query(configuration, state, track_query(order, cursor, strategy=strategy)))[0]["rows"]
+            if not rows:
+                break
+            ids.extend(row["id"] for row in rows)
+            cursor = rows[-1]["c"]
+        everything = (await c.query(configuration, state, track_query(order, limit=10000, strategy=strategy)))
+        return ids, [row["id"] for row in everything[0]["rows"]]
+
+    ids, everything = connector(test)
+    assert len(everything) == 3503
+    assert ids == everything
+
+
+def test_nullable_order_is_rejected(connector):
+    async def test(c, configuration, state):
+        with pytest.raises(ValueError, match="nullable"):
+            await c.query(configuration, state, track_query([("Composer", "asc")]))
+
+    connector(test)
+
+
+def test_list_procedure_cursor(connector):
+    async def test(c, configuration, state):
+        fields = {"type": "array", "fields": {"type": "object", "fields": {
+            "id": {"type": "column", "column": "ArtistId"}, "c": {"type": "column", "column": "_cursor"}}}}
+        pages, cursor = [], None
+        for _ in range(3):
+            operation = {"type": "procedure", "name": "list_Artist", "arguments": {"limit": 2, "cursor": cursor},
+                         "fields": fields}
+            response = await c.mutation(configuration, state,
+                                        MutationRequest(collection_relationships={}, operations=[operation]))
+            rows = response.operation_results[0].result
+            pages.append([row["id"] for row in rows])
+            cursor = rows[-1]["c"]
+        return pages
+
+    assert connector(test) == [[1, 2], [3, 4], [5, 6]]
@@ -0,0 +1,73 @@
+import pytest
+
+from handlers.mutation import ConnectorError, chunk_insert_data
+from models import MutationRequest
+
+SETTINGS = {"mutations": {"max_parameters": 32766, "max_rows_per_statement": 100}}
+
+
+def insert_artists(objects):
+    return MutationRequest(collection_relationships={}, operations=[{
+        "type": "procedure",
+        "name": "insert_Artist_many",
+        "arguments": {"objects": objects},
+        "fields": {"type": "array", "fields": {"type": "object", "fields": {
+            "id": {"type": "column", "column": "ArtistId"}, "name": {"type": "column", "column": "Name"}}}}
+    }])
+
+
+def count_artists():
+    return MutationRequest(collection_relationships={}, operations=[{
+        "type": "procedure", "name": "list_Artist", "arguments": {},
+        "fields": {"type": "array", "fields": {"type": "object", "fields": {
+            "id": {"type": "column", "column": "ArtistId"}}}}
+    }])
+
+
+def test_chunks_keep_runs_of_key_sets_in_order():
+    data = [{"a": 1}, {"a": 2}, {"b": 1}, {"a": 3}, {"a": 4}, {"a": 5}, {}, {}]
+    assert chunk_insert_data(data, 100, 2) == [[{"a": 1}, {"a": 2}], [{"b": 1}], [{"a": 3}, {"a": 4}], [{"a": 5}],
+                                               [{}], [{}]]
+    assert chunk_insert_data([{"a": 1, "b": 2}] * 5, 4, 100) == [[{"a": 1, "b": 2}] * 2] * 2 + [[{"a": 1, "b": 2}]]
+
+
+def test_insert_over_the_chunk_size_keeps_row_and_returning_order(connector):
+    # Alternating key sets split the rows into many chunks, some of them shorter than the maximum
+    objects = []
+    for i in range(1001):
+        objects.append({"ArtistId": 10000 + i, "Name": f"Artist {i}"} if i % 150 < 120 else {"Name": f"Artist {i}"})
+
+    async def test(c, configuration, state):
+        response = await c.mutation(configuration, state, insert_artists(objects))
+        listed = await c.mutation(configuration, state, count_artists())
+        return response.operation_results[0].result, listed.operation_results[0].result
+
+    returned, listed = connector(test, **SETTINGS)
+    assert [row["name"] for row in returned] == [f"Artist {i}" for i in range(1001)]
+    assert [row["id"] for row in returned][:120] == list(range(10000, 10120))
+    assert len(listed) == 275 + 1001
+
+
+def test_failing_chunk_rolls_back_earlier_chunks(connector):
+    # The last chunk reuses a primary key, after several chunks have already been inserted
+    objects = [{"ArtistId": 20000 + i, "Name": f"Artist {i}"} for i in range(450)] + [{"ArtistId": 20000, "Name": "X"}]
+
+    async def test(c, configuration, state):
+        with pytest.raises(ConnectorError) as error:
+            await c.mutation(configuration, state, insert_artists(objects))
+        listed = await c.mutation(configuration, state, count_artists())
+        return error.value.status_code, len(listed.operation_results[0].result)
+
+    assert connector(test, **SETTINGS) == (400, 275)
+
+
+@pytest.mark.parametrize("timed", [False, True])
+def test_large_insert(connector, timed):
+    objects = [{"Name": f"Artist {i}"} for i in range(20001)]
+
+    async def test(c, configuration, state):
+        response = await c.mutation(configuration, state, insert_artists(objects))
+        return [row["name"] for row in response.operation_results[0].result]
+
+    settings = {"mutations": {"statement_timings": timed}}
+    assert connector(test, **settings) == [f"Artist {i}" for i in range(20001)]
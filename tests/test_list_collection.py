@@ -0,0 +1,29 @@
+import pytest
+
+from models import QueryRequest
+
+ORDER_BY = {"elements": [{"target": {"type": "column", "name": "ArtistId", "path": [], "column": None,
+                                     "function": None}, "order_direction": "asc"}]}
+PREDICATE = {"type": "binary_comparison_operator", "column": {"type": "column", "name": "ArtistId", "path": []},
+             "operator": "_gt", "value": {"type": "scalar", "value": 10}}
+
+
+def artists_request(collection, arguments, **query):
+    return QueryRequest(**{"collection": collection, "arguments": arguments, "collection_relationships": {},
+                           "query": {"fields": {"id": {"type": "column", "column": "ArtistId"}},
+                                     "order_by": ORDER_BY, "predicate": PREDICATE, **query}})
+
+
+@pytest.mark.parametrize("arguments, expected", [
+    ({"limit": {"type": "literal", "value": 3}}, [11, 12, 13]),
+    ({"limit": {"type": "literal", "value": 3}, "offset": {"type": "literal", "value": 2}}, [13, 14, 15]),
+])
+def test_list_collection_matches_its_table(connector, arguments, expected):
+    async def test(c, configuration, state):
+        listed = await c.query(configuration, state, artists_request("list_Artist", arguments))
+        table = await c.query(configuration, state, artists_request(
+            "Artist", {}, limit=arguments["limit"]["value"], offset=arguments.get("offset", {}).get("value")))
+        assert [row["id"] for row in listed[0]["rows"]] == expected
+        assert listed == table
+
+    connector(test)
@@ -0,0 +1,100 @@
+import pytest
+
+from handlers.mutation import ConnectorError
+from models import MutationRequest
+
+
+def procedure(name, arguments, fields=None):
+    operation = {"type": "procedure", "name": name, "arguments": arguments}
+    if fields is not None:
+        operation["fields"] = {"type": "array", "fields": {"type": "object", "fields": {
+            alias: {"type": "column", "column": column} for alias, column in fields.items()}}}
+    return operation
+
+
+def mutate(c, configuration, state, *operations):
+    return c.mutation(configuration, state, MutationRequest(collection_relationships={}, operations=list(operations)))
+
+
+def test_list_procedure_applies_where(connector):
+    async def test(c, configuration, state):
+        response = await mutate(c, configuration, state,
+                                procedure("list_Artist", {"where": {"ArtistId": {"_lt": 4}}}, {"id": "ArtistId"}),
+                                procedure("list_Artist", {"where": {"_or": [{"Name": {"_eq": "Accept"}},
+                                                                            {"ArtistId": {"_eq": 1}}]}}))
+        return [operation.result for operation in response.operation_results]
+
+    filtered, either = connector(test)
+    assert filtered == [{"id": 1}, {"id": 2}, {"id": 3}]
+    assert either == [{"ArtistId": 1, "Name": "AC/DC"}, {"ArtistId": 2, "Name": "Accept"}]
+
+
+def test_list_procedure_sees_earlier_writes_and_keeps_later_operations(connector):
+    async def test(c, configuration, state):
+        response = await mutate(c, configuration, state,
+                                procedure("update_Artist_by_pk", {"pk_columns": {"ArtistId": 2},
+                                                                  "_set": {"Name": "Accept!"}}, {"n": "Name"}),
+                                procedure("list_Artist", {"where": {"ArtistId": {"_eq": 2}}}, {"n": "Name"}),
+                                procedure("delete_Track_many", {"where": {"AlbumId": {"_eq": 1}}}))
+        return [operation.result for operation in response.operation_results]
+
+    assert connector(test) == [[{"n": "Accept!"}], [{"n": "Accept!"}], 10]
+
+
+def test_list_procedure_passthrough(connector):
+    async def test(c, configuration, state):
+        response = await mutate(c, configuration, state,
+                                procedure("list_Artist", {"where": {"ArtistId": {"_eq": 1}}}, {"id": "ArtistId"}))
+        return response.body
+
+    assert connector(test, json_passthrough=True) == \
+        b'{"operation_results":[{"type":"procedure","result":[{"id":1}]}]}'
+
+
+@pytest.mark.parametrize("where", [
+    {"1=1 OR TrackId": {"_eq": 1}},
+    {"TrackId": {"_eq) OR (1": 1}},
+    {"_not": {"Missing": {"_is_null": True}}},
+])
+def test_many_rejects_unknown_columns_and_operators(connector, where):
+    async def test(c, configuration, state):
+        with pytest.raises(ConnectorError) as error:
+            await mutate(c, configuration, state, procedure("delete_Track_many", {"where": where}))
+        remaining = await mutate(c, configuration, state,
+                                 procedure("list_Track", {"where": {"TrackId": {"_lte": 3}}}, {"id": "TrackId"}))
+        return error.value.status_code, remaining.operation_results[0].result
+
+    assert connector(test) == (400, [{"id": 1}, {"id": 2}, {"id": 3}])
+
+
+def test_unknown_procedure_is_rejected(connector):
+    async def test(c, configuration, state):
+        with pytest.raises(ConnectorError) as error:
+            await mutate(c, configuration, state, procedure("upsert_Artist_one", {"object": {"Name": "X"}}))
+        return error.value.status_code, str(error.value)
+
+    assert connector(test) == (400, "Unknown procedure upsert_Artist_one")
+
+
+@pytest.mark.parametrize("operation", [
+    procedure("insert_Artist_many", {"objects": []}),
+    procedure("update_Artist_by_pk", {"pk_columns": {"ArtistId": 1}}),
+    procedure("update_Artist_many", {"where": {"ArtistId": {"_eq": 1}}}),
+    procedure("delete_Artist_by_pk", {"pk_columns": {}}),
+])
+def test_empty_operations_are_rejected(connector, operation):
+    async def test(c, configuration, state):
+        with pytest.raises(ConnectorError) as error:
+            await mutate(c, configuration, state, operation)
+        return error.value.status_code
+
+    assert connector(test) == 400
+
+
+def test_explain_is_only_advertised_for_mutations(connector):
+    async def test(c, configuration, state):
+        return (await c.get_capabilities(configuration)).capabilities
+
+    capabilities = connector(test)
+    assert capabilities.query.explain is None
+    assert capabilities.mutation.explain is not None
@@ -0,0 +1,105 @@
+import pytest
+
+from handlers.query import fingerprint_request
+from models import QueryRequest
+
+NAME = {"name": {"type": "column", "column": "Name"}}
+
+
+def column(name):
+    return {"type": "column", "name": name, "path": []}
+
+
+def compare(name, operator, value):
+    return {"type": "binary_comparison_operator", "column": column(name), "operator": operator,
+            "value": {"type": "scalar", "value": value}}
+
+
+def order(name, direction):
+    return {"elements": [{"target": {**column(name), "column": None, "function": None}, "order_direction": direction}]}
+
+
+def track_request(fields=None, predicate=None, order_by=None, limit=None, offset=None, relationships=None):
+    query = {"fields": fields or NAME}
+    for key, value in (("predicate", predicate), ("order_by", order_by), ("limit", limit), ("offset", offset)):
+        if value is not None:
+            query[key] = value
+    return QueryRequest(**{"collection": "Track", "arguments": {}, "collection_relationships": relationships or {},
+                           "query": query})
+
+
+ALBUM = {"album": {"column_mapping": {"AlbumId": "AlbumId"}, "relationship_type": "object",
+                   "target_collection": "Album", "arguments": {}}}
+ARTIST = {"album": {"column_mapping": {"AlbumId": "ArtistId"}, "relationship_type": "object",
+                    "target_collection": "Album", "arguments": {}}}
+
+
+def album_field(relationship="album"):
+    return {**NAME, "album": {"type": "relationship", "relationship": relationship, "arguments": {},
+                              "query": {"fields": {"title": {"type": "column", "column": "Title"}}}}}
+
+
+# Pairs of requests differing only in literal values
+SAME_SHAPE = [
+    (track_request(predicate=compare("TrackId", "_eq", 1)), track_request(predicate=compare("TrackId", "_eq", 2))),
+    (track_request(predicate=compare("Name", "_like", "A%"), limit=5, offset=1),
+     track_request(predicate=compare("Name", "_like", "B%"), limit=7, offset=3)),
+    (track_request(fields=album_field(), relationships=ALBUM, predicate=compare("AlbumId", "_lt", 3), limit=4),
+     track_request(fields=album_field(), relationships=ALBUM, predicate=compare("AlbumId", "_lt", 9), limit=2)),
+]
+
+BETWEEN = [compare("TrackId", "_gt", 1), compare("TrackId", "_lt", 5)]
+
+# Pairs of requests differing in structure
+DIFFERENT_SHAPE = [
+    (track_request(), track_request(fields={"name": {"type": "column", "column": "Composer"}})),
+    (track_request(), track_request(fields={"title": {"type": "column", "column": "Name"}})),
+    (track_request(predicate=compare("TrackId", "_eq", 1)), track_request(predicate=compare("TrackId", "_gt", 1))),
+    (track_request(predicate=compare("TrackId", "_eq", 1)), track_request(predicate=compare("AlbumId", "_eq", 1))),
+    (track_request(predicate={"type": "and", "expressions": BETWEEN}),
+     track_request(predicate={"type": "or", "expressions": BETWEEN})),
+    (track_request(order_by=order("Name", "asc")), track_request(order_by=order("Name", "desc"))),
+    (track_request(order_by=order("Name", "asc")), track_request()),
+    (track_request(fields=album_field(), relationships=ALBUM),
+     track_request(fields=album_field(), relationships=ARTIST)),
+    (track_request(fields=album_field(), relationships=ALBUM), track_request()),
+    (track_request(limit=5), track_request()),
+    (track_request(limit=5), track_request(limit=5, offset=5)),
+]
+
+
+def rows(response):
+    return response[0]["rows"]
+
+
+@pytest.mark.parametrize("first, second", SAME_SHAPE)
+def test_literal_values_share_a_plan_and_return_their_own_rows(connector, first, second):
+    assert fingerprint_request(first)[0] == fingerprint_request(second)[0]
+
+    async def test(c, configuration, state):
+        await c.query(configuration, state, first)
+        cached = rows(await c.query(configuration, state, second))
+        hits = state.plan_cache.hits
+        state.plan_cache.clear()
+        fresh = rows(await c.query(configuration, state, second))
+        return hits, cached, fresh
+
+    hits, cached, fresh = connector(test)
+    assert hits == 1
+    assert cached and cached == fresh
+
+
+@pytest.mark.parametrize("first, second", DIFFERENT_SHAPE)
+def test_different_structures_never_share_a_plan(connector, first, second):
+    assert fingerprint_request(first)[0] != fingerprint_request(second)[0]
+
+    async def test(c, configuration, state):
+        await c.query(configuration, state, first)
+        cached = rows(await c.query(configuration, state, second))
+        hits = state.plan_cache.hits
+        state.plan_cache.clear()
+        return hits, cached, rows(await c.query(configuration, state, second))
+
+    hits, cached, fresh = connector(test)
+    assert hits == 0
+    assert cached == fresh
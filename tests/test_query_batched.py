@@ -0,0 +1,90 @@
+import pytest
+
+from handlers.query_batched import use_batched_relationships
+from models import QueryRequest
+
+
+def relationship(target, mapping, kind="array"):
+    return {"column_mapping": mapping, "relationship_type": kind, "target_collection": target, "arguments": {}}
+
+
+RELATIONSHIPS = {
+    "albums": relationship("Album", {"ArtistId": "ArtistId"}),
+    "tracks": relationship("Track", {"AlbumId": "AlbumId"}),
+    "genre": relationship("Genre", {"GenreId": "GenreId"}, "object"),
+}
+
+
+def order(name, direction):
+    return {"elements": [{"target": {"type": "column", "name": name, "column": None, "function": None, "path": []},
+                          "order_direction": direction}]}
+
+
+def artist_request(strategy, variables=None, predicate=None):
+    tracks = {"fields": {"name": {"type": "column", "column": "Name"},
+                         "genre": {"type": "relationship", "relationship": "genre", "arguments": {},
+                                   "query": {"fields": {"genre": {"type": "column", "column": "Name"}}}}},
+              "limit": 3, "offset": 1, "order_by": order("Milliseconds", "desc")}
+    albums = {"fields": {"title": {"type": "column", "column": "Title"},
+                         "tracks": {"type": "relationship", "relationship": "tracks", "arguments": {},
+                                    "query": tracks}},
+              "order_by": order("Title", "asc")}
+    request = {
+        "collection": "Artist",
+        "arguments": {"relationship_strategy": {"type": "literal", "value": strategy}},
+        "collection_relationships": RELATIONSHIPS,
+        "query": {"fields": {"id": {"type": "column", "column": "ArtistId"},
+                             "albums": {"type": "relationship", "relationship": "albums", "arguments": {},
+                                        "query": albums}},
+                  "limit": 40,
+                  "predicate": predicate}
+    }
+    if variables is not None:
+        request["variables"] = variables
+    return QueryRequest(**request)
+
+
+VARIABLE_PREDICATE = {"type": "binary_comparison_operator",
+                      "column": {"type": "column", "name": "ArtistId", "path": []},
+                      "operator": "_gt",
+                      "value": {"type": "variable", "name": "after"}}
+
+
+@pytest.mark.parametrize("passthrough", [False, True])
+def test_batched_matches_subquery(connector, passthrough):
+    async def test(c, configuration, state):
+        subquery = await c.query(configuration, state, artist_request("subquery"))
+        batched = await c.query(configuration, state, artist_request("batched"))
+        if passthrough:
+            return subquery.body, batched.body
+        return subquery, batched
+
+    subquery, batched = connector(test, json_passthrough=passthrough)
+    assert subquery == batched
+    if not passthrough:
+        assert any(album["tracks"]["rows"] for artist in batched[0]["rows"] for album in artist["albums"]["rows"])
+
+
+def test_variable_requests_use_the_subquery_strategy(connector):
+    variables = {"0": {"after": 10}, "1": {"after": 200}, "2": {"after": 10}}
+
+    async def test(c, configuration, state):
+        request = artist_request("batched", variables, VARIABLE_PREDICATE)
+        routed = use_batched_relationships(configuration, request)
+        batched = await c.query(configuration, state, request)
+        subquery = await c.query(configuration, state, artist_request("subquery", variables, VARIABLE_PREDICATE))
+        return routed, batched, subquery
+
+    routed, batched, subquery = connector(test, relationship_strategy="batched")
+    assert routed is False
+    assert batched == subquery
+    assert len(batched) == 3 and batched[0] == batched[2] != batched[1]
+
+
+def test_batched_results_are_cached(connector):
+    async def test(c, configuration, state):
+        first = await c.query(configuration, state, artist_request("batched"))
+        second = await c.query(configuration, state, artist_request("batched"))
+        return first == second, state.result_cache.stats()["hits"]
+
+    assert connector(test, result_cache={"max_bytes": 1 << 20, "ttl": 60}) == (True, 1)
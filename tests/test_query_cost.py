@@ -0,0 +1,59 @@
+from handlers.query_cost import apply_limits
+from models import ObjectFieldDetails, QueryRequest
+from table_statistics import load_table_statistics
+from utilities import introspect_table, introspect_tables_batched
+
+QUERY_COST = {"default_limit": 5, "max_limit": 100}
+
+
+def artists_request():
+    return QueryRequest(**{"collection": "Artist", "arguments": {}, "collection_relationships": {},
+                           "query": {"fields": {"name": {"type": "column", "column": "Name"}}}})
+
+
+def test_limits_are_applied_to_a_copy(connector):
+    async def test(c, configuration, state):
+        request = artists_request()
+        limited = apply_limits(configuration, request)
+        assert limited.query.limit == 5
+        assert request.query.limit is None
+
+        response = await c.query(configuration, state, request)
+        assert request.query.limit is None
+        assert len(response[0]["rows"]) == 5
+
+    connector(test, query_cost=QUERY_COST)
+
+
+def test_separate_unique_keys_are_each_unique(connector):
+    async def test(c, configuration, state):
+        async with state.read_pool.acquire() as client:
+            statistics = await load_table_statistics(client, ["Track"], {"Track": ["TrackId"]},
+                                                     {"Track": [["Name"], ["Composer"]]})
+        assert statistics.is_unique("Track", ["Name"])
+        assert statistics.is_unique("Track", ["Composer"])
+        assert not statistics.is_unique("Track", ["AlbumId"])
+
+    connector(test)
+
+
+def test_introspection_keeps_unique_indexes_apart(connector):
+    async def test(c, configuration, state):
+        async with state.write_pool.acquire() as client:
+            await client.batch([
+                "CREATE TABLE Keys (Id INTEGER PRIMARY KEY, A TEXT UNIQUE, B TEXT UNIQUE, C TEXT, D TEXT)",
+                "CREATE UNIQUE INDEX Keys_C_D ON Keys (C, D)",
+            ])
+        async with state.read_pool.acquire() as client:
+            batched = (await introspect_tables_batched(["Keys"], client))["Keys"]
+            single = await introspect_table("Keys", client)
+        for result in (batched, single):
+            assert sorted(result.unique_keys) == [["A"], ["B"], ["C", "D"]]
+
+    connector(test)
+
+
+def test_flat_unique_keys_read_as_one_composite_key():
+    details = ObjectFieldDetails(field_names=["A", "B"], field_types={"A": "String", "B": "String"}, primary_keys=[],
+                                 unique_keys=["A", "B"], nullable_keys=[], foreign_keys={})
+    assert details.unique_keys == [["A", "B"]]
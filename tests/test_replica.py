@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import replica
+
+
+class FakeConnection:
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.active = 0
+        self.overlapped = False
+        self.lock = threading.Lock()
+
+    def sync(self):
+        with self.lock:
+            self.active += 1
+            self.overlapped = self.overlapped or self.active > 1
+        try:
+            time.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return 1
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def embedded_replica(monkeypatch, tmp_path):
+    monkeypatch.setattr(replica, "libsql", object())
+
+    def create(connection, timeout):
+        r = replica.EmbeddedReplica(str(tmp_path / "replica.db"), "http://primary", read_your_writes=True,
+                                    read_your_writes_timeout=timeout)
+        r._conn = connection
+        return r
+    return create
+
+
+def test_read_your_writes_is_off_by_default():
+    from models import ReplicaSchema
+    assert ReplicaSchema(path="replica.db").read_your_writes is False
+
+
+def test_timed_out_catch_up_keeps_the_sync_running_under_the_lock(embedded_replica):
+    async def test():
+        connection = FakeConnection(delay=0.3)
+        r = embedded_replica(connection, 0.05)
+        r.note_write()
+        await r.catch_up()
+        locked = r._lock.locked()
+        await r.sync()
+        return locked, connection.overlapped, r.syncs, r.stats()["pending_writes"]
+
+    assert asyncio.run(test()) == (True, False, 2, 0)
+
+
+def test_failed_catch_up_reads_stale_data(embedded_replica):
+    async def test():
+        r = embedded_replica(FakeConnection(error=RuntimeError("primary unreachable")), 1.0)
+        r.note_write()
+        await r.catch_up()
+        return r.sync_errors, r.stats()["pending_writes"]
+
+    assert asyncio.run(test()) == (1, 1)
@@ -0,0 +1,63 @@
+import pytest
+
+from handlers.query import variable_reference
+from models import QueryRequest
+
+
+def variable_request(name, variable_sets, relationship=False):
+    fields = {"id": {"type": "column", "column": "TrackId"}}
+    if relationship:
+        fields["album"] = {"type": "relationship", "relationship": "album", "arguments": {},
+                           "query": {"fields": {"title": {"type": "column", "column": "Title"}}}}
+    return QueryRequest(**{
+        "collection": "Track",
+        "arguments": {},
+        "collection_relationships": {"album": {"column_mapping": {"AlbumId": "AlbumId"},
+                                               "relationship_type": "object",
+                                               "target_collection": "Album",
+                                               "arguments": {}}},
+        "query": {
+            "fields": fields,
+            "limit": 3,
+            "predicate": {"type": "binary_comparison_operator",
+                          "column": {"type": "column", "name": "AlbumId", "path": []},
+                          "operator": "_eq",
+                          "value": {"type": "variable", "name": name}}
+        },
+        "variables": {str(i): {name: value} for i, value in enumerate(variable_sets)}
+    })
+
+
+@pytest.mark.parametrize("name", ["album", "album.id", 'album"id', "album's", "albums[0]"])
+@pytest.mark.parametrize("relationship", [False, True])
+def test_foreach_matches_one_query_per_variable_set(connector, name, relationship):
+    # Repeated sets are evaluated once inside SQLite and fanned back out in request order
+    variable_sets = [1, 2, 1, 3, 2, 1]
+
+    async def test(c, configuration, state):
+        return await c.query(configuration, state, variable_request(name, variable_sets, relationship))
+
+    foreach = connector(test, variables_mode="json_each")
+    batch = connector(test, variables_mode="batch")
+    assert len(foreach) == len(variable_sets)
+    assert foreach == batch
+    assert foreach[0] == foreach[2] == foreach[5] and foreach[0] != foreach[1]
+    assert all(row_set["rows"] for row_set in foreach)
+
+
+def test_variable_names_do_not_share_foreach_plans(connector):
+    async def test(c, configuration, state):
+        first = await c.query(configuration, state, variable_request("a", [1, 2]))
+        second = await c.query(configuration, state, variable_request("b", [3, 4]))
+        return first, second, state.plan_cache.hits
+
+    first, second, hits = connector(test, variables_mode="json_each")
+    assert hits == 0
+    assert second[0]["rows"] != first[0]["rows"]
+
+
+def test_variable_reference_quotes_the_path():
+    assert variable_reference("a.b", "__vars") == 'JSON_EXTRACT("__vars".value, \'$."a.b"\')'
+    assert variable_reference("it's", "__vars") == 'JSON_EXTRACT("__vars".value, \'$."it\'\'s"\')'
+    assert variable_reference('a"b', "__vars") == \
+        '(SELECT value FROM JSON_EACH("__vars".value) WHERE key = \'a"b\')'
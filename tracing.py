@@ -0,0 +1,44 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+import random
+
+from opentelemetry import trace
+
+tracer = trace.get_tracer("ndc-turso")
+
+# Whether the request being served records the connector's spans. None outside a request, like while the
+# configuration is parsed or introspected, where the spans follow the tracer provider's own sampler.
+sampled: ContextVar[Optional[bool]] = ContextVar("sampled", default=None)
+
+
+@contextmanager
+def sample_request(sample_rate: float) -> Iterator[bool]:
+    """
+    Decide once, at the head of a request, whether its connector spans are recorded. Only requests whose server span
+    is itself recording can be sampled, so the decision never splits a trace.
+    """
+    decision = trace.get_current_span().is_recording() and (sample_rate >= 1.0 or random.random() < sample_rate)
+    token = sampled.set(decision)
+    try:
+        yield decision
+    finally:
+        sampled.reset(token)
+
+
+def span(name: str, attributes: Optional[Dict[str, Any]] = None) -> ContextManager[trace.Span]:
+    """
+    Start a span as a child of the current one. In a request that was not sampled this is a shared no-op span, so
+    the only cost is a context variable lookup; callers should check is_recording before computing attributes.
+    """
+    if sampled.get() is False:
+        return nullcontext(trace.INVALID_SPAN)
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def statement_attributes(statements: List[Any]) -> Dict[str, Any]:
+    return {
+        "db.system": "sqlite",
+        "ndc_turso.statements": len(statements),
+        "ndc_turso.sql_bytes": sum(len(statement.sql) for statement in statements)
+    }
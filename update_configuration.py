@@ -1,13 +1,55 @@
 import libsql_client
-from models import Configuration, ObjectFieldDetails
+from models import Configuration, ConfigurationSchema, ObjectFieldDetails, ObjectType
 from constants import BASE_TYPES, BASE_FIELDS
-from utilities import introspect_table
-from typing import Dict
+from utilities import introspect_tables, TableIntrospectResult
+from typing import Dict, List, Tuple
+import argparse
+import hashlib
 import json
 import asyncio
 
 
-async def update_configuration(raw_configuration: Configuration) -> Configuration:
+async def fetch_schema_state(client: libsql_client.Client, table_names: List[str]) -> Tuple[int, Dict[str, str]]:
+    """
+    Fetch PRAGMA schema_version and a hash per table of its DDL, including the DDL of its indexes.
+    """
+    version_result, ddl_result = await client.batch([
+        "PRAGMA schema_version",
+        libsql_client.Statement(
+            "SELECT tbl_name, type, name, sql FROM sqlite_master "
+            "WHERE tbl_name IN (SELECT value FROM JSON_EACH(?)) "
+            "ORDER BY tbl_name, type, name",
+            [json.dumps(table_names)]
+        )
+    ])
+    hashes = {table_name: hashlib.sha256() for table_name in table_names}
+    for row in ddl_result.rows:
+        hashes[row['tbl_name']].update(json.dumps([row['type'], row['name'], row['sql']]).encode())
+    return version_result.rows[0][0], {table_name: h.hexdigest() for table_name, h in hashes.items()}
+
+
+def apply_table(config: ConfigurationSchema, table_name: str, field_dict: TableIntrospectResult) -> None:
+    config.object_types[table_name] = ObjectType(**{
+        'description': None,
+        'fields': {**{k: v.model_dump() for k, v in field_dict.object_types.items()}, **BASE_FIELDS},
+    })
+    config.object_fields[table_name] = ObjectFieldDetails(**{
+        'field_names': field_dict.field_names,
+        'field_types': field_dict.field_types,
+        'primary_keys': field_dict.primary_keys,
+        'unique_keys': field_dict.unique_keys,
+        'nullable_keys': field_dict.nullable_keys,
+        'foreign_keys': field_dict.foreign_keys,
+    })
+
+
+async def update_configuration(raw_configuration: Configuration, refresh: bool = False) -> Configuration:
+    """
+    Introspect the database into the configuration.
+
+    Without an existing config every table is introspected. With refresh, an existing config is brought up to date by
+    re-introspecting only the tables whose DDL changed or that were added, and dropping the tables that are gone.
+    """
     credentials = raw_configuration.credentials.model_dump()
     client = libsql_client.create_client(**credentials)
     tables_result = await client.execute(
@@ -16,43 +58,56 @@ async def update_configuration(raw_configuration: Configuration) -> Configuratio
         "name <> 'libsql_wasm_func_table'"
     )
     table_names = [row['name'] for row in tables_result.rows]
+    schema_version, table_hashes = await fetch_schema_state(client, table_names)
+
+    config = raw_configuration.config
+    if not config:
+        config = ConfigurationSchema(
+            collection_names=table_names,
+            object_types={**BASE_TYPES},
+            object_fields={}
+        )
+        changed = table_names
+    elif refresh and config.schema_version != schema_version:
+        changed = [t for t in table_names if config.table_hashes.get(t) != table_hashes[t]]
+        dropped = [t for t in config.collection_names if t not in table_hashes]
+        for table_name in dropped:
+            config.object_types.pop(table_name, None)
+            config.object_fields.pop(table_name, None)
+        config.collection_names = table_names
+        print(f"Schema version {config.schema_version} -> {schema_version}: "
+              f"re-introspecting {len(changed)} tables, dropping {len(dropped)}")
+    else:
+        await client.close()
+        return raw_configuration
 
-    if not raw_configuration.config:
-        raw_configuration.config = {
-            'collection_names': table_names,
-            'object_types': {**BASE_TYPES},
-            'object_fields': {}
-        }
-
-        object_fields: Dict[str, ObjectFieldDetails] = {}
-
-        for table_name in table_names:
-            field_dict = await introspect_table(table_name, client)
-            raw_configuration.config['object_types'][table_name] = {
-                'description': None,
-                'fields': {**field_dict.object_types, **BASE_FIELDS},
-            }
-            object_fields[table_name] = ObjectFieldDetails(**{
-                'field_names': field_dict.field_names,
-                'field_types': field_dict.field_types,
-                'primary_keys': field_dict.primary_keys,
-                'unique_keys': field_dict.unique_keys,
-                'nullable_keys': field_dict.nullable_keys,
-                'foreign_keys': field_dict.foreign_keys,
-            })
-
-        raw_configuration.config["object_fields"] = object_fields
+    if changed:
+        introspected = await introspect_tables(changed, client)
+        for table_name in changed:
+            apply_table(config, table_name, introspected[table_name])
+    config.schema_version = schema_version
+    config.table_hashes = table_hashes
+    raw_configuration.config = config
 
     await client.close()
     return raw_configuration
 
 
 if __name__ == "__main__":
-    with open("config.json", "r") as f:
-        configuration = json.load(f)
+    parser = argparse.ArgumentParser(description="Introspect the database into the configuration file")
+    parser.add_argument("--configuration", default="config.json")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Re-introspect the tables whose DDL changed since the configuration was generated")
+    args = parser.parse_args()
+
+    with open(args.configuration, "r") as f:
+        raw_configuration = json.load(f)
 
-    configuration = Configuration(**configuration)
-    configuration = asyncio.run(update_configuration(configuration))
+    configuration = Configuration(**raw_configuration)
+    configuration = asyncio.run(update_configuration(configuration, refresh=args.refresh))
 
-    with open("config.json", "w") as f:
-        json.dump(configuration.model_dump(), f)
+    # Only the introspected section is written back, the other settings stay as the user wrote them, so defaults
+    # are neither added to the file nor pinned there
+    raw_configuration["config"] = configuration.config.model_dump()
+    with open(args.configuration, "w") as f:
+        json.dump(raw_configuration, f)
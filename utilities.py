@@ -1,7 +1,11 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
+import asyncio
+import json
 import libsql_client  # Assuming this is your database client module
+from libsql_client import Statement
 from models import ForeignKeyDetail
+from tracing import span
 
 
 # Define necessary types and classes
@@ -20,7 +24,7 @@ class TableIntrospectResult(BaseModel):
     object_types: Dict[str, ObjectField]
     field_names: List[str]
     primary_keys: List[str]
-    unique_keys: List[str]
+    unique_keys: List[List[str]]
     nullable_keys: List[str]
     field_types: Dict[str, str]
     foreign_keys: Dict[str, ForeignKeyDetail]
@@ -49,8 +53,8 @@ def wrap_nullable(_type: Type, is_not_null: bool, is_primary_key: bool) -> Type:
     return _type if is_not_null else Type(type="nullable", underlying_type=_type)
 
 
-async def introspect_table(table_name: str, client: libsql_client.Client) -> TableIntrospectResult:
-    response = TableIntrospectResult(
+def empty_introspect_result() -> TableIntrospectResult:
+    return TableIntrospectResult(
         object_types={},
         field_names=[],
         primary_keys=[],
@@ -60,39 +64,131 @@ async def introspect_table(table_name: str, client: libsql_client.Client) -> Tab
         foreign_keys={}
     )
 
-    # Execute SQL query to get column details
-    columns_result = await client.execute(f"PRAGMA table_info({table_name})")
-    for column in columns_result.rows:
-        if not isinstance(column['name'], str):
-            raise ValueError("Column name must be string")
-
-        determined_type = determine_type(column['type'])
-        final_type = wrap_nullable(determined_type, column['notnull'] == 1, column['pk'] == 1)
-
-        response.field_names.append(column['name'])
-        if column['pk'] > 0:
-            response.primary_keys.append(column['name'])
-        if column['notnull'] == 0 and column['pk'] == 0:
-            response.nullable_keys.append(column['name'])
-        if determined_type.type == "named":
-            response.field_types[column['name']] = determined_type.name
-        response.object_types[column['name']] = ObjectField(description=None, type=final_type)
-
-    # Introspect for foreign keys
-    foreign_keys_result = await client.execute(f"PRAGMA foreign_key_list({table_name})")
-    for fk in foreign_keys_result.rows:
-        response.foreign_keys[fk['from']] = ForeignKeyDetail(
-            table=fk['table'],
-            column=fk['to']
-        )
-
-    # Introspect for unique keys
-    index_list_result = await client.execute(f"PRAGMA index_list({table_name})")
-    for index in index_list_result.rows:
-        if index['unique']:
-            index_info_result = await client.execute(f"PRAGMA index_info({index['name']})")
-            for col in index_info_result.rows:
-                if col['name'] not in response.unique_keys:
-                    response.unique_keys.append(col['name'])
-
-    return response
+
+def add_column(response: TableIntrospectResult, column) -> None:
+    if not isinstance(column['name'], str):
+        raise ValueError("Column name must be string")
+
+    determined_type = determine_type(column['type'])
+    final_type = wrap_nullable(determined_type, column['notnull'] == 1, column['pk'] == 1)
+
+    response.field_names.append(column['name'])
+    if column['pk'] > 0:
+        response.primary_keys.append(column['name'])
+    if column['notnull'] == 0 and column['pk'] == 0:
+        response.nullable_keys.append(column['name'])
+    if determined_type.type == "named":
+        response.field_types[column['name']] = determined_type.name
+    response.object_types[column['name']] = ObjectField(description=None, type=final_type)
+
+
+def add_foreign_key(response: TableIntrospectResult, fk) -> None:
+    response.foreign_keys[fk['from']] = ForeignKeyDetail(
+        table=fk['table'],
+        column=fk['to']
+    )
+
+
+def add_unique_key(response: TableIntrospectResult, column_names: List[str]) -> None:
+    if column_names and column_names not in response.unique_keys:
+        response.unique_keys.append(column_names)
+
+
+async def introspect_table(table_name: str, client: libsql_client.Client) -> TableIntrospectResult:
+    with span("introspect_table", {"db.system": "sqlite", "ndc_turso.collection": table_name}) as introspect_span:
+        response = empty_introspect_result()
+
+        # Execute SQL query to get column details
+        columns_result = await client.execute(f"PRAGMA table_info({table_name})")
+        for column in columns_result.rows:
+            add_column(response, column)
+
+        # Introspect for foreign keys
+        foreign_keys_result = await client.execute(f"PRAGMA foreign_key_list({table_name})")
+        for fk in foreign_keys_result.rows:
+            add_foreign_key(response, fk)
+
+        # Introspect for unique keys
+        index_list_result = await client.execute(f"PRAGMA index_list({table_name})")
+        statements = 3
+        for index in index_list_result.rows:
+            if index['unique']:
+                index_info_result = await client.execute(f"PRAGMA index_info({index['name']})")
+                statements += 1
+                add_unique_key(response, [col['name'] for col in index_info_result.rows])
+
+        introspect_span.set_attribute("ndc_turso.statements", statements)
+        introspect_span.set_attribute("ndc_turso.columns", len(response.field_names))
+        return response
+
+
+def introspection_statements(table_names: List[str]) -> List[Statement]:
+    # The pragma table-valued functions let one statement cover every table, the tables are passed as a JSON array
+    tables = "SELECT value AS name FROM JSON_EACH(?)"
+    args = [json.dumps(table_names)]
+    return [
+        Statement(f"""
+SELECT t.name AS table_name, c.name, c.type, c."notnull", c.pk
+FROM ({tables}) t JOIN pragma_table_info(t.name) c
+ORDER BY t.name, c.cid
+""", args),
+        Statement(f"""
+SELECT t.name AS table_name, f."from", f."table", f."to"
+FROM ({tables}) t JOIN pragma_foreign_key_list(t.name) f
+ORDER BY t.name, f.id, f.seq
+""", args),
+        Statement(f"""
+SELECT t.name AS table_name, l.name AS index_name, i.name AS column_name
+FROM ({tables}) t JOIN pragma_index_list(t.name) l JOIN pragma_index_info(l.name) i
+WHERE l."unique" = 1
+ORDER BY t.name, l.seq, i.seqno
+""", args),
+    ]
+
+
+async def introspect_tables_batched(table_names: List[str],
+                                    client: libsql_client.Client) -> Dict[str, TableIntrospectResult]:
+    """
+    Introspect every table with three set-based queries sent in a single batch.
+    """
+    with span("introspect_tables_batched", {"db.system": "sqlite", "ndc_turso.tables": len(table_names)}) as \
+            introspect_span:
+        responses = {table_name: empty_introspect_result() for table_name in table_names}
+        statements = introspection_statements(table_names)
+        columns_result, foreign_keys_result, unique_keys_result = await client.batch(statements)
+        for column in columns_result.rows:
+            add_column(responses[column['table_name']], column)
+        for fk in foreign_keys_result.rows:
+            add_foreign_key(responses[fk['table_name']], fk)
+        unique_indexes: Dict[Tuple[str, str], List[str]] = {}
+        for col in unique_keys_result.rows:
+            unique_indexes.setdefault((col['table_name'], col['index_name']), []).append(col['column_name'])
+        for (table_name, _), column_names in unique_indexes.items():
+            add_unique_key(responses[table_name], column_names)
+        introspect_span.set_attribute("ndc_turso.statements", len(statements))
+        introspect_span.set_attribute("ndc_turso.columns", len(columns_result.rows))
+        return responses
+
+
+async def introspect_tables(table_names: List[str],
+                            client: libsql_client.Client,
+                            concurrency: int = 8) -> Dict[str, TableIntrospectResult]:
+    """
+    Introspect the given tables, preferring the batched set-based queries.
+
+    Servers without the pragma table-valued functions fall back to per-table introspection with at most
+    `concurrency` tables in flight.
+    """
+    try:
+        return await introspect_tables_batched(table_names, client)
+    except libsql_client.LibsqlError as e:
+        print(f"Batched introspection failed, introspecting tables one by one: {e}")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def introspect_bounded(table_name: str) -> TableIntrospectResult:
+        async with semaphore:
+            return await introspect_table(table_name, client)
+
+    results = await asyncio.gather(*[introspect_bounded(table_name) for table_name in table_names])
+    return dict(zip(table_names, results))